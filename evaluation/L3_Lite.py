@@ -1,10 +1,26 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, AutoModelForSeq2SeqLM
+from __future__ import annotations # Annotations mention torch types without importing torch
 import numpy as np
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, NamedTuple, Callable
 import os
 import re
+from decimal import Decimal
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm # Import tqdm library
+import hashlib
+from lazy_import import LazyModule
+from score_cache import ScoreCache, weights_fingerprint, weights_size, sample_key
+from result_io import iter_chunks, DEFAULT_CHUNK_SIZE
+from prompt_tokens import PROMPT_PREFIX, PromptTokenizerRegistry, build_prompt
+from metrics import StageMetrics
+from judge_backends import BACKENDS, DEFAULT_ONNX_DIR, JudgeBackend, TransformersBackend, OnnxBackend, judge_graph_dir
+
+# torch and transformers are imported when a model is first needed, so that runs answered entirely
+# from the score cache or by exact matches start without paying seconds for the imports
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
 
 # Local model paths
 MODEL_PATHS = {
@@ -12,15 +28,220 @@ MODEL_PATHS = {
     'DeepSeek-R1-Distill-Qwen-1.5B': "llm_weights/DeepSeek-R1-Distill-Qwen-1.5B",
 }
 
+# Model weight dtypes (names of torch dtypes), selected with the dtype policy of L3Lite ('auto' picks one of these per device)
+DTYPES = {
+    'fp32': 'float32',
+    'bf16': 'bfloat16',
+    'fp16': 'float16',
+}
+DTYPE_POLICIES = ('auto',) + tuple(DTYPES)
+
+# Supported scoring modes:
+#   'logits'   - one forward pass over the prompt, read the next-token distribution at the last position,
+#                and only call model.generate when neither ' 1' nor ' 0' is a plausible first token.
+#   'generate' - the original path: always generate up to 20 tokens and use the scores of the first step.
+SCORING_MODES = ('logits', 'generate')
+
+# If p(' 1') + p(' 0') for the first answer token is below this, the answer is parsed from generated text instead
+FALLBACK_PROB_THRESHOLD = 1e-3
+
+# Constrained fallback decoding only lets the model write a number between 0.00 and 1.00 (with an optional
+# leading space and at most two decimals), so it stops after a handful of steps instead of generating 20 free tokens
+NUMERIC_ANSWER_PREFIX = re.compile(r' ?(?:0(?:\.\d{0,2})?|1(?:\.0{0,2})?)?') # Texts that can still become a valid number
+NUMERIC_ANSWER = re.compile(r' ?(?:0(?:\.\d{1,2})?|1(?:\.0{1,2})?)') # Complete numbers
+NUMERIC_ANSWER_FINAL = re.compile(r' ?(?:0\.\d\d|1\.00)') # Numbers that cannot be extended any further
+NUMERIC_TOKEN_CHARS = set("0123456789. ")
+MAX_NUMERIC_STEPS = 6 # Longest answer: ' 0.xx' is 5 characters, plus end of sequence
+
+# Default budget of padded tokens (batch size x longest prompt) per forward pass in batched scoring
+DEFAULT_MAX_BATCH_TOKENS = 4096
+
+
+class ModelScore(NamedTuple):
+    """Scores one judge model gave one sample."""
+    score_one: float # Probability of ' 1' (similar), as a percentage
+    score_zero: float # Probability of ' 0' (dissimilar), as a percentage
+    fallback: bool = False # True if the score was parsed from generated text instead of the first-token probabilities
+
+
+# Score of samples a model could not evaluate
+ZERO_SCORE = ModelScore(0.0, 0.0)
+
+# Number words that are normalized to digits before exact-match comparison
+NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7',
+    'eight': '8', 'nine': '9', 'ten': '10', 'eleven': '11', 'twelve': '12', 'thirteen': '13', 'fourteen': '14',
+    'fifteen': '15', 'sixteen': '16', 'seventeen': '17', 'eighteen': '18', 'nineteen': '19', 'twenty': '20',
+    'thirty': '30', 'forty': '40', 'fifty': '50', 'sixty': '60', 'seventy': '70', 'eighty': '80', 'ninety': '90',
+}
+
+
+def normalize_answer(answer) -> str:
+    """
+    Normalize an answer for exact-match comparison.
+
+    Lowercases, drops punctuation (except decimal points inside numbers and minus signs), collapses
+    whitespace, and writes numbers as digits ("Two" -> "2", "2.0" -> "2", "-3.50" -> "-3.5") without
+    rounding them.
+    """
+    text = str(answer).lower() if answer is not None else ""
+    # Remove punctuation unless it sits between two digits (e.g. "2.5") or is a minus sign (e.g. "-3")
+    text = re.sub(r'(?<!\d)(?!-\d)[^\w\s]|[^\w\s](?!\d)', ' ', text)
+    tokens = []
+    for token in text.split():
+        token = NUMBER_WORDS.get(token, token)
+        if re.fullmatch(r'-?\d+(\.\d+)?', token):
+            # Decimal keeps every digit (float formatting would round to six), normalize() drops trailing zeros
+            number = Decimal(token).normalize()
+            token = "0" if number == 0 else f"{number:f}"
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+def is_exact_match(pred, gt) -> bool:
+    """True if the prediction equals the ground truth after normalize_answer (and is not empty)."""
+    normalized_gt = normalize_answer(gt)
+    return normalized_gt != "" and normalize_answer(pred) == normalized_gt
+
+
+def cpu_supports_fast_bf16() -> bool:
+    """True if the CPU has native bfloat16 matmul instructions (AVX512-BF16 or AMX)."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def resolve_dtype(policy: str, device: str) -> str:
+    """
+    Pick the model dtype for a device, as a key of DTYPES.
+
+    'auto' keeps float16 on CUDA, and on CPU uses bfloat16 where the CPU computes it natively and
+    float32 otherwise (CPU float16 matmuls are emulated and slow). Other policies force a dtype.
+    """
+    if policy not in DTYPE_POLICIES:
+        raise ValueError(f"Unknown dtype policy: {policy}, expected one of {DTYPE_POLICIES}")
+    if policy != 'auto':
+        return policy
+    if "cuda" in device:
+        return 'fp16'
+    return 'bf16' if cpu_supports_fast_bf16() else 'fp32'
+
+
+def split_thread_budget(total_threads: int, weights: List[float]) -> List[int]:
+    """
+    Split total_threads between jobs in proportion to their weights (e.g. model sizes),
+    so that the jobs finish at roughly the same time. Every job gets at least one thread.
+    """
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        weights = [1.0] * len(weights)
+        total_weight = float(len(weights))
+    budgets = [max(1, int(total_threads * weight / total_weight)) for weight in weights]
+    # Hand out threads lost to rounding, largest jobs first
+    for i in sorted(range(len(weights)), key=lambda i: weights[i], reverse=True):
+        if sum(budgets) >= total_threads:
+            break
+        budgets[i] += 1
+    return budgets
+
+
+def make_length_buckets(lengths: List[int], max_batch_tokens: int) -> List[List[int]]:
+    """
+    Group sample indices into batches of similar token length.
+
+    Indices are sorted by length and packed greedily so that every padded batch
+    (batch size x longest sequence) stays within max_batch_tokens.
+    A sequence longer than the budget gets a batch of its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    for idx in order:
+        # Lengths are sorted, so the new sample is always the longest one in the batch
+        if current and (len(current) + 1) * lengths[idx] > max_batch_tokens:
+            batches.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
 class L3Lite:
-    def __init__(self, model_names: Optional[List[str]] = None, device: str = "cuda"):
+    def __init__(self, model_names: Optional[List[str]] = None, device: str = "cuda", scoring_mode: str = "logits",
+                 max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS, use_prefix_cache: bool = True,
+                 cache_path: Optional[str] = None, exact_match_shortcut: bool = False, verbose: bool = True,
+                 concurrent_models: bool = False, dtype: str = "auto", quantize: bool = False,
+                 metrics: bool = False, metrics_callback: Optional[Callable[[Dict], None]] = None,
+                 constrained_fallback: bool = True, cascade_threshold: Optional[float] = None,
+                 model_registry: Optional[Dict[str, str]] = None, ram_budget_mb: Optional[float] = None,
+                 backend: str = "transformers", onnx_dir: Optional[str] = None):
         """
         Initialize the L3Lite evaluator.
 
+        Models are not loaded here but on the first call that has samples for them to score (or by load_models()).
+
         Args:
-            model_names: List of model names to use. If None, all available models will be used.
+            model_names: List of model names to use. If None, all models of the registry will be used.
             device: The device to run the models on.
+            scoring_mode: 'logits' (single forward pass, generate only as a fallback) or 'generate' (always generate).
+            max_batch_tokens: Budget of padded tokens per batch in 'logits' mode. 1 disables batching.
+            use_prefix_cache: In 'logits' mode, compute the key/values of the fixed prompt prefix once per model
+                and only run the question/answer/ground-truth part of each prompt through the model.
+            cache_path: Path of a persistent score cache (SQLite file). Samples already scored by the same
+                model weights and prompt template are read from it instead of being evaluated again.
+            exact_match_shortcut: Score predictions that equal the ground truth after normalize_answer as 100
+                without running the models.
+            verbose: Show progress bars and per-call summaries while evaluating.
+            concurrent_models: Run the ensemble members at the same time on separate threads, splitting the
+                torch thread budget between them in proportion to their sizes, instead of one after another.
+            dtype: Weight dtype policy, 'auto' (fastest supported dtype for the device, see resolve_dtype),
+                'fp32', 'bf16' or 'fp16'.
+            quantize: On CPU, load the models in float32 and apply int8 dynamic quantization to their Linear layers.
+            metrics: Collect per-stage timings and counters (see get_metrics). On CUDA, stages wait for the device
+                so that their timings are accurate, which costs some throughput.
+            metrics_callback: Called with get_metrics() after every evaluate call; implies metrics.
+            constrained_fallback: In 'logits' mode, when neither ' 1' nor ' 0' is a plausible first token, decode the
+                answer batched and constrained to a number in [0.00, 1.00] (at most MAX_NUMERIC_STEPS steps) instead of
+                generating 20 free tokens and searching them for a number.
+            cascade_threshold: Run the ensemble as a cascade, smallest model first (see cascade_order): a sample is
+                only passed on to the next model if the current one's p_one and p_zero both stay below this
+                threshold (or its score was parsed from generated text). Accepted samples are scored by the models
+                that ran on them. None runs every model on every sample. Takes precedence over concurrent_models.
+            model_registry: {model name: model path} of the available models (see model_registry.load_model_registry);
+                MODEL_PATHS if None.
+            ram_budget_mb: Memory the loaded models' weights may take together. Before a model is loaded, the least
+                recently used models are evicted until it fits; evicted models are loaded again on their next use.
+                A model larger than the budget on its own is still loaded. None keeps every model once loaded.
+                Disables concurrent_models, which needs all models resident at once.
+            backend: What runs the models (see judge_backends.py): 'transformers' (PyTorch, any device) or 'onnx'
+                (ONNX Runtime on CPU, float32 or with quantize int8, from graphs exported on first use).
+            onnx_dir: Directory of the exported graphs of the 'onnx' backend; DEFAULT_ONNX_DIR if None.
         """
+        start_time = time.perf_counter()
+        if scoring_mode not in SCORING_MODES:
+            raise ValueError(f"Unknown scoring mode: {scoring_mode}, expected one of {SCORING_MODES}")
+        self.scoring_mode = scoring_mode
+        self.max_batch_tokens = max_batch_tokens
+        self.use_prefix_cache = use_prefix_cache
+        self.exact_match_shortcut = exact_match_shortcut
+        self.verbose = verbose
+        if ram_budget_mb is not None and concurrent_models:
+            print("Warning: concurrent_models needs every model resident at once and is disabled by the RAM budget.")
+            concurrent_models = False
+        self.concurrent_models = concurrent_models
+        self.constrained_fallback = constrained_fallback and scoring_mode == "logits"
+        if cascade_threshold is not None and not 0.5 <= cascade_threshold <= 1.0:
+            raise ValueError(f"cascade_threshold must be between 0.5 and 1.0, got {cascade_threshold}")
+        self.cascade_threshold = cascade_threshold
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+        self.backend_name = backend
+        self.onnx_dir = onnx_dir if onnx_dir is not None else DEFAULT_ONNX_DIR
+
         # Check if CUDA is available
         if "cuda" in device:
             if not torch.cuda.is_available():
@@ -30,108 +251,223 @@ class L3Lite:
                  self.device = device
         else:
              self.device = device # Use the specified non-CUDA device
+        if backend == "onnx" and self.device != "cpu":
+            print(f"Warning: The onnx backend runs on CPU, not on {self.device}. Will use CPU.")
+            self.device = "cpu"
+
+        # int8 dynamic quantization runs on CPU only and starts from float32 weights
+        if quantize and self.device != "cpu":
+            print(f"Warning: int8 dynamic quantization is only supported on CPU, not on {self.device}. Quantization disabled.")
+            quantize = False
+        self.quantize = quantize
+        # Exported graphs are float32 (int8 with quantize), whatever the dtype policy
+        if backend == "onnx" and dtype not in ('auto', 'fp32'):
+            print(f"Warning: The onnx backend runs float32 graphs, dtype {dtype} is ignored.")
+        self.dtype_name = 'fp32' if quantize or backend == "onnx" else resolve_dtype(dtype, self.device)
+        print(f"Using dtype {self.dtype_name} on {self.device}{' with int8 dynamic quantization' if quantize else ''}"
+              f"{' (ONNX Runtime)' if backend == 'onnx' else ''}.")
+
+        # Per-stage timers and counters; free when disabled
+        self.metrics = StageMetrics(enabled=metrics or metrics_callback is not None, callback=metrics_callback)
+        self.stage_sync = (lambda: torch.cuda.synchronize(self.device)) if "cuda" in self.device else None
 
-        self.models = {}
+        self.backends: Dict[str, JudgeBackend] = {} # Loaded models, filled on first use (see _ensure_loaded)
         self.tokenizers = {}
+        self.model_paths = {}
+        self.model_sizes = {}
+        self.binary_ids = {} # Cache 1/0 token ids for each model
+        self.prompt_tokenizers = {} # Assembles prompt token ids from pre-tokenized pieces, see prompt_tokens.py
+        self.numeric_vocabularies = {} # (token id, text) of every token that can be part of a number, per model
+        self.batch_failures: Dict[str, int] = {} # Batches per model that failed and were retried sample by sample
+        self.prompt_tokenizer_registry = PromptTokenizerRegistry()
+        self.score_cache = ScoreCache(cache_path) if cache_path else None
+
+        # Model pool: resident size of every loaded model's weights and when it was last used, for LRU eviction
+        self.ram_budget = int(ram_budget_mb * 1024 * 1024) if ram_budget_mb is not None else None
+        self.resident_sizes = {}
+        self.last_used = {}
 
         # If no models are specified, use all available models
+        self.model_registry = model_registry if model_registry is not None else MODEL_PATHS
         if model_names is None:
-            model_names = list(MODEL_PATHS.keys())
+            model_names = list(self.model_registry.keys())
 
-        # Load models and tokenizers
+        # Models whose weights exist; they are loaded the first time a sample needs them, so runs answered
+        # from the score cache or by exact matches never load them
+        self.model_names = []
         for model_name in model_names:
-            if model_name not in MODEL_PATHS:
+            if model_name not in self.model_registry:
                 print(f"Warning: Unknown model: {model_name}, skipping loading.")
                 continue # Skip unknown model
 
-            model_path = MODEL_PATHS[model_name]
+            model_path = self.model_registry[model_name]
             # Check if model path exists
             if not os.path.exists(model_path):
                  print(f"Warning: Model path not found: {model_path}, skipping loading model {model_name}.")
                  continue # Skip model if path does not exist
 
-            print(f"Loading model: {model_name} from {model_path}")
+            self.model_names.append(model_name)
+            self.model_paths[model_name] = model_path
+            # Size of the weight files, used to split threads between concurrently running models
+            self.model_sizes[model_name] = weights_size(model_path)
+
+        if not self.model_names:
+             print("Warning: No models were found. L3-Lite will not be able to perform evaluation.")
+
+        self.load_locks = {model_name: threading.Lock() for model_name in self.model_names}
+        self.loaded_models = set() # Models that are fully loaded, with token ids and prefix cache
+
+        self.created_at = time.perf_counter()
+        self.startup_seconds = self.created_at - start_time
+        self.first_score_seconds = None # Time from the end of __init__ to the first returned score
+        print(f"L3-Lite started in {self.startup_seconds:.2f}s, {len(self.model_names)} model(s) will be loaded on first use.")
+
+
+    @property
+    def torch_dtype(self):
+        """torch dtype the models are loaded in."""
+        return getattr(torch, DTYPES[self.dtype_name])
+
+
+    def get_metrics(self) -> Dict:
+        """Cumulative per-stage timings and counters, see metrics.StageMetrics.snapshot (empty unless metrics is enabled)."""
+        return self.metrics.snapshot()
+
+
+    def load_models(self):
+        """
+        Load every model now instead of on first use, e.g. before serving requests.
+        With a RAM budget, models that do not fit next to the ones loaded before them are left for first use.
+        """
+        for model_name in list(self.model_names):
+            if self.ram_budget is not None and self.loaded_models and \
+                    sum(self.resident_sizes.values()) + self._estimated_size(model_name) > self.ram_budget:
+                continue
+            self._ensure_loaded(model_name)
+
+
+    def _ensure_loaded(self, model_name: str) -> bool:
+        """Load a model on first use. Returns False if the model is unknown or failed to load."""
+        self.last_used[model_name] = time.perf_counter()
+        if model_name in self.loaded_models:
+            return True
+        if model_name not in self.load_locks:
+            return False
+        with self.load_locks[model_name]:
+            if model_name in self.loaded_models:
+                return True
+            if model_name not in self.model_names: # An earlier attempt failed
+                return False
+            if self.ram_budget is not None:
+                self._make_room(model_name, self._estimated_size(model_name))
+            with self.metrics.stage("load"):
+                loaded = self._load_model(model_name)
+            if loaded:
+                self.resident_sizes[model_name] = self.backends[model_name].resident_size()
+                self.loaded_models.add(model_name)
+                if self.ram_budget is not None:
+                    # The estimate may have been off (e.g. weights stored in another dtype), check the actual size
+                    self._make_room(model_name, 0)
+                return True
+            # Like a model that fails to load at startup, it no longer takes part in the ensemble
+            self.model_names.remove(model_name)
+            return False
 
-            try:
-                self.tokenizers[model_name] = AutoTokenizer.from_pretrained(model_path)
 
+    def _estimated_size(self, model_name: str) -> int:
+        """Resident size of a model before loading it: its size when it was last loaded, else its weight files."""
+        return self.resident_sizes.get(model_name, self.model_sizes.get(model_name, 0))
+
+
+    def _make_room(self, model_name: str, size: int):
+        """Evict the least recently used other models until size more bytes fit in the RAM budget."""
+        others = sorted((name for name in self.loaded_models if name != model_name), key=lambda name: self.last_used.get(name, 0.0))
+        for victim in others:
+            if sum(self.resident_sizes.values()) + size <= self.ram_budget:
+                break
+            self.evict_model(victim)
+        if sum(self.resident_sizes.values()) + size > self.ram_budget:
+            print(f"Warning: Model {model_name} does not fit in the RAM budget of {self.ram_budget / 2**20:.0f} MiB "
+                  f"({(sum(self.resident_sizes.values()) + size) / 2**20:.0f} MiB needed), loading it anyway.")
+
+
+    def evict_model(self, model_name: str):
+        """Free a loaded model's weights and prefix cache; it is loaded again on its next use."""
+        if model_name not in self.loaded_models:
+            return
+        self.loaded_models.discard(model_name)
+        self.backends.pop(model_name, None)
+        size = self.resident_sizes.pop(model_name, 0)
+        gc.collect()
+        if "cuda" in self.device:
+            torch.cuda.empty_cache()
+        self.metrics.count("evictions")
+        print(f"Evicted model {model_name} ({size / 2**20:.0f} MiB).")
+
+
+    def _load_model(self, model_name: str) -> bool:
+        """Load a model and its tokenizer, look up its 1/0 token ids and build its prefix cache."""
+        model_path = self.model_paths[model_name]
+        print(f"Loading model: {model_name} from {model_path}")
+        load_start = time.perf_counter()
+
+        try:
+            tokenizer = transformers.AutoTokenizer.from_pretrained(model_path)
+            if self.backend_name == "onnx":
+                # The prefix cache of the onnx backend is a graph of its own, which then runs nearly every prompt
+                backend = OnnxBackend(model_path, tokenizer, judge_graph_dir(self.onnx_dir, model_name, model_path),
+                                      quantize=self.quantize, defer_full_graph=self.scoring_mode == "logits" and self.use_prefix_cache,
+                                      metrics=self.metrics)
+            else:
                 # Determine model type and load corresponding class
-                if model_name in ['flan-t5-small', 'flan-t5-large', 'flan-t5-xl']:
-                    self.models[model_name] = AutoModelForSeq2SeqLM.from_pretrained(
-                        model_path,
-                        torch_dtype=torch.float16,
-                        device_map=self.device # Use self.device
-                    )
-                else: # Assume other models are CausalLM
-                    self.models[model_name] = AutoModelForCausalLM.from_pretrained(
-                        model_path,
-                        torch_dtype=torch.float16,
-                        device_map=self.device # Use self.device
-                    )
-
-                # Ensure model is loaded to the correct device
-                if self.device != 'cpu' and hasattr(self.models[model_name], 'to'):
-                     self.models[model_name].to(self.device)
-                self.models[model_name].eval() # Set to evaluation mode
-
-            except Exception as e:
-                 print(f"Error loading model {model_name}: {e}, skipping this model.")
-                 # If loading fails, remove from loaded dictionaries (if partially loaded)
-                 self.models.pop(model_name, None)
-                 self.tokenizers.pop(model_name, None)
-                 continue # Skip loading current model
-
-        # Cache 1/0 token ids for each model
-        self.binary_ids = {}
-        if not self.models:
-             print("Warning: No models were loaded successfully. L3-Lite will not be able to perform evaluation.")
-
-        for model_name, tokenizer in self.tokenizers.items():
-             try:
-                # Use a leading space to get independent tokens for words
-                one_ids = tokenizer.encode(" 1", add_special_tokens=False)
-                zero_ids = tokenizer.encode(" 0", add_special_tokens=False)
-
-                # Check if encoding result is empty
-                if not one_ids or not zero_ids:
-                     print(f"Warning: Model {model_name} could not encode ' 1' or ' 0' as independent tokens. This model may not be usable for L3-Lite.")
-                     # If encoding fails, mark the model as unusable or remove it
-                     self.models.pop(model_name, None)
-                     self.tokenizers.pop(model_name, None)
-                     continue # Skip current model
-
-                # Use the last token as the token id for 1/0
-                self.binary_ids[model_name] = {
-                    "one": one_ids[-1],
-                    "zero": zero_ids[-1]
-                }
-
-                print(f"Model {model_name} ' 1' token id: {self.binary_ids[model_name]['one']}")
-                print(f"Model {model_name} ' 0' token id: {self.binary_ids[model_name]['zero']}")
-
-             except Exception as e:
-                 print(f"Error processing token ids for model {model_name}: {e}, skipping this model.")
-                 self.models.pop(model_name, None)
-                 self.tokenizers.pop(model_name, None)
-                 continue
-
-
-        if not self.models:
-             print("Error: No models available for L3-Lite evaluation.")
+                backend = TransformersBackend(model_path, tokenizer, self.device, self.torch_dtype, quantize=self.quantize,
+                                              seq2seq=model_name in ['flan-t5-small', 'flan-t5-large', 'flan-t5-xl'],
+                                              metrics=self.metrics, stage_sync=self.stage_sync)
+        except Exception as e:
+             print(f"Error loading model {model_name}: {e}, skipping this model.")
+             return False # Skip loading current model
+
+        try:
+            # Use a leading space to get independent tokens for words
+            one_ids = tokenizer.encode(" 1", add_special_tokens=False)
+            zero_ids = tokenizer.encode(" 0", add_special_tokens=False)
+
+            # Check if encoding result is empty
+            if not one_ids or not zero_ids:
+                 print(f"Warning: Model {model_name} could not encode ' 1' or ' 0' as independent tokens. This model may not be usable for L3-Lite.")
+                 return False # Mark the model as unusable
+
+            # Use the last token as the token id for 1/0
+            self.binary_ids[model_name] = {
+                "one": one_ids[-1],
+                "zero": zero_ids[-1]
+            }
+
+            print(f"Model {model_name} ' 1' token id: {self.binary_ids[model_name]['one']}")
+            print(f"Model {model_name} ' 0' token id: {self.binary_ids[model_name]['zero']}")
+
+            # Prefix/suffix token ids are computed once; field pieces are shared with models of the same tokenizer family
+            self.prompt_tokenizers[model_name] = self.prompt_tokenizer_registry.create(tokenizer)
+            if not self.prompt_tokenizers[model_name].enabled:
+                print(f"Warning: Model {model_name} does not tokenize prompt pieces independently, full prompts will be tokenized.")
+
+        except Exception as e:
+             print(f"Error processing token ids for model {model_name}: {e}, skipping this model.")
+             return False
+
+        self.tokenizers[model_name] = tokenizer
+        self.backends[model_name] = backend
+
+        if self.scoring_mode == "logits" and self.use_prefix_cache:
+            self._build_prefix_cache(model_name)
+
+        print(f"Loaded model {model_name} in {time.perf_counter() - load_start:.2f}s ({backend.resident_size() / 2**20:.0f} MiB).")
+        return True
 
 
     def create_prompt(self, qst: str, pred: str, gt: str) -> str:
         """Creates a prompt to evaluate the semantic similarity of two answers."""
-        # Basic cleaning of inputs to prevent errors from None or non-string types
-        qst_str = str(qst) if qst is not None else ""
-        pred_str = str(pred) if pred is not None else ""
-        gt_str = str(gt) if gt is not None else ""
-
-        return f"""I'm evaluating for open QA and need your assistance in determining the answers. The questions, predicted answers and ground truths are as follows. Please determine if the following two answers have the same semantic meaning:\n\
-Question:{qst_str}\n\
-Answer: {pred_str}\n\
-Grount truth: {gt_str}\n\
-Please use the questions as background information, provide a similarity score between 0.00 and 1.00, where 1.00 means the answers are completely semantically equivalent, and 0.00 means they are completely different. If the answers are similar, related, or have a contain and be contained relationship, provide a decimal score between 0.00 and 1.00 . Answer with only the number, without any explanation. Your answer : """
+        return build_prompt(qst, pred, gt)
 
 
     def evaluate_single_model(self, model_name: str, qst:str, pred: str, gt: str) -> Tuple[float, float]:
@@ -141,97 +477,296 @@ Please use the questions as background information, provide a similarity score b
         Returns:
             (score_one, score_zero): Probability scores for 1 (similar) and 0 (dissimilar) (converted to percentage).
         """
-        if model_name not in self.models:
+        score = self._score_single_sample(model_name, qst, pred, gt)
+        return score.score_one, score.score_zero
+
+
+    def _score_single_sample(self, model_name: str, qst: str, pred: str, gt: str) -> ModelScore:
+        """evaluate_single_model, also reporting whether the score came from the generated-text fallback."""
+        if not self._ensure_loaded(model_name):
              #print(f"Warning: Model {model_name} is not available, cannot evaluate.")
-             return 0.0, 0.0 # Return 0 scores if model is not available
+             return ZERO_SCORE # Return 0 scores if model is not available
 
-        model = self.models[model_name]
         tokenizer = self.tokenizers[model_name]
         # Check if binary_ids exist
         if model_name not in self.binary_ids:
              #print(f"Warning: binary_ids for model {model_name} are not available, cannot evaluate.")
-             return 0.0, 0.0
+             return ZERO_SCORE
 
         one_id = self.binary_ids[model_name]["one"]
         zero_id = self.binary_ids[model_name]["zero"]
 
-        prompt = self.create_prompt(qst, pred, gt)
-        # print(f"prompt: {prompt}")
-
         try:
+            # Same token ids as tokenizing create_prompt(qst, pred, gt), assembled from pre-tokenized pieces
+            with self.metrics.stage("tokenize"):
+                ids = self.prompt_tokenizers[model_name].encode([qst], [pred], [gt])[0]
+            self.metrics.count("prompt_tokens", len(ids))
             # Ensure input_ids are not empty
-            inputs = tokenizer(prompt, return_tensors="pt")
-            if inputs.input_ids.shape[1] == 0:
+            if not ids:
                  print(f"Warning: Model {model_name} could not encode the prompt.")
-                 return 0.0, 0.0
-
-            inputs = inputs.to(self.device)
-
-            # Generate at most 20 tokens
-            # Set max_new_tokens a bit larger to prevent the model generating extra tokens that affect number extraction
-            # Could also consider setting num_beams=1 and do_sample=False for greedy search
-            with torch.no_grad():
-                outputs = model.generate(
-                    **inputs,
-                    max_new_tokens=20,
-                    return_dict_in_generate=True,
-                    output_scores=True, # Need output_scores to calculate probabilities
-                    pad_token_id=tokenizer.eos_token_id,
-                    num_beams=1, # Typically used for generation, L3-Lite's original logic might require this
-                    do_sample=False, # Disable sampling, use Greedy Search or Beam Search
-                    generation_config=model.generation_config if hasattr(model, 'generation_config') else None # Use model's default generation config
-                )
-
-            # Get generated token ids and corresponding scores (log probability)
-            # scores is a tuple of tensors, scores[i] are the scores for the i-th generated token
-            # generated_ids is the sequence of generated token ids
-            generated_ids = outputs.sequences[0, inputs.input_ids.shape[1]:]
-            # token_scores are the logits when generating each token
-            # Convert logits to probabilities and take the probability of the token at the first time step
-            # (usually the model's first generated token is 0 or 1)
-            if not outputs.scores:
-                 # print(f"Warning: Model {model_name} did not return scores.")
-                 return 0.0, 0.0 # Cannot calculate probability if no scores
-
-            # Theoretically, L3-Lite's logic is to look at the probability of the first generated token
-            first_token_logits = outputs.scores[0][0] # Logits for the first generated token, batch size = 1
-            first_token_probs = torch.softmax(first_token_logits, dim=-1)
-
-            p_one = first_token_probs[one_id].item() if one_id < first_token_probs.size(0) else 0.0 # Check boundary
-            p_zero = first_token_probs[zero_id].item() if zero_id < first_token_probs.size(0) else 0.0 # Check boundary
+                 return ZERO_SCORE
+
+            backend = self.backends[model_name]
+            generated_ids = None
+            if self.scoring_mode == "logits":
+                # A single forward pass gives the same distribution as the first step of generate(),
+                # without paying for the remaining decode steps that L3-Lite never looks at
+                first_token_logits = backend.next_token_logits([ids])[0]
+            else:
+                first_token_logits, generated_ids = backend.generate(ids)
+                if first_token_logits is None:
+                     # print(f"Warning: Model {model_name} did not return scores.")
+                     return ZERO_SCORE # Cannot calculate probability if no scores
+                # Theoretically, L3-Lite's logic is to look at the probability of the first generated token
+
+            with self.metrics.stage("softmax", self.stage_sync):
+                first_token_probs = torch.softmax(first_token_logits, dim=-1)
+
+            with self.metrics.stage("host_transfer"):
+                p_one = first_token_probs[one_id].item() if one_id < first_token_probs.size(0) else 0.0 # Check boundary
+                p_zero = first_token_probs[zero_id].item() if zero_id < first_token_probs.size(0) else 0.0 # Check boundary
 
             # If the sum of probabilities for 1 and 0 is very small, the model might have generated other starting tokens
             # In this case, fall back to trying to parse numbers from the generated text
-            if p_one + p_zero < 1e-3: # Set a threshold to determine if it's a valid 0/1 start
+            if p_one + p_zero < FALLBACK_PROB_THRESHOLD: # Set a threshold to determine if it's a valid 0/1 start
                 # print(f"Warning: Model {model_name} did not generate ' 1' or ' 0' as the first token, trying to parse number.")
+                if generated_ids is None and self.constrained_fallback:
+                    return self._constrained_fallback_scores(model_name, [ids])[0]
+                if generated_ids is None: # Logit-only mode only generates for these samples
+                    _, generated_ids = backend.generate(ids)
                 generated_text = tokenizer.decode(generated_ids, skip_special_tokens=True)
-                match = re.search(r'(\d+\.?\d*)', generated_text.strip())
-                if match:
-                    score = float(match.group(1))
-                    score = max(0.0, min(1.0, score)) # Ensure score is between 0-1
-                    return score * 100, (1.0 - score) * 100 # Convert to percentage
-                else:
-                     # print(f"Warning: No number found in model {model_name}'s generated text, and it didn't start with 0/1.")
-                     return 0.0, 0.0 # Cannot parse, return 0 score
-
-            # Normalize probabilities of 1 and 0 (if they are the first token)
-            total_prob = p_one + p_zero
-            if total_prob > 0:
-                 score_one = p_one / total_prob
-                 score_zero = p_zero / total_prob
-            else: # Both p_one and p_zero are zero
-                 score_one = 0.0
-                 score_zero = 0.0 # This case is unlikely if the previous p_one + p_zero < 1e-3 check didn't catch it.
-
-            return score_one * 100, score_zero * 100 # Convert to percentage
+                return self._fallback_from_text(generated_text)
+
+            return self._binary_scores(p_one, p_zero)
 
 
         except Exception as e:
             # print(f"Warning: Error evaluating sample with model {model_name}: {e}")
-            return 0.0, 0.0 # Return 0 score on error
+            self.metrics.count("exceptions")
+            return ZERO_SCORE # Return 0 score on error
 
 
-    def evaluate(self, qst: List[str], preds: List[str], gts: List[str]) -> List[float]:
+    def evaluate_model(self, model_name: str, qst: List[str], preds: List[str], gts: List[str],
+                       token_memo: Optional[Dict] = None) -> List[ModelScore]:
+        """
+        Evaluate all samples with a single model.
+
+        In 'logits' mode the prompts are tokenized together, sorted by token length and scored in
+        left-padded batches of at most max_batch_tokens tokens, one forward pass per batch.
+        In 'generate' mode every sample goes through evaluate_single_model.
+        token_memo lets models of the same tokenizer family reuse each other's tokenization (see PromptTokenizer.encode).
+
+        Returns:
+            List of ModelScore (score_one, score_zero percentages and fallback flag), in the same order as the inputs.
+        """
+        if not self._ensure_loaded(model_name) or model_name not in self.binary_ids:
+             return [ZERO_SCORE] * len(preds)
+
+        if self.scoring_mode != "logits":
+            return [self._score_single_sample(model_name, qst_item, pred_item, gt_item)
+                    for qst_item, pred_item, gt_item in tqdm(zip(qst, preds, gts), total=len(preds), desc=f"Evaluating samples ({model_name})", disable=not self.verbose)]
+
+        with self.metrics.stage("tokenize"):
+            encoded = self.prompt_tokenizers[model_name].encode(qst, preds, gts, token_memo)
+        self.metrics.count("prompt_tokens", sum(len(ids) for ids in encoded))
+
+        results = [ZERO_SCORE] * len(encoded) # Prompts that could not be encoded keep a 0 score
+        valid = [i for i, ids in enumerate(encoded) if len(ids) > 0]
+        buckets = make_length_buckets([len(encoded[i]) for i in valid], self.max_batch_tokens)
+
+        with tqdm(total=len(encoded), desc=f"Evaluating samples ({model_name})", disable=not self.verbose) as progress:
+            for bucket in buckets:
+                batch = [valid[i] for i in bucket]
+                try:
+                    batch_scores = self._score_token_batch(model_name, [encoded[i] for i in batch])
+                except Exception as e:
+                    # Retry one sample at a time so that a failing sample only costs its own score
+                    self.metrics.count("batch_retries")
+                    self.batch_failures[model_name] = self.batch_failures.get(model_name, 0) + 1
+                    if self.batch_failures[model_name] == 1: # A systematic failure would otherwise print once per batch
+                        print(f"Warning: A batch of {len(batch)} samples failed with model {model_name} ({type(e).__name__}: {e}); "
+                              f"scoring its samples one at a time. Further failures are counted in batch_failures.")
+                    batch_scores = [self._score_single_sample(model_name, qst[i], preds[i], gts[i]) for i in batch]
+                for i, sample_scores in zip(batch, batch_scores):
+                    results[i] = sample_scores
+                progress.update(len(batch))
+            progress.update(len(encoded) - len(valid))
+
+        return results
+
+
+    def _score_token_batch(self, model_name: str, batch_ids: List[List[int]]) -> List[ModelScore]:
+        """Score a batch of tokenized prompts with one forward pass."""
+        one_id = self.binary_ids[model_name]["one"]
+        zero_id = self.binary_ids[model_name]["zero"]
+
+        # With a prefix cache, only the part of the prompts after the cached prefix is padded and run through the model
+        logits = self.backends[model_name].next_token_logits(batch_ids)
+        with self.metrics.stage("softmax", self.stage_sync):
+            probs = torch.softmax(logits, dim=-1)
+
+        # Move the two columns to the host at once instead of one .item() per sample
+        with self.metrics.stage("host_transfer"):
+            vocab_size = probs.size(-1)
+            p_ones = probs[:, one_id].tolist() if one_id < vocab_size else [0.0] * len(batch_ids) # Check boundary
+            p_zeros = probs[:, zero_id].tolist() if zero_id < vocab_size else [0.0] * len(batch_ids) # Check boundary
+
+        batch_scores = []
+        fallback_rows = []
+        for row, (ids, p_one, p_zero) in enumerate(zip(batch_ids, p_ones, p_zeros)):
+            if p_one + p_zero < FALLBACK_PROB_THRESHOLD:
+                fallback_rows.append(row)
+                batch_scores.append(None)
+            else:
+                batch_scores.append(self._binary_scores(p_one, p_zero))
+        if fallback_rows:
+            if self.constrained_fallback:
+                # All fallback samples of the batch are decoded together
+                fallback_scores = self._constrained_fallback_scores(model_name, [batch_ids[row] for row in fallback_rows])
+            else:
+                fallback_scores = [self._fallback_scores(model_name, batch_ids[row]) for row in fallback_rows]
+            for row, sample_scores in zip(fallback_rows, fallback_scores):
+                batch_scores[row] = sample_scores
+        return batch_scores
+
+
+    def _fallback_scores(self, model_name: str, ids: List[int]) -> ModelScore:
+        """Generate an answer for one unpadded prompt and parse the score from its text."""
+        _, generated_ids = self.backends[model_name].generate(ids)
+        generated_text = self.tokenizers[model_name].decode(generated_ids, skip_special_tokens=True)
+        return self._fallback_from_text(generated_text)
+
+
+    def _numeric_vocabulary(self, model_name: str) -> List[Tuple[int, str]]:
+        """(token id, text) of the model's tokens made only of digits, '.' and spaces, looked up once per model."""
+        if model_name not in self.numeric_vocabularies:
+            tokenizer = self.tokenizers[model_name]
+            special_ids = set(tokenizer.all_special_ids)
+            # Cheap check on the raw token first (byte-level BPE writes a space as 'Ġ', SentencePiece as '▁'),
+            # so that only a few tokens need to be decoded
+            raw_chars = NUMERIC_TOKEN_CHARS | {'Ġ', '▁'}
+            vocabulary = []
+            for token, token_id in tokenizer.get_vocab().items():
+                if token_id in special_ids or not set(token) <= raw_chars:
+                    continue
+                text = tokenizer.convert_tokens_to_string([token])
+                if text and set(text) <= NUMERIC_TOKEN_CHARS:
+                    vocabulary.append((token_id, text))
+            self.numeric_vocabularies[model_name] = vocabulary
+        return self.numeric_vocabularies[model_name]
+
+
+    def _constrained_fallback_scores(self, model_name: str, batch_ids: List[List[int]]) -> List[ModelScore]:
+        """
+        Decode the answers of a batch of prompts greedily, allowing only tokens that keep the answer a valid
+        number between 0.00 and 1.00, and score each from its number.
+
+        Every step masks the processed next-token logits to the tokens that extend the row's text to a prefix of
+        NUMERIC_ANSWER (and end of sequence once the number is complete). Rows finish when they pick end of sequence
+        or their number cannot be extended; decoding stops after MAX_NUMERIC_STEPS steps.
+        """
+        vocabulary = self._numeric_vocabulary(model_name)
+        if not vocabulary:
+            # No token can write a number, fall back to free generation
+            return [self._fallback_scores(model_name, ids) for ids in batch_ids]
+        self.metrics.count("constrained_fallbacks", len(batch_ids))
+        eos_id = self.tokenizers[model_name].eos_token_id
+        token_texts = dict(vocabulary)
+        texts = [""] * len(batch_ids)
+        finished = [False] * len(batch_ids)
+
+        def choose(step: int, logits: torch.Tensor) -> Optional[torch.Tensor]:
+            self.metrics.count("constrained_steps")
+            mask = torch.full_like(logits, float('-inf'))
+            for row, text in enumerate(texts):
+                if finished[row]:
+                    mask[row] = 0.0 # The row's output is ignored
+                    continue
+                allowed = [token_id for token_id, token_text in vocabulary if NUMERIC_ANSWER_PREFIX.fullmatch(text + token_text)]
+                if eos_id is not None and NUMERIC_ANSWER.fullmatch(text):
+                    allowed.append(eos_id)
+                if not allowed:
+                    finished[row] = True
+                    mask[row] = 0.0
+                    continue
+                mask[row, allowed] = 0.0
+            next_tokens = (logits + mask).argmax(dim=-1)
+
+            for row, token_id in enumerate(next_tokens.tolist()):
+                if finished[row]:
+                    continue
+                if token_id == eos_id:
+                    finished[row] = True
+                    continue
+                texts[row] += token_texts[token_id]
+                if NUMERIC_ANSWER_FINAL.fullmatch(texts[row]):
+                    finished[row] = True
+            # The backend feeds the chosen tokens back, reusing the key/values of everything before them if it can
+            return None if all(finished) else next_tokens
+
+        with self.metrics.stage("constrained_decode", self.stage_sync):
+            self.backends[model_name].decode(batch_ids, choose, MAX_NUMERIC_STEPS)
+
+        return [self._fallback_from_text(text) for text in texts]
+
+
+    def _fallback_from_text(self, generated_text: str) -> ModelScore:
+        """Parse the score from generated text, counting parsed and unparseable answers."""
+        with self.metrics.stage("parse"):
+            score = self._parse_score(generated_text)
+        self.metrics.count("fallback_parsed" if score is not None else "fallback_unparseable")
+        return self._parsed_scores(score)
+
+
+    def _build_prefix_cache(self, model_name: str):
+        """Run PROMPT_PREFIX through the model once and keep its key/values for reuse by every batch."""
+        tokenizer = self.tokenizers[model_name]
+        try:
+            prefix_ids = tokenizer(PROMPT_PREFIX)["input_ids"]
+            # The cache is only valid if full prompts start with exactly the prefix tokens
+            sample_ids = tokenizer(self.create_prompt("question", "answer", "ground truth"))["input_ids"]
+            if not prefix_ids or sample_ids[:len(prefix_ids)] != prefix_ids:
+                print(f"Warning: Model {model_name} does not tokenize the prompt prefix independently, prefix cache disabled.")
+                return
+            if not self.backends[model_name].build_prefix_cache(prefix_ids):
+                print(f"Warning: Model {model_name} did not return past key/values, prefix cache disabled.")
+        except Exception as e:
+            print(f"Warning: Could not build the prefix cache for model {model_name}: {e}, prefix cache disabled.")
+
+
+    @staticmethod
+    def _parse_score(generated_text: str) -> Optional[float]:
+        """Parse the first number in generated text as a 0-1 score, or None if there is no number."""
+        match = re.search(r'(\d+\.?\d*)', generated_text.strip())
+        if not match:
+            return None
+        score = float(match.group(1))
+        return max(0.0, min(1.0, score)) # Ensure score is between 0-1
+
+
+    @staticmethod
+    def _parsed_scores(score: Optional[float]) -> ModelScore:
+        """Convert a parsed 0-1 score into (score_one, score_zero) percentages; unparseable answers score 0."""
+        if score is None:
+            # No number found in the generated text, and it didn't start with 0/1
+            return ModelScore(0.0, 0.0, fallback=True)
+        return ModelScore(score * 100, (1.0 - score) * 100, fallback=True) # Convert to percentage
+
+
+    @staticmethod
+    def _binary_scores(p_one: float, p_zero: float) -> ModelScore:
+        """Normalize the probabilities of ' 1' and ' 0' into (score_one, score_zero) percentages."""
+        total_prob = p_one + p_zero
+        if total_prob > 0:
+             score_one = p_one / total_prob
+             score_zero = p_zero / total_prob
+        else: # Both p_one and p_zero are zero
+             score_one = 0.0
+             score_zero = 0.0 # This case is unlikely if the fallback threshold check didn't catch it.
+        return ModelScore(score_one * 100, score_zero * 100) # Convert to percentage
+
+
+    def evaluate(self, qst: List[str], preds: List[str], gts: List[str], return_details: bool = False) -> List:
         """
         Evaluate the semantic similarity between predicted answers and ground truth answers.
 
@@ -239,51 +774,345 @@ Please use the questions as background information, provide a similarity score b
             qst: List of questions.
             preds: List of predicted answers.
             gts: List of ground truth answers.
+            return_details: Return a dict per sample instead of the bare score: {'score': L3-Lite score,
+                'exact_match': whether it was short-circuited, 'models': {model name: {'p_one': ..., 'p_zero': ...,
+                'fallback': ...}}}, where p_one/p_zero are each model's normalized probabilities of ' 1'/' 0' and
+                fallback tells whether the score was parsed from generated text. With cascade_threshold set,
+                'models' only holds the models that ran on the sample and 'escalated' tells whether it went past
+                the first one.
 
         Returns:
-            List of L3-Lite scores (percentage, 0-100).
+            List of L3-Lite scores (percentage, 0-100), or of detail dicts if return_details is set.
         """
         if not (len(preds) == len(gts) == len(qst)): # More concise check
             print(f"Error: Mismatch in the number of questions, predictions, and ground truths ({len(qst)}, {len(preds)}, {len(gts)}).")
             # Return a list of 0 scores with the same length as predictions, or raise an error
             # Here, choosing to return a list of 0 scores to maintain code flow
+            if return_details:
+                return [{"score": 0.0, "exact_match": False, "models": {}} for _ in preds]
             return [0.0] * len(preds) if preds else []
 
 
-        scores = []
+        # Identical (question, pred, gt) triples are scored once and their scores are fanned back out
+        unique_index = {}
+        sample_to_unique = []
+        for triple in zip(qst, preds, gts):
+            key = tuple(str(x) if x is not None else "" for x in triple)
+            sample_to_unique.append(unique_index.setdefault(key, len(unique_index)))
+        unique_triples = list(unique_index)
 
-        # Wrap zip iterator with tqdm to display a progress bar
-        # No need for enumerate i, tqdm handles progress display
-        for qst_item, pred_item, gt_item in tqdm(zip(qst, preds, gts), total=len(preds), desc="Evaluating samples"):
+        unique_details = [None] * len(unique_triples)
+        to_judge = []
+        for u, (qst_item, pred_item, gt_item) in enumerate(unique_triples):
+            if self.exact_match_shortcut and is_exact_match(pred_item, gt_item):
+                # Normalized exact match, no need to ask the models
+                unique_details[u] = {"score": 100.0, "exact_match": True, "models": {}}
+            else:
+                to_judge.append(u)
+
+        judged_details = self._judge([unique_triples[u][0] for u in to_judge],
+                                     [unique_triples[u][1] for u in to_judge],
+                                     [unique_triples[u][2] for u in to_judge])
+        for u, details in zip(to_judge, judged_details):
+            unique_details[u] = details
 
-            model_scores_one = []
-            # model_scores_zero = [] # Actually only need 'one' scores for L3-Lite calculation
+        if return_details:
+            scores = [dict(unique_details[u]) for u in sample_to_unique]
+        else:
+            scores = [unique_details[u]["score"] for u in sample_to_unique]
 
-            # Evaluate with each successfully loaded model
-            # Check if self.models is empty to avoid iteration when no models are available
-            if not self.models:
-                 #print("Warning: No models available for L3-Lite evaluation, returning 0 score for this sample.")
-                 scores.append(0.0) # No available models, current sample gets 0 score
-                 continue # Skip to the next sample
+        judged = set(to_judge)
+        num_short_circuited = sum(1 for u in sample_to_unique if u not in judged)
+        self.metrics.count("samples", len(scores))
+        self.metrics.count("unique_triples", len(unique_triples))
+        self.metrics.count("exact_matches", num_short_circuited)
+        self.metrics.count("judged_triples", len(to_judge))
+        if self.verbose:
+            print(f"L3-Lite: {len(scores)} samples, {len(unique_triples)} unique triples, "
+                  f"{num_short_circuited} samples short-circuited as exact matches, {len(to_judge)} triples sent to the models.")
 
-            for model_name in self.models: # Iterate over successfully loaded models in self.models
-                score_one, score_zero = self.evaluate_single_model(model_name, qst_item, pred_item, gt_item)
-                model_scores_one.append(score_one)
-                # model_scores_zero.append(score_zero)
+        if self.first_score_seconds is None and scores:
+            self.first_score_seconds = time.perf_counter() - self.created_at
+            if self.verbose:
+                print(f"L3-Lite: time to first score {self.first_score_seconds:.2f}s (startup {self.startup_seconds:.2f}s).")
 
+        self.metrics.report()
 
-            # Calculate average score (only for models that actually returned scores)
-            if model_scores_one: # If any model returned a score
-                avg_score_one = np.mean(model_scores_one)
-                # avg_score_zero = np.mean(model_scores_zero)
-            else: # All models failed to return a score or no models were loaded
-                avg_score_one = 0.0
+        return scores
 
 
-            # L3-Lite score is the average '1' score (indicating similarity), rounded to two decimal places
-            l3_lite_score = round(avg_score_one, 2) # Score is already 0-100
-            scores.append(l3_lite_score)
+    def evaluate_iter(self, records: Iterable[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[Dict, float]]:
+        """
+        Evaluate a stream of result records (dicts with 'question', 'pred' and 'gt' keys) chunk by chunk.
 
-            # print(f"  L3-Lite Score for sample: {l3_lite_score:.2f}") # Can be printed occasionally during progress bar updates or removed
+        Only one chunk of records is held at a time, so memory use does not grow with the number of records.
 
-        return scores
+        Yields:
+            (record, L3-Lite score) pairs in input order, as soon as the chunk containing them is scored.
+        """
+        for chunk in iter_chunks(records, chunk_size):
+            scores = self.evaluate([record['question'] for record in chunk],
+                                   [record['pred'] for record in chunk],
+                                   [record['gt'] for record in chunk])
+            yield from zip(chunk, scores)
+
+
+    def judge_order(self) -> List[str]:
+        """The models in the order _judge runs them."""
+        if self.cascade_threshold is not None and len(self.model_names) > 1:
+            return self.cascade_order(list(self.model_names))
+        return list(self.model_names)
+
+
+    def prefill_cache(self, model_name: str, qst: List[str], preds: List[str], gts: List[str]):
+        """
+        Score samples with one model only and store the scores in the score cache, so that a later evaluate() call
+        on the same samples does not need the model. Running the whole data set through one model after the
+        other this way keeps a single model resident at a time (see evaluation.py --schedule judge_major).
+
+        Samples evaluate() would not send to the model are skipped: exact matches (with exact_match_shortcut),
+        and in a cascade, samples an earlier model of judge_order() is confident about (read from the cache).
+
+        Samples already in the cache (e.g. repeated in an earlier call) are left out of the batches, so the others
+        are padded and batched differently than without the cache. Their scores then differ by float rounding only:
+        identical at two decimals in fp32 on our checks, up to about 0.1 points in bf16/fp16.
+        """
+        if self.score_cache is None:
+            raise ValueError("prefill_cache requires a score cache (cache_path)")
+        triples = [unique for unique in dict.fromkeys(tuple(str(x) if x is not None else "" for x in triple) for triple in zip(qst, preds, gts))
+                   if not (self.exact_match_shortcut and is_exact_match(unique[1], unique[2]))]
+
+        if self.cascade_threshold is not None:
+            token_memo = {}
+            for earlier in self.judge_order():
+                if earlier == model_name or not triples:
+                    break
+                earlier_scores = self._evaluate_model_cached(earlier, [t[0] for t in triples], [t[1] for t in triples],
+                                                             [t[2] for t in triples], token_memo)
+                if earlier in self.model_names:
+                    triples = [triple for triple, model_score in zip(triples, earlier_scores) if not self._is_confident(model_score)]
+        if triples:
+            self._evaluate_model_cached(model_name, [t[0] for t in triples], [t[1] for t in triples], [t[2] for t in triples])
+
+
+    def _judge(self, qst: List[str], preds: List[str], gts: List[str]) -> List[Dict]:
+        """Score samples with every loaded model and average their '1' scores per sample (see evaluate's details)."""
+        # Check if self.model_names is empty to avoid evaluating when no models are available
+        if not self.model_names:
+             #print("Warning: No models available for L3-Lite evaluation, returning 0 score for every sample.")
+             return [{"score": 0.0, "exact_match": False, "models": {}} for _ in preds]
+        if not preds:
+             return []
+
+        cache_stats_before = self.score_cache.stats() if self.score_cache is not None else None
+
+        # Each successfully loaded model scores the whole sample list in batches,
+        # and the '1' scores are joined per sample afterwards
+        model_names = list(self.model_names)
+        token_memo = {} # Prompt tokenization shared by models of the same tokenizer family
+        escalated = None
+        if self.cascade_threshold is not None and len(model_names) > 1:
+            model_names = self.judge_order()
+            all_model_scores, escalated = self._evaluate_models_cascaded(model_names, qst, preds, gts, token_memo)
+        elif self.concurrent_models and len(model_names) > 1:
+            all_model_scores = self._evaluate_models_concurrently(model_names, qst, preds, gts, token_memo)
+        else:
+            all_model_scores = [self._evaluate_model_cached(model_name, qst, preds, gts, token_memo) for model_name in model_names]
+
+        # Models that failed to load on first use are left out of the ensemble
+        usable = [i for i, model_name in enumerate(model_names) if model_name in self.model_names]
+        if not usable:
+             return [{"score": 0.0, "exact_match": False, "models": {}} for _ in preds]
+        model_names = [model_names[i] for i in usable]
+        all_model_scores = [all_model_scores[i] for i in usable]
+
+        if self.score_cache is not None and self.verbose:
+            cache_stats = self.score_cache.stats()
+            print(f"Score cache: {cache_stats['hits'] - cache_stats_before['hits']} hits, "
+                  f"{cache_stats['misses'] - cache_stats_before['misses']} misses ({self.score_cache.path})")
+
+        if escalated is not None and self.verbose:
+            print(f"Cascade: {sum(escalated)} of {len(escalated)} samples escalated past {model_names[0]}.")
+
+        details = []
+        for i, sample_model_scores in enumerate(zip(*all_model_scores)):
+            # In a cascade, only the models that ran on the sample are averaged
+            sample_details = self._combine_scores([(model_name, model_score) for model_name, model_score
+                                                   in zip(model_names, sample_model_scores) if model_score is not None])
+            if escalated is not None:
+                sample_details["escalated"] = escalated[i]
+            details.append(sample_details)
+
+        return details
+
+
+    @staticmethod
+    def _combine_scores(model_scores: List[Tuple[str, ModelScore]]) -> Dict:
+        """Details of one sample (see evaluate) from the (model name, score) pairs of the models that scored it."""
+        # Calculate average score over the models
+        avg_score_one = np.mean([model_score.score_one for _, model_score in model_scores])
+
+        # L3-Lite score is the average '1' score (indicating similarity), rounded to two decimal places
+        l3_lite_score = round(avg_score_one, 2) # Score is already 0-100
+        return {
+            "score": l3_lite_score,
+            "exact_match": False,
+            "models": {model_name: {"p_one": model_score.score_one / 100, "p_zero": model_score.score_zero / 100,
+                                    "fallback": model_score.fallback}
+                       for model_name, model_score in model_scores},
+        }
+
+
+    def cascade_order(self, model_names: List[str]) -> List[str]:
+        """Models in the order a cascade runs them: smallest weights first, ties in the configured order."""
+        return sorted(model_names, key=lambda model_name: self.model_sizes.get(model_name, 0))
+
+
+    def _is_confident(self, model_score: ModelScore) -> bool:
+        """Whether a cascade accepts a model's score instead of passing the sample on to the next model."""
+        if model_score.fallback: # Scores parsed from generated text carry no probability
+            return False
+        return max(model_score.score_one, model_score.score_zero) / 100 >= self.cascade_threshold
+
+
+    def _evaluate_models_cascaded(self, model_names: List[str], qst: List[str], preds: List[str], gts: List[str],
+                                  token_memo: Optional[Dict] = None) -> Tuple[List[List[Optional[ModelScore]]], List[bool]]:
+        """
+        Run the models one after another, each only on the samples none of the previous models was confident about.
+
+        Returns:
+            (scores, escalated): per model, the score of every sample or None where the model did not run,
+            and per sample whether it went past the first model.
+        """
+        all_model_scores = []
+        pending = list(range(len(preds)))
+        escalated = [False] * len(preds)
+        for stage, model_name in enumerate(model_names):
+            model_scores: List[Optional[ModelScore]] = [None] * len(preds)
+            if pending:
+                if stage > 0:
+                    for i in pending:
+                        escalated[i] = True
+                stage_scores = self._evaluate_model_cached(model_name, [qst[i] for i in pending], [preds[i] for i in pending],
+                                                           [gts[i] for i in pending], token_memo)
+                for i, model_score in zip(pending, stage_scores):
+                    model_scores[i] = model_score
+                if model_name in self.model_names: # A model that failed to load decides nothing
+                    pending = [i for i in pending if not self._is_confident(model_scores[i])]
+            all_model_scores.append(model_scores)
+        self.metrics.count("cascade_samples", len(preds))
+        self.metrics.count("cascade_escalated", sum(escalated))
+        return all_model_scores, escalated
+
+
+    def validate_cascade(self, qst: List[str], preds: List[str], gts: List[str], tolerance: float = 5.0) -> Dict:
+        """
+        Compare cascade scores with full-ensemble scores on a validation subset.
+
+        Every model scores every sample once; the cascade score of each sample is then derived from the same
+        per-model scores, so the comparison costs one ensemble pass.
+
+        Args:
+            tolerance: Largest difference (in score points) counted as agreement.
+
+        Returns:
+            {'samples', 'escalation_rate', 'agreement': fraction of samples whose scores differ by at most
+            tolerance, 'decision_agreement': fraction on the same side of 50, 'mean_abs_diff', 'max_abs_diff'}.
+        """
+        if self.cascade_threshold is None:
+            raise ValueError("validate_cascade requires cascade_threshold to be set")
+        model_names = self.cascade_order(list(self.model_names))
+        token_memo = {}
+        all_model_scores = [self._evaluate_model_cached(model_name, qst, preds, gts, token_memo) for model_name in model_names]
+        usable = [i for i, model_name in enumerate(model_names) if model_name in self.model_names]
+        model_names = [model_names[i] for i in usable]
+        all_model_scores = [all_model_scores[i] for i in usable]
+        if not model_names or not preds:
+            return {"samples": 0, "escalation_rate": 0.0, "agreement": 1.0, "decision_agreement": 1.0,
+                    "mean_abs_diff": 0.0, "max_abs_diff": 0.0}
+
+        differences = []
+        num_escalated = 0
+        num_same_decision = 0
+        for sample_model_scores in zip(*all_model_scores):
+            scored = list(zip(model_names, sample_model_scores))
+            depth = 1
+            while depth < len(scored) and not self._is_confident(scored[depth - 1][1]):
+                depth += 1
+            num_escalated += depth > 1
+            ensemble_score = self._combine_scores(scored)["score"]
+            cascade_score = self._combine_scores(scored[:depth])["score"]
+            differences.append(abs(cascade_score - ensemble_score))
+            num_same_decision += (cascade_score >= 50) == (ensemble_score >= 50)
+
+        differences = np.asarray(differences)
+        return {
+            "samples": len(differences),
+            "escalation_rate": num_escalated / len(differences),
+            "agreement": float(np.mean(differences <= tolerance)),
+            "decision_agreement": num_same_decision / len(differences),
+            "mean_abs_diff": float(differences.mean()),
+            "max_abs_diff": float(differences.max()),
+        }
+
+
+    def judge_identity(self, model_name: str) -> str:
+        """
+        Describe everything that determines a model's scores: model name, weights, prompt template, dtype and backend.
+        Used as part of the persistent score cache keys.
+        """
+        template = self.create_prompt("{question}", "{pred}", "{gt}")
+        return "|".join([
+            model_name,
+            weights_fingerprint(self.model_paths.get(model_name, "")),
+            hashlib.sha256(template.encode('utf-8')).hexdigest(),
+            f"torch.{DTYPES[self.dtype_name]}", # str() of the torch dtype, known without loading the model
+            'int8' if self.quantize else '',
+            'numeric-fallback' if self.constrained_fallback else '', # Fallback scores differ from free generation
+            '' if self.backend_name == 'transformers' else self.backend_name, # Other runtimes' scores differ in the last digits
+        ])
+
+
+    def _evaluate_model_cached(self, model_name: str, qst: List[str], preds: List[str], gts: List[str],
+                               token_memo: Optional[Dict] = None) -> List[ModelScore]:
+        """evaluate_model, reading known samples from the persistent score cache and writing new scores back."""
+        if self.score_cache is None:
+            return self.evaluate_model(model_name, qst, preds, gts, token_memo)
+
+        identity = self.judge_identity(model_name)
+        keys = [sample_key(identity, qst_item, pred_item, gt_item) for qst_item, pred_item, gt_item in zip(qst, preds, gts)]
+        with self.metrics.stage("cache_lookup"):
+            cached = self.score_cache.get_many(keys)
+        self.metrics.count("cache_hits", len(cached))
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        results = [ModelScore(*cached[key]) if key in cached else ZERO_SCORE for key in keys]
+        if missing:
+            new_scores = self.evaluate_model(model_name, [qst[i] for i in missing], [preds[i] for i in missing], [gts[i] for i in missing], token_memo)
+            for i, sample_scores in zip(missing, new_scores):
+                results[i] = sample_scores
+            # ZERO_SCORE is also what a failed evaluation returns, so it is never stored and gets retried next run
+            with self.metrics.stage("cache_write"):
+                self.score_cache.put_many([(keys[i], sample_scores) for i, sample_scores in zip(missing, new_scores) if sample_scores != ZERO_SCORE])
+        return results
+
+
+    def _evaluate_models_concurrently(self, model_names: List[str], qst: List[str], preds: List[str], gts: List[str],
+                                      token_memo: Optional[Dict] = None) -> List[List[ModelScore]]:
+        """Run the models over all samples at the same time, one thread per model."""
+        total_threads = torch.get_num_threads()
+        budgets = split_thread_budget(total_threads, [self.model_sizes.get(name, 1) for name in model_names])
+
+        def run(model_name: str, num_threads: int) -> List[ModelScore]:
+            # With torch's OpenMP backend the intra-op thread count is a per-thread setting,
+            # so each ensemble member gets its own share of the cores
+            torch.set_num_threads(num_threads)
+            return self._evaluate_model_cached(model_name, qst, preds, gts, token_memo)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(model_names)) as executor:
+                futures = [executor.submit(run, model_name, budget) for model_name, budget in zip(model_names, budgets)]
+                return [future.result() for future in futures]
+        finally:
+            # Some BLAS backends keep one global thread count, so restore the caller's
+            torch.set_num_threads(total_threads)
@@ -0,0 +1,286 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from check_drift import score_drift
+
+# Name the benchmark model is registered under in L3_Lite.MODEL_PATHS
+BENCH_MODEL_NAME = 'bench-tiny'
+
+# Metrics compared against a baseline run
+COMPARED_METRICS = ('samples_per_s', 'latency_p50_ms', 'latency_p99_ms', 'load_s', 'peak_rss_mb')
+
+# L3Lite settings compared by the benchmark
+BENCHMARK_CONFIGS = {
+    'logits': dict(scoring_mode='logits'),
+    'logits_no_prefix_cache': dict(scoring_mode='logits', use_prefix_cache=False),
+    'logits_unbatched': dict(scoring_mode='logits', max_batch_tokens=1),
+    'generate': dict(scoring_mode='generate'),
+    'onnx': dict(scoring_mode='logits', backend='onnx'),
+    'onnx_int8': dict(scoring_mode='logits', backend='onnx', quantize=True),
+}
+
+# Scores of every other configuration are compared with this one's (see score_drift)
+REFERENCE_CONFIG = 'logits'
+
+# Synthetic Traffic-VQA-shaped questions: (question type, question templates, answer generator kind)
+VEHICLES = ['car', 'truck', 'bus', 'motorcycle', 'bicycle', 'van', 'taxi', 'pedestrian']
+PLACES = ['upper left', 'upper right', 'bottom left', 'bottom right', 'center', 'left lane', 'right lane', 'intersection']
+SCENES = ['urban road', 'highway', 'parking lot', 'crossroad', 'roundabout', 'bridge', 'residential street']
+CONDITIONS = ['at night', 'in the rain', 'in fog', 'in daylight', 'on a thermal image']
+QUESTION_TYPES = [
+    ('counting', ["How many {v}s are there in the image?", "How many {v}s are waiting at the {p} {c}?"], 'count'),
+    ('yes/no', ["Is there a {v} in the {p}?", "Is the {v} in the {p} parked illegally {c}?"], 'yes_no'),
+    ('location', ["Where is the {v} located?", "In which part of the {s} is the {v} {c}?"], 'place'),
+    ('scene', ["What type of scene is shown in the image?", "What kind of road is visible {c}?"], 'scene'),
+    ('reasoning', ["Why is the {v} in the {p} stopped {c}?", "What is the most likely traffic risk near the {p} of the {s}?",
+                   "What should the {v} driver do next given the traffic situation {c}?"], 'sentence'),
+]
+SENTENCE_WORDS = ("the {v} is waiting because a {v2} is crossing the {p} and traffic is heavy {c} so it should slow down "
+                  "keep a safe distance and yield to the {v2} before turning towards the {s}").split()
+
+
+def synthetic_triples(num_samples: int, seed: int = 0, duplicate_rate: float = 0.05) -> List[Tuple[str, str, str]]:
+    """
+    Generate (question, prediction, ground truth) triples shaped like Traffic-VQA results: short perception
+    answers (counts, yes/no, places) and longer free-form reasoning answers, with a few repeated samples.
+    """
+    rng = random.Random(seed)
+
+    def fill(template: str) -> str:
+        return template.format(v=rng.choice(VEHICLES), v2=rng.choice(VEHICLES), p=rng.choice(PLACES),
+                               s=rng.choice(SCENES), c=rng.choice(CONDITIONS))
+
+    def answer(kind: str) -> str:
+        if kind == 'count':
+            count = rng.randint(0, 20)
+            return str(count) if rng.random() < 0.7 else f"There are {count}."
+        if kind == 'yes_no':
+            return rng.choice(['Yes', 'No', 'yes', 'no', 'Yes, there is.', 'No, there is not.'])
+        if kind == 'place':
+            return rng.choice(PLACES) if rng.random() < 0.6 else f"It is in the {rng.choice(PLACES)} of the {rng.choice(SCENES)}."
+        if kind == 'scene':
+            return rng.choice(SCENES)
+        # Reasoning answers: 8 to 40 words
+        length = min(len(SENTENCE_WORDS), max(8, int(rng.gauss(20, 8))))
+        start = rng.randint(0, len(SENTENCE_WORDS) - length)
+        return fill(" ".join(SENTENCE_WORDS[start:start + length])).capitalize() + "."
+
+    triples = []
+    for _ in range(num_samples):
+        if triples and rng.random() < duplicate_rate:
+            triples.append(rng.choice(triples))
+            continue
+        _, templates, kind = rng.choice(QUESTION_TYPES)
+        triples.append((fill(rng.choice(templates)), answer(kind), answer(kind)))
+    return triples
+
+
+def build_tiny_model(model_dir: str, seed: int = 0, vocab_size: int = 1024, hidden_size: int = 64, num_layers: int = 2):
+    """
+    Write a tiny random-weight Qwen2 causal LM and a byte-level BPE tokenizer trained on synthetic
+    prompts to model_dir, so the benchmark runs without network access or downloaded weights.
+    """
+    import torch
+    from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+    from prompt_tokens import build_prompt
+
+    corpus = [build_prompt(*triple) for triple in synthetic_triples(2000, seed=seed + 1)]
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<|endoftext|>"],
+                                                              initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    fast_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>")
+    fast_tokenizer.save_pretrained(model_dir)
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(vocab_size=len(fast_tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+                         num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2,
+                         eos_token_id=fast_tokenizer.eos_token_id)
+    Qwen2ForCausalLM(config).save_pretrained(model_dir)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def _in_fresh_process(context, function: Callable, *args):
+    """Run function(*args) in a new interpreter of the multiprocessing context and return its result."""
+    pool = context.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _load_config(model_dir: str, l3_lite_kwargs: Dict):
+    """Load the benchmark model with one L3Lite configuration."""
+    import L3_Lite
+    L3_Lite.MODEL_PATHS[BENCH_MODEL_NAME] = model_dir
+    l3_lite = L3_Lite.L3Lite(model_names=[BENCH_MODEL_NAME], verbose=False, **l3_lite_kwargs)
+    l3_lite.load_models()
+    return l3_lite
+
+
+def _export_graphs(model_dir: str, l3_lite_kwargs: Dict):
+    """Export the ONNX graphs an 'onnx' configuration loads."""
+    _load_config(model_dir, l3_lite_kwargs)
+
+
+def _run_config(model_dir: str, l3_lite_kwargs: Dict, triples: List[Tuple[str, str, str]], request_size: int) -> Dict:
+    """Benchmark one L3Lite configuration. Runs in a fresh process so that load time and peak RSS are its own."""
+    start = time.perf_counter()
+    l3_lite = _load_config(model_dir, l3_lite_kwargs)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up kernels and allocators on one request before measuring
+    warmup = triples[:request_size]
+    l3_lite.evaluate([t[0] for t in warmup], [t[1] for t in warmup], [t[2] for t in warmup])
+
+    latencies = []
+    scores = []
+    run_start = time.perf_counter()
+    for offset in range(0, len(triples), request_size):
+        request = triples[offset:offset + request_size]
+        request_start = time.perf_counter()
+        scores.extend(l3_lite.evaluate([t[0] for t in request], [t[1] for t in request], [t[2] for t in request]))
+        latencies.append(time.perf_counter() - request_start)
+    run_seconds = time.perf_counter() - run_start
+
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        "samples": len(triples),
+        "requests": len(latencies),
+        "samples_per_s": len(triples) / run_seconds if run_seconds > 0 else 0.0,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        "load_s": load_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "scores": scores, # Replaced by the agreement with REFERENCE_CONFIG in run_benchmark
+    }
+
+
+def run_benchmark(configs: List[str], num_samples: int = 512, request_size: int = 16, device: str = 'cpu',
+                  dtype: str = 'fp32', seed: int = 0, model_dir: Optional[str] = None) -> Dict:
+    """
+    Benchmark L3Lite configurations on synthetic triples with a tiny local model.
+
+    Args:
+        configs: Names from BENCHMARK_CONFIGS. The 'onnx' configurations export the model once before they are timed.
+        num_samples: Number of synthetic samples scored per configuration.
+        request_size: Samples per evaluate() call; latency percentiles are per call.
+        model_dir: Existing benchmark model directory; a fresh one is built in a temporary directory if None.
+
+    Returns:
+        {'environment': ..., 'settings': ..., 'results': {config: metrics}}, ready to be written as JSON. If
+        REFERENCE_CONFIG is among the configs, the metrics of the others include the 'agreement' of their scores with it.
+    """
+    triples = synthetic_triples(num_samples, seed=seed)
+    with tempfile.TemporaryDirectory(prefix="l3lite-bench-") as temp_dir:
+        if model_dir is None:
+            model_dir = temp_dir
+            build_tiny_model(model_dir, seed=seed)
+
+        # Spawn a fresh interpreter per configuration (see _run_config)
+        context = mp.get_context("spawn")
+        onnx_dir = os.path.join(temp_dir, "onnx")
+        results = {}
+        for name in configs:
+            kwargs = dict(BENCHMARK_CONFIGS[name], device=device, dtype=dtype)
+            if kwargs.get('backend') == 'onnx':
+                kwargs['onnx_dir'] = onnx_dir
+                # Export (and quantize) before the timed run; exporting is a one-off cost per model version
+                _in_fresh_process(context, _export_graphs, model_dir, kwargs)
+            results[name] = _in_fresh_process(context, _run_config, model_dir, kwargs, triples, request_size)
+            print(f"{name}: {results[name]['samples_per_s']:.1f} samples/s, p50 {results[name]['latency_p50_ms']:.1f} ms, "
+                  f"p99 {results[name]['latency_p99_ms']:.1f} ms, load {results[name]['load_s']:.2f}s, "
+                  f"peak RSS {results[name]['peak_rss_mb']:.0f} MiB")
+
+    reference = results[REFERENCE_CONFIG]["scores"] if REFERENCE_CONFIG in results else None
+    for name, metrics in results.items():
+        scores = metrics.pop("scores")
+        if reference is not None and name != REFERENCE_CONFIG:
+            metrics["agreement"] = dict(score_drift(reference, scores), reference=REFERENCE_CONFIG)
+            print(f"{name} vs {REFERENCE_CONFIG}: mean difference {metrics['agreement']['mean_abs_diff']:.4f}, "
+                  f"largest {metrics['agreement']['max_abs_diff']:.4f}, verdict flips {100.0 * metrics['agreement']['verdict_flip_rate']:.1f}%")
+
+    import torch
+    import transformers
+    environment_extra = {}
+    if any(BENCHMARK_CONFIGS[name].get('backend') == 'onnx' for name in configs):
+        import onnxruntime
+        environment_extra["onnxruntime"] = onnxruntime.__version__
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            **environment_extra,
+        },
+        "settings": {"num_samples": num_samples, "request_size": request_size, "device": device, "dtype": dtype, "seed": seed},
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """Lines describing the relative change of every metric against a baseline benchmark JSON."""
+    lines = []
+    for name, metrics in current["results"].items():
+        if name not in baseline.get("results", {}):
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            value, before = metrics.get(metric), baseline["results"][name].get(metric)
+            if value is not None and before:
+                changes.append(f"{metric} {100.0 * (value - before) / before:+.1f}%")
+        lines.append(f"{name}: {', '.join(changes)}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark L3-Lite throughput and latency offline with a tiny random-weight model")
+    parser.add_argument("--configs", nargs="+", default=list(BENCHMARK_CONFIGS), choices=list(BENCHMARK_CONFIGS), help="Configurations to benchmark")
+    parser.add_argument("--num_samples", type=int, default=512, help="Synthetic samples scored per configuration")
+    parser.add_argument("--request_size", type=int, default=16, help="Samples per evaluate() call")
+    parser.add_argument("--device", type=str, default='cpu', help="Device to run on")
+    parser.add_argument("--dtype", type=str, default='fp32', help="dtype policy (see evaluation.py)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic model and samples")
+    parser.add_argument("--model_dir", type=str, default=None, help="Reuse a benchmark model directory instead of building one")
+    parser.add_argument("--output", type=str, default='benchmark.json', help="Path of the JSON results")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier benchmark JSON to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.configs, num_samples=args.num_samples, request_size=args.request_size,
+                           device=args.device, dtype=args.dtype, seed=args.seed, model_dir=args.model_dir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\nChange against baseline:")
+        for line in compare(baseline, report):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
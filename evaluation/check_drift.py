@@ -0,0 +1,70 @@
+import argparse
+import gc
+import itertools
+from typing import Dict, List
+
+import numpy as np
+
+from L3_Lite import L3Lite, DTYPE_POLICIES
+from judge_backends import BACKENDS, DEFAULT_ONNX_DIR
+from result_io import iter_records
+
+
+def score_drift(baseline: List[float], candidate: List[float]) -> Dict[str, float]:
+    """
+    Compare candidate L3-Lite scores with baseline scores of the same samples.
+
+    Returns:
+        Mean/max absolute difference (score points, 0-100), Pearson correlation, and the fraction of
+        samples whose verdict (score > 50, i.e. 'Semantically Similar') differs.
+    """
+    baseline = np.asarray(baseline, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    diff = np.abs(candidate - baseline)
+    correlation = float(np.corrcoef(baseline, candidate)[0, 1]) if len(baseline) > 1 and baseline.std() > 0 and candidate.std() > 0 else 1.0
+    return {
+        "num_samples": int(len(baseline)),
+        "mean_abs_diff": float(diff.mean()) if len(diff) else 0.0,
+        "max_abs_diff": float(diff.max()) if len(diff) else 0.0,
+        "correlation": correlation,
+        "verdict_flip_rate": float(np.mean((baseline > 50) != (candidate > 50))) if len(diff) else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the L3-Lite score drift of a dtype/quantization/backend setting against the fp32 baseline")
+    parser.add_argument("--model_names", nargs="+", default=['Qwen2.5-3B-Instruct'], help="List of model names to use")
+    parser.add_argument("--device", type=str, default='cpu', help="Device to run on")
+    parser.add_argument("--result_path", type=str, required=True, help="Results file used as the sample set (JSON, JSON Lines or column store)")
+    parser.add_argument("--num_samples", type=int, default=500, help="Number of samples from the start of the results file to compare on")
+    parser.add_argument("--dtype", type=str, default='auto', choices=DTYPE_POLICIES, help="dtype policy to compare with fp32")
+    parser.add_argument("--quantize", action="store_true", help="Compare int8 dynamic quantization with fp32")
+    parser.add_argument("--backend", type=str, default='transformers', choices=BACKENDS, help="Backend of the candidate setting; the fp32 baseline runs on transformers")
+    parser.add_argument("--onnx_dir", type=str, default=DEFAULT_ONNX_DIR, help="Directory of the exported judge graphs of the 'onnx' backend")
+    args = parser.parse_args()
+
+    # Only the first num_samples records are read, whatever the size of the results file
+    results = list(itertools.islice(iter_records(args.result_path, ['question', 'pred', 'gt']), args.num_samples))
+    questions = [item['question'] for item in results]
+    predictions = [item['pred'] for item in results]
+    ground_truths = [item['gt'] for item in results]
+
+    # Load one configuration at a time so that only one copy of the weights is resident
+    settings = {"fp32": dict(dtype="fp32"),
+                "candidate": dict(dtype=args.dtype, quantize=args.quantize, backend=args.backend, onnx_dir=args.onnx_dir)}
+    scores = {}
+    for name, setting in settings.items():
+        l3_lite = L3Lite(model_names=args.model_names, device=args.device, **setting)
+        scores[name] = l3_lite.evaluate(questions, predictions, ground_truths)
+        del l3_lite
+        gc.collect()
+
+    drift = score_drift(scores["fp32"], scores["candidate"])
+    print(f"\nScore drift of dtype={args.dtype}{' + int8 quantization' if args.quantize else ''}"
+          f"{' on ' + args.backend if args.backend != 'transformers' else ''} against fp32:")
+    for key, value in drift.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterator, Tuple
+
+# Seconds between fsyncs of the journal; a crash loses at most the scores of this interval
+SYNC_INTERVAL = 5.0
+
+JOURNAL_VERSION = 1
+
+# Flags of the evaluate details that are journaled with the score, so that resumed rows are written as they were scored
+JOURNALED_FLAGS = ('exact_match', 'type_scorer', 'prefilter', 'escalated')
+
+
+def file_fingerprint(path: str) -> str:
+    """SHA-256 of a file's content, read in blocks. For a directory (column store), of its files' names and contents."""
+    digest = hashlib.sha256()
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    for file_path in paths:
+        if os.path.isdir(path):
+            digest.update(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class ScoreJournal:
+    """
+    Append-only JSON Lines journal of scored samples, used to resume interrupted evaluation runs.
+
+    The first line is a header with the fingerprint of the input results file. Every following line holds
+    one sample: {"index": position in the results file, "score": L3-Lite score, "models": per-model p_one/p_zero,
+    plus the JOURNALED_FLAGS that were set}. Samples are appended in input order, so the indices increase.
+    Lines are flushed and fsynced to disk every SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, path: str, input_path: str, resume: bool = False):
+        """
+        Open the journal for the results file at input_path.
+
+        Args:
+            path: Path of the journal file.
+            input_path: Path of the results file being evaluated.
+            resume: Keep the samples already in an existing journal (self.num_done of them, streamed by
+                iter_done) and append to it.
+                Raises ValueError if the journal was written for a different version of the results file.
+                Without resume, an existing journal is overwritten.
+        """
+        self.path = path
+        self.fingerprint = file_fingerprint(input_path)
+        self.num_done = 0
+        self.done_bytes = 0 # Length of the journal up to its last resumed sample
+
+        if resume and os.path.exists(path):
+            self._load()
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            if os.path.exists(path):
+                print(f"Warning: Overwriting existing journal {path} (use --resume to continue it).")
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps({"version": JOURNAL_VERSION, "input": os.path.abspath(input_path), "sha256": self.fingerprint}) + "\n")
+            self._sync()
+        self.last_sync = time.monotonic()
+
+    def _load(self):
+        """Check an existing journal and count its scored samples, dropping a partially written last line."""
+        valid_bytes = 0
+        with open(self.path, 'rb') as f:
+            header_line = f.readline()
+            try:
+                header = json.loads(header_line)
+            except ValueError:
+                raise ValueError(f"Journal {self.path} has no valid header, cannot resume from it.")
+            if header.get("sha256") != self.fingerprint:
+                raise ValueError(f"The results file has changed since journal {self.path} was written, cannot resume. "
+                                 f"Start a new run without --resume.")
+            valid_bytes = len(header_line)
+            for line in f:
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break # Interrupted in the middle of a write, everything after this point is lost
+                if not line.endswith(b"\n"):
+                    break
+                self.num_done += 1
+                valid_bytes += len(line)
+        # Cut off the partial line so that new entries start on a fresh line
+        with open(self.path, 'r+b') as f:
+            f.truncate(valid_bytes)
+        self.done_bytes = valid_bytes
+        print(f"Resuming from journal {self.path}: {self.num_done} samples already scored.")
+
+    def iter_done(self) -> Iterator[Tuple[int, Dict]]:
+        """
+        Stream the samples that were already scored when the journal was resumed, without keeping them in memory.
+
+        Yields:
+            (index, journaled details with 'score', 'models' and the JOURNALED_FLAGS that were set), in increasing index order.
+        """
+        with open(self.path, 'rb') as f:
+            offset = len(f.readline()) # Header
+            # Entries appended by this run start at done_bytes
+            while offset < self.done_bytes:
+                line = f.readline()
+                offset += len(line)
+                entry = json.loads(line)
+                index = entry.pop("index")
+                entry.setdefault("models", {})
+                yield index, entry
+
+    def append(self, index: int, details: Dict):
+        """Record the score of the sample at position index (details as returned by L3Lite.evaluate)."""
+        entry = {"index": index, "score": float(details["score"]), "models": details.get("models", {})}
+        entry.update({flag: details[flag] for flag in JOURNALED_FLAGS if flag in details})
+        self.file.write(json.dumps(entry) + "\n")
+        if time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+            self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self._sync()
+        self.file.close()
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+# Column stores are directories; this suffix selects them in ResultWriter and the CLIs
+COLUMN_STORE_SUFFIX = '.cols'
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+
+# Columns stored as fixed-width numbers: name -> (numpy dtype, array typecode, value of missing entries).
+# Every other column holds text.
+NUMERIC_COLUMNS = {
+    'index': ('int64', 'q', -1),
+    'score': ('float64', 'd', float('nan')),
+    'p_one': ('float64', 'd', float('nan')),
+    'p_zero': ('float64', 'd', float('nan')),
+    'fallback': ('int8', 'b', -1), # Booleans: 1/0, -1 if missing
+    'escalated': ('int8', 'b', -1),
+}
+
+# Text columns with at most this many distinct values (question types, images, sources...) are stored
+# as integer codes into a list of categories, so they can be grouped without decoding any text
+MAX_CATEGORIES = 1 << 16
+
+# Rows decoded at a time by ColumnStore.iter_records
+READ_CHUNK_ROWS = 4096
+
+
+def is_column_store(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+
+class _NumericColumnWriter:
+    def __init__(self, name: str, dtype: str, typecode: str, missing):
+        self.name = name
+        self.dtype = dtype
+        self.missing = missing
+        self.values = array(typecode)
+
+    def append(self, value):
+        if value is None or value == "":
+            self.values.append(self.missing)
+        elif self.dtype == 'int8':
+            self.values.append(1 if value is True or str(value).lower() in ('1', 'true') else 0)
+        elif self.dtype == 'int64':
+            self.values.append(int(value))
+        else:
+            self.values.append(float(value))
+
+    def finish(self, directory: str) -> Dict:
+        np.save(os.path.join(directory, f"{self.name}.npy"), np.frombuffer(self.values, dtype=self.dtype))
+        return {"kind": "numeric", "dtype": self.dtype}
+
+
+class _TextColumnWriter:
+    """
+    Writes UTF-8 text as one data file plus row offsets. While the column has few distinct values it is also
+    dictionary-encoded, and if it stays that way only the codes and categories are kept.
+    Nested values (the per-model 'models' dict of evaluation.py output) are stored as JSON text.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.data_path = os.path.join(directory, f"{name}.data")
+        self.data = open(self.data_path, 'wb')
+        self.offsets = array('q', [0])
+        self.categories: Optional[Dict[str, int]] = {}
+        self.codes = array('i')
+        self.is_json = None # Decided by the first value that is not None
+
+    def append(self, value):
+        if self.is_json is None and value is not None:
+            self.is_json = isinstance(value, (dict, list))
+        if self.is_json:
+            text = json.dumps(value, ensure_ascii=False)
+        else:
+            text = "" if value is None else str(value)
+        encoded = text.encode('utf-8')
+        self.data.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+        if self.categories is not None:
+            code = self.categories.setdefault(text, len(self.categories))
+            if len(self.categories) > MAX_CATEGORIES:
+                self.categories = None
+                self.codes = None
+            else:
+                self.codes.append(code)
+
+    def finish(self, directory: str) -> Dict:
+        self.data.close()
+        meta = {"json": bool(self.is_json)}
+        if self.categories is not None:
+            os.remove(self.data_path)
+            np.save(os.path.join(directory, f"{self.name}.codes.npy"), np.frombuffer(self.codes, dtype=np.int32))
+            with open(os.path.join(directory, f"{self.name}.categories.json"), 'w', encoding='utf-8') as f:
+                json.dump(list(self.categories), f, ensure_ascii=False)
+            meta["kind"] = "dictionary"
+        else:
+            np.save(os.path.join(directory, f"{self.name}.offsets.npy"), np.frombuffer(self.offsets, dtype=np.int64))
+            meta["kind"] = "text"
+        return meta
+
+
+class ColumnStoreWriter:
+    """
+    Writes records (dicts) as a column store: a directory with meta.json and one or two files per column.
+    Fields may differ between records; missing entries are empty text, NaN or -1 (see NUMERIC_COLUMNS).
+    Numeric columns and row offsets are kept in compact arrays until close(), text goes straight to disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, META_FILE)):
+            os.remove(os.path.join(path, META_FILE)) # The store is only valid again once close() rewrites it
+        self.num_rows = 0
+        self.columns: Dict[str, object] = {}
+
+    def write(self, record: Dict):
+        for name in record:
+            if name not in self.columns:
+                if name in NUMERIC_COLUMNS:
+                    column = _NumericColumnWriter(name, *NUMERIC_COLUMNS[name])
+                else:
+                    column = _TextColumnWriter(self.path, name)
+                for _ in range(self.num_rows): # The field first appears in this record
+                    column.append(None)
+                self.columns[name] = column
+        for name, column in self.columns.items():
+            column.append(record.get(name))
+        self.num_rows += 1
+
+    def close(self):
+        meta = {"version": STORE_VERSION, "num_rows": self.num_rows,
+                "columns": {name: column.finish(self.path) for name, column in self.columns.items()}}
+        temp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(temp_path, os.path.join(self.path, META_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class TextColumn:
+    """Memory-mapped UTF-8 column; rows are only decoded when they are read."""
+
+    def __init__(self, directory: str, name: str, is_json: bool):
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode='r')
+        data_path = os.path.join(directory, f"{name}.data")
+        # np.memmap cannot map empty files
+        self.data = np.memmap(data_path, dtype=np.uint8, mode='r') if os.path.getsize(data_path) else np.zeros(0, dtype=np.uint8)
+        self.is_json = is_json
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def texts(self, start: int, stop: int) -> List[str]:
+        """Rows start to stop as text, decoded from one contiguous read."""
+        offsets = self.offsets[start:stop + 1].tolist()
+        if not offsets:
+            return []
+        raw = self.data[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [raw[begin - base:end - base].decode('utf-8') for begin, end in zip(offsets[:-1], offsets[1:])]
+
+    def slice(self, start: int, stop: int) -> List:
+        texts = self.texts(start, stop)
+        return [json.loads(text) for text in texts] if self.is_json else texts
+
+    def to_array(self) -> np.ndarray:
+        return np.asarray(self.texts(0, len(self)), dtype=str)
+
+
+class DictionaryColumn:
+    """Memory-mapped integer codes into a list of distinct text values."""
+
+    def __init__(self, directory: str, name: str, is_json: bool):
+        self.codes = np.load(os.path.join(directory, f"{name}.codes.npy"), mmap_mode='r')
+        with open(os.path.join(directory, f"{name}.categories.json"), 'r', encoding='utf-8') as f:
+            self.categories = json.load(f)
+        self.values = [json.loads(text) for text in self.categories] if is_json else self.categories
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def slice(self, start: int, stop: int) -> List:
+        return [self.values[code] for code in self.codes[start:stop].tolist()]
+
+    def to_array(self) -> np.ndarray:
+        """The column as a NumPy string array, built from the codes without decoding row by row."""
+        if not self.categories:
+            return np.full(len(self), "")
+        return np.asarray(self.categories, dtype=str)[self.codes]
+
+
+class ColumnStore:
+    """
+    Read side of a column store. Numeric columns are memory-mapped NumPy arrays, text columns are
+    TextColumn/DictionaryColumn objects; only the columns that are asked for are opened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"{path} is a column store of version {self.meta.get('version')}, expected {STORE_VERSION}")
+        self.num_rows = self.meta["num_rows"]
+        self.opened: Dict[str, object] = {}
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.meta["columns"]
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.meta["columns"])
+
+    def column(self, name: str):
+        """np.ndarray (memory-mapped) for numeric columns, TextColumn or DictionaryColumn for text columns."""
+        if name not in self.opened:
+            meta = self.meta["columns"][name]
+            if meta["kind"] == "numeric":
+                self.opened[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+            elif meta["kind"] == "dictionary":
+                self.opened[name] = DictionaryColumn(self.path, name, meta["json"])
+            else:
+                self.opened[name] = TextColumn(self.path, name, meta["json"])
+        return self.opened[name]
+
+    def text_array(self, name: str) -> np.ndarray:
+        """A text column as a NumPy string array, or empty strings if the store has no such column."""
+        if name not in self:
+            return np.full(self.num_rows, "")
+        return self.column(name).to_array()
+
+    def _slice(self, name: str, start: int, stop: int) -> List:
+        column = self.column(name)
+        if not isinstance(column, np.ndarray):
+            return column.slice(start, stop)
+        dtype, _, missing = NUMERIC_COLUMNS.get(name, (str(column.dtype), None, None))
+        values = column[start:stop].tolist()
+        if dtype == 'int8':
+            return [None if value == -1 else bool(value) for value in values]
+        if dtype == 'float64':
+            return [None if value != value else value for value in values] # NaN marks missing
+        return [None if value == missing else value for value in values]
+
+    def iter_records(self, fields: Optional[Iterable[str]] = None, chunk_size: int = READ_CHUNK_ROWS) -> Iterator[Dict]:
+        """
+        Yield the rows as dicts, decoding chunk_size rows at a time.
+
+        Args:
+            fields: Columns to read; all columns if None. Missing columns are left out of the records.
+        """
+        names = [name for name in (self.column_names if fields is None else fields) if name in self]
+        for start in range(0, self.num_rows, chunk_size):
+            stop = min(start + chunk_size, self.num_rows)
+            columns = [self._slice(name, start, stop) for name in names]
+            for values in zip(*columns):
+                yield dict(zip(names, values))
+
+
+def convert_to_column_store(records: Iterable[Dict], path: str) -> int:
+    """Write records (e.g. iter_records of a JSON results file) to a column store. Returns the number of rows."""
+    with ColumnStoreWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.num_rows
+
+
+def main():
+    from result_io import iter_records
+
+    parser = argparse.ArgumentParser(description="Convert a results file (JSON array or JSON Lines) to a memory-mapped column store")
+    parser.add_argument("--input", type=str, required=True, help="Results file, or per-sample output of evaluation.py")
+    parser.add_argument("--output", type=str, required=True, help=f"Directory of the column store, conventionally ending in {COLUMN_STORE_SUFFIX}")
+    args = parser.parse_args()
+
+    num_rows = convert_to_column_store(iter_records(args.input), args.output)
+    store = ColumnStore(args.output)
+    kinds = ", ".join(f"{name} ({store.meta['columns'][name]['kind']})" for name in store.column_names)
+    print(f"Wrote {num_rows} rows to {args.output}: {kinds}")
+
+
+if __name__ == "__main__":
+    main()
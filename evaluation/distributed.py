@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from checkpoint import file_fingerprint
+from result_io import iter_records, iter_jsonl, RECORD_FIELDS
+
+JOB_VERSION = 1
+PLAN_FILE = 'job.json'
+
+# Seconds without a heartbeat after which a claimed shard counts as abandoned and may be claimed again.
+# Loading the judges happens while the first shard is claimed, so this should be well above the load time.
+DEFAULT_STALE_SECONDS = 600.0
+
+# Seconds between polls of the job directory while waiting for the plan or for shards claimed by other workers
+POLL_SECONDS = 5.0
+
+
+def shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}"
+
+
+def job_paths(job_dir: str) -> Dict[str, str]:
+    """Layout of a job directory: the plan, and one subdirectory each for shard inputs, claims and scores."""
+    return {"plan": os.path.join(job_dir, PLAN_FILE), "inputs": os.path.join(job_dir, "inputs"),
+            "claims": os.path.join(job_dir, "claims"), "scores": os.path.join(job_dir, "scores")}
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _write_atomic(path: str, lines: Iterable[str]):
+    """Write lines to a temporary file next to path, fsync it and rename it into place."""
+    temp_path = f"{path}.{default_worker_id()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def create_job(job_dir: str, result_path: str, shard_size: int, settings: Dict) -> Dict:
+    """
+    Split a results file into shards of shard_size consecutive records and write the job plan.
+
+    The plan records the fingerprint of the results file and the judge settings every worker uses, and is
+    written last, so workers only start once all shard inputs exist. Creating a job in a directory that
+    already holds the same job (same results file, shard size and settings) reuses it, so a coordinator
+    can be restarted without losing finished shards.
+
+    Returns:
+        The plan: {'version', 'input', 'sha256', 'num_records', 'shard_size', 'num_shards', 'settings'}.
+    """
+    paths = job_paths(job_dir)
+    fingerprint = file_fingerprint(result_path)
+    if os.path.exists(paths["plan"]):
+        plan = load_plan(job_dir)
+        if plan["sha256"] != fingerprint or plan["shard_size"] != shard_size or plan["settings"] != settings:
+            raise ValueError(f"{job_dir} already holds a job for different inputs or settings; use a new job directory")
+        print(f"Reusing the job in {job_dir}")
+        return plan
+
+    for path in (paths["inputs"], paths["claims"], paths["scores"]):
+        os.makedirs(path, exist_ok=True)
+    num_records = 0
+    shard = []
+    for record in iter_records(result_path, RECORD_FIELDS):
+        # Only the fields the judge and the output rows use
+        shard.append({field: record[field] for field in RECORD_FIELDS if field in record})
+        num_records += 1
+        if len(shard) == shard_size:
+            _write_shard_input(paths["inputs"], num_records // shard_size - 1, shard)
+            shard = []
+    if shard:
+        _write_shard_input(paths["inputs"], num_records // shard_size, shard)
+
+    plan = {"version": JOB_VERSION, "input": os.path.abspath(result_path), "sha256": fingerprint,
+            "num_records": num_records, "shard_size": shard_size,
+            "num_shards": (num_records + shard_size - 1) // shard_size, "settings": settings}
+    _write_atomic(paths["plan"], [json.dumps(plan, indent=2)])
+    return plan
+
+
+def _write_shard_input(directory: str, shard: int, records: List[Dict]):
+    _write_atomic(os.path.join(directory, f"{shard_name(shard)}.jsonl"),
+                  (json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+
+def load_plan(job_dir: str, wait: bool = False) -> Dict:
+    """Read the job plan; with wait, poll until the coordinator has written it."""
+    path = job_paths(job_dir)["plan"]
+    if wait and not os.path.exists(path):
+        print(f"Waiting for a coordinator to create the job in {job_dir}...")
+        while not os.path.exists(path):
+            time.sleep(POLL_SECONDS)
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get("version") != JOB_VERSION:
+        raise ValueError(f"{path} is a job of version {plan.get('version')}, expected {JOB_VERSION}")
+    return plan
+
+
+def filesystem_time(job_dir: str, worker_id: str) -> float:
+    """
+    Current time as seen by the shared filesystem: the modification time of a freshly touched file.
+    Lock ages are measured against it rather than the local clock, so clock skew between nodes does not
+    make live claims look abandoned. The file is removed again right away.
+    """
+    path = os.path.join(job_paths(job_dir)["claims"], f".clock-{worker_id}-{os.getpid()}-{threading.get_ident()}")
+    try:
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+        return os.stat(path).st_mtime
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ShardClaim:
+    """
+    Exclusive claim of one shard: a lock file created with O_CREAT | O_EXCL, so that of several workers trying
+    at once exactly one succeeds, also across nodes on a shared filesystem. While the claim is held, a thread
+    touches the lock every stale_seconds / 4 as a heartbeat. A lock whose heartbeat is older than stale_seconds
+    belongs to a dead worker and is taken over by renaming it away, which also succeeds for only one worker.
+    If the renamed file turns out not to be the stale lock that was looked at (another worker reclaimed the shard
+    in between, or the owner's heartbeat came back), it is put back and the claim is left alone.
+    """
+
+    def __init__(self, job_dir: str, shard: int, worker_id: str, stale_seconds: float = DEFAULT_STALE_SECONDS):
+        self.job_dir = job_dir
+        self.shard = shard
+        self.worker_id = worker_id
+        self.stale_seconds = stale_seconds
+        self.lock_path = os.path.join(job_paths(job_dir)["claims"], f"{shard_name(shard)}.lock")
+        self.stop = threading.Event()
+        self.heartbeat: Optional[threading.Thread] = None
+
+    def acquire(self) -> bool:
+        """Try to claim the shard, taking over an abandoned claim. Returns whether the claim is now held."""
+        if self._create():
+            return True
+        try:
+            lock_stat = os.stat(self.lock_path)
+            claim = read_claim(self.lock_path)
+            age = filesystem_time(self.job_dir, self.worker_id) - lock_stat.st_mtime
+        except FileNotFoundError: # Released in the meantime
+            return self._create()
+        if age < self.stale_seconds:
+            return False
+        stale_path = f"{self.lock_path}.stale-{self.worker_id}"
+        try:
+            os.rename(self.lock_path, stale_path)
+        except FileNotFoundError: # Another worker took it over first
+            return False
+        # Between the stat and the rename, another worker may have reclaimed the shard and created a fresh lock,
+        # or the owner may have refreshed its heartbeat; then the moved file is a live claim
+        moved_stat = os.stat(stale_path)
+        if (moved_stat.st_ino, moved_stat.st_mtime) != (lock_stat.st_ino, lock_stat.st_mtime) or read_claim(stale_path) != claim:
+            self._put_back(stale_path)
+            return False
+        print(f"Reclaiming {shard_name(self.shard)} from {claim.get('worker', 'an unknown worker')} "
+              f"(no heartbeat for {age:.0f}s)")
+        os.remove(stale_path)
+        return self._create()
+
+    def _put_back(self, moved_path: str):
+        """Move a live lock renamed away by mistake back into place, unless a newer lock has been created there."""
+        try:
+            # Unlike a rename, a hard link never replaces an existing lock
+            os.link(moved_path, self.lock_path)
+        except FileExistsError:
+            pass
+        os.remove(moved_path)
+
+    def _create(self) -> bool:
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid(), "claimed_at": time.time()}, f)
+        self.heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self.heartbeat.start()
+        return True
+
+    def _beat(self):
+        while not self.stop.wait(self.stale_seconds / 4):
+            # The lock may be missing for a moment while another worker checks it (see acquire); only this
+            # worker's own lock is refreshed
+            if read_claim(self.lock_path).get("worker") != self.worker_id:
+                continue
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                continue
+
+    def release(self):
+        """Stop the heartbeat and remove the lock, unless another worker has taken it over in the meantime."""
+        self.stop.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        if read_claim(self.lock_path).get("worker") == self.worker_id:
+            try:
+                os.remove(self.lock_path)
+            except FileNotFoundError:
+                pass
+
+
+def read_claim(path: str) -> Dict:
+    """Content of a lock file, or {} if it is gone or still being written."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def score_path(job_dir: str, shard: int) -> str:
+    return os.path.join(job_paths(job_dir)["scores"], f"{shard_name(shard)}.jsonl")
+
+
+def pending_shards(job_dir: str, plan: Dict) -> List[int]:
+    """Shards without a score file."""
+    return [shard for shard in range(plan["num_shards"]) if not os.path.exists(score_path(job_dir, shard))]
+
+
+def run_worker(job_dir: str, plan: Dict, score_shard: Callable[[Iterable[Dict], int], Iterator[Dict]],
+               worker_id: Optional[str] = None, stale_seconds: float = DEFAULT_STALE_SECONDS) -> int:
+    """
+    Claim and score shards until every shard of the job has a score file.
+
+    Args:
+        score_shard: Called with the records of a shard and the index of its first record; yields the output
+            rows (see result_io.make_output_row) of the shard in order.
+        worker_id: Name of this worker in lock files; host name and process id by default.
+        stale_seconds: Heartbeat age after which another worker's claim is taken over.
+
+    Returns:
+        The number of shards this worker scored.
+    """
+    worker_id = worker_id or default_worker_id()
+    num_scored = 0
+    while True:
+        pending = pending_shards(job_dir, plan)
+        if not pending:
+            return num_scored
+        claim = None
+        for shard in pending:
+            candidate = ShardClaim(job_dir, shard, worker_id, stale_seconds)
+            if candidate.acquire():
+                claim = candidate
+                break
+        if claim is None:
+            # The remaining shards are claimed by live workers; wait in case one of them dies
+            time.sleep(POLL_SECONDS)
+            continue
+        try:
+            if os.path.exists(score_path(job_dir, claim.shard)): # Finished between the listing and the claim
+                continue
+            start_time = time.perf_counter()
+            start = claim.shard * plan["shard_size"]
+            records = list(iter_jsonl(os.path.join(job_paths(job_dir)["inputs"], f"{shard_name(claim.shard)}.jsonl")))
+            _write_atomic(score_path(job_dir, claim.shard),
+                          (json.dumps(row, ensure_ascii=False) + "\n" for row in score_shard(records, start)))
+            num_scored += 1
+            print(f"{worker_id}: scored {shard_name(claim.shard)} ({len(records)} samples) in {time.perf_counter() - start_time:.1f}s, "
+                  f"{len(pending) - 1} shards left")
+        finally:
+            claim.release()
+
+
+def iter_merged_rows(job_dir: str, plan: Dict) -> Iterator[Dict]:
+    """Output rows of all shards in input order. Raises ValueError if a shard has not been scored."""
+    missing = pending_shards(job_dir, plan)
+    if missing:
+        raise ValueError(f"{len(missing)} of {plan['num_shards']} shards of {job_dir} have not been scored yet")
+    for shard in range(plan["num_shards"]):
+        yield from iter_jsonl(score_path(job_dir, shard))
+
+
+def wait_for_shards(job_dir: str, plan: Dict):
+    """Poll until every shard has a score file, printing progress as shards finish."""
+    num_pending = None
+    while True:
+        pending = pending_shards(job_dir, plan)
+        if len(pending) != num_pending:
+            num_pending = len(pending)
+            print(f"{plan['num_shards'] - num_pending} of {plan['num_shards']} shards scored")
+        if not pending:
+            return
+        time.sleep(POLL_SECONDS)
+
+
+def job_status(job_dir: str, plan: Dict, stale_seconds: float = DEFAULT_STALE_SECONDS) -> Dict[str, List]:
+    """
+    Returns:
+        {'scored': shards, 'running': (shard, worker) pairs, 'stale': (shard, worker) pairs, 'waiting': shards}.
+    """
+    now = filesystem_time(job_dir, f"status-{socket.gethostname()}")
+    status = {"scored": [], "running": [], "stale": [], "waiting": []}
+    for shard in range(plan["num_shards"]):
+        lock_path = os.path.join(job_paths(job_dir)["claims"], f"{shard_name(shard)}.lock")
+        if os.path.exists(score_path(job_dir, shard)):
+            status["scored"].append(shard)
+            continue
+        try:
+            age = now - os.stat(lock_path).st_mtime
+        except FileNotFoundError:
+            status["waiting"].append(shard)
+            continue
+        worker = read_claim(lock_path).get("worker")
+        status["stale" if age >= stale_seconds else "running"].append((shard, worker))
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the progress of a distributed evaluation job (see evaluation.py --job_dir)")
+    parser.add_argument("--job_dir", type=str, required=True, help="Job directory on the shared filesystem")
+    parser.add_argument("--stale_seconds", type=float, default=DEFAULT_STALE_SECONDS, help="Heartbeat age after which a claim counts as abandoned")
+    args = parser.parse_args()
+
+    plan = load_plan(args.job_dir)
+    status = job_status(args.job_dir, plan, args.stale_seconds)
+    print(f"Job for {plan['input']}: {plan['num_records']} samples in {plan['num_shards']} shards of {plan['shard_size']}")
+    print(f"Scored: {len(status['scored'])}, running: {len(status['running'])}, "
+          f"abandoned: {len(status['stale'])}, waiting: {len(status['waiting'])}")
+    for shard, worker in status["running"]:
+        print(f"  {shard_name(shard)}: {worker}")
+    for shard, worker in status["stale"]:
+        print(f"  {shard_name(shard)}: {worker} (abandoned, will be reclaimed)")
+
+
+if __name__ == "__main__":
+    main()
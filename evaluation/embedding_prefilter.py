@@ -0,0 +1,171 @@
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from lazy_import import LazyModule
+from prompt_tokens import clean_field
+from L3_Lite import normalize_answer
+from question_scorers import parse_boolean, parse_locations
+
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+
+# Small sentence encoder (mean-pooled, as in sentence-transformers' all-MiniLM-L6-v2)
+DEFAULT_ENCODER_PATH = "llm_weights/sentence-transformers/all-MiniLM-L6-v2"
+
+# Pairs at or above the high threshold score 100, pairs at or below the low threshold score 0;
+# tune them for the encoder with --prefilter_validation
+DEFAULT_HIGH_THRESHOLD = 0.9
+DEFAULT_LOW_THRESHOLD = 0.2
+
+# Answers of at most this many words ("2", "yes", "upper left") are never scored 100 on similarity alone:
+# sentence encoders put "2"/"3", "yes"/"no" and "upper left"/"upper right" well above the high threshold
+SHORT_ANSWER_WORDS = 3
+NEGATION_WORDS = {'no', 'not', 'never', 'none', 'nothing', 'without', 'nobody', 'neither', 'nor'}
+
+DEFAULT_EMBED_BATCH_SIZE = 256
+DEFAULT_GT_CACHE_SIZE = 20000 # Ground-truth embeddings kept (about 1.5 KB each for a 384-dimensional encoder)
+MAX_ENCODER_TOKENS = 128 # Answers are short; longer ones are truncated
+
+
+def answer_facts(answer) -> tuple:
+    """The numbers, yes/no value, locations and negation stated in an answer, which similarity does not capture."""
+    normalized = normalize_answer(answer)
+    # Contractions ("isn't") are looked for before normalize_answer drops their apostrophe
+    negated = any(token in NEGATION_WORDS for token in normalized.split()) or re.search(r"n['’]t\b", clean_field(answer).lower()) is not None
+    return (sorted(re.findall(r'-?\d+(?:\.\d+)?', normalized)), parse_boolean(answer), parse_locations(answer), negated)
+
+
+def can_score_similar(pred, gt) -> bool:
+    """Whether a highly similar pair may score 100 without the judge: both answers long enough and their facts agree."""
+    if min(len(normalize_answer(pred).split()), len(normalize_answer(gt).split())) <= SHORT_ANSWER_WORDS:
+        return False
+    return answer_facts(pred) == answer_facts(gt)
+
+
+class EmbeddingPrefilter:
+    """
+    Scores (prediction, ground truth) pairs by the cosine similarity of their sentence embeddings when it is
+    clearly high (near-paraphrases, 100) or clearly low (unrelated answers, 0), and leaves the ambiguous middle
+    band to the L3-Lite judge. Short answers and answers whose numbers, yes/no value, locations or negation differ
+    are never scored 100 (see can_score_similar). Ground-truth embeddings are cached, since ground truths repeat across models
+    and runs of a benchmark.
+    """
+
+    def __init__(self, encoder_path: str = DEFAULT_ENCODER_PATH, device: str = "cpu",
+                 high_threshold: float = DEFAULT_HIGH_THRESHOLD, low_threshold: float = DEFAULT_LOW_THRESHOLD,
+                 batch_size: int = DEFAULT_EMBED_BATCH_SIZE, cache_size: int = DEFAULT_GT_CACHE_SIZE):
+        """
+        Args:
+            encoder_path: Local directory of a transformers encoder and its tokenizer.
+            device: Device to run the encoder on.
+            high_threshold: Cosine similarity from which a pair scores 100 without the judge.
+            low_threshold: Cosine similarity up to which a pair scores 0 without the judge.
+            batch_size: Texts embedded per forward pass.
+            cache_size: Number of ground-truth embeddings kept, least recently used ones are dropped first.
+        """
+        if not -1.0 <= low_threshold <= high_threshold <= 1.0:
+            raise ValueError(f"Prefilter thresholds must satisfy -1 <= low <= high <= 1, got low={low_threshold}, high={high_threshold}")
+        if "cuda" in device and not torch.cuda.is_available():
+            print(f"Warning: Specified device is {device}, but CUDA is not available. Will use CPU.")
+            device = "cpu"
+        self.device = device
+        self.high_threshold = high_threshold
+        self.low_threshold = low_threshold
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.gt_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.stats = {"pairs": 0, "similar": 0, "different": 0, "passed": 0, "guarded": 0, "gt_cache_hits": 0}
+
+        print(f"Loading prefilter encoder from {encoder_path}")
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(encoder_path)
+        self.model = transformers.AutoModel.from_pretrained(encoder_path).to(self.device)
+        self.model.eval()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized mean-pooled embeddings of texts, shape (len(texts), dim)."""
+        if not texts:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        # Batches of similar lengths waste little on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                    max_length=MAX_ENCODER_TOKENS, return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state.to(dtype=torch.float32)
+            mask = inputs["attention_mask"].unsqueeze(-1).to(dtype=torch.float32)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+            pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            embeddings[batch] = pooled.cpu().numpy()
+        return embeddings
+
+    def similarities(self, preds: List[str], gts: List[str]) -> np.ndarray:
+        """Cosine similarity of every (prediction, ground truth) pair."""
+        preds = [clean_field(pred) for pred in preds]
+        gts = [clean_field(gt) for gt in gts]
+
+        # Predictions and the ground truths missing from the cache are embedded together
+        missing = [gt for gt in dict.fromkeys(gts) if gt not in self.gt_cache]
+        embeddings = self.embed(preds + missing)
+        pred_embeddings = embeddings[:len(preds)]
+
+        gt_embeddings = {gt: self.gt_cache[gt] for gt in dict.fromkeys(gts) if gt in self.gt_cache}
+        self.stats["gt_cache_hits"] += sum(1 for gt in gts if gt in gt_embeddings)
+        for gt in gt_embeddings:
+            self.gt_cache.move_to_end(gt)
+        for gt, embedding in zip(missing, embeddings[len(preds):]):
+            gt_embeddings[gt] = embedding
+            self.gt_cache[gt] = embedding
+        while len(self.gt_cache) > self.cache_size:
+            self.gt_cache.popitem(last=False)
+
+        if not preds:
+            return np.zeros(0, dtype=np.float32)
+        return np.einsum('ij,ij->i', pred_embeddings, np.stack([gt_embeddings[gt] for gt in gts]))
+
+    def score(self, preds: List[str], gts: List[str]) -> List[Optional[float]]:
+        """
+        Returns:
+            One entry per pair: 100.0 or 0.0 if the similarity is outside the ambiguous band, None if the
+            pair still needs the L3-Lite judge.
+        """
+        scores = []
+        for pred, gt, similarity in zip(preds, gts, self.similarities(preds, gts)):
+            if similarity >= self.high_threshold:
+                if can_score_similar(pred, gt):
+                    scores.append(100.0)
+                    self.stats["similar"] += 1
+                else:
+                    scores.append(None)
+                    self.stats["passed"] += 1
+                    self.stats["guarded"] += 1
+            elif similarity <= self.low_threshold:
+                scores.append(0.0)
+                self.stats["different"] += 1
+            else:
+                scores.append(None)
+                self.stats["passed"] += 1
+        self.stats["pairs"] += len(scores)
+        return scores
+
+
+def compare_with_judge(prefilter_scores: List[float], judge_scores: List[float]) -> Dict:
+    """
+    Agreement of prefilter scores with the judge's scores of the same samples.
+
+    Returns:
+        {'samples', 'decision_agreement': fraction on the same side of 50, 'mean_abs_diff'}.
+    """
+    if not prefilter_scores:
+        return {"samples": 0, "decision_agreement": 1.0, "mean_abs_diff": 0.0}
+    prefilter = np.asarray(prefilter_scores, dtype=np.float64)
+    judge = np.asarray(judge_scores, dtype=np.float64)
+    return {
+        "samples": len(prefilter),
+        "decision_agreement": float(np.mean((prefilter >= 50) == (judge >= 50))),
+        "mean_abs_diff": float(np.abs(prefilter - judge).mean()),
+    }
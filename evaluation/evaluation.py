@@ -1,51 +1,481 @@
 import argparse
 import json
-from L3_Lite import L3Lite
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from tqdm import tqdm
+from L3_Lite import L3Lite, SCORING_MODES, DEFAULT_MAX_BATCH_TOKENS, DTYPE_POLICIES
+from model_registry import load_model_registry
+from judge_backends import BACKENDS, DEFAULT_ONNX_DIR
+from embedding_prefilter import EmbeddingPrefilter, compare_with_judge, DEFAULT_HIGH_THRESHOLD, DEFAULT_LOW_THRESHOLD
+from question_scorers import apply_question_scorers, load_scorer_map
+from parallel_eval import ParallelEvaluator
+from result_io import iter_records, iter_chunks, DEFAULT_CHUNK_SIZE, ResultWriter, make_output_row, RECORD_FIELDS
+from checkpoint import ScoreJournal
+from distributed import create_job, load_plan, run_worker, wait_for_shards, iter_merged_rows, DEFAULT_STALE_SECONDS
+from report import build_report, export_report
+from server import ScoringClient
+from metrics import format_snapshot
+
+
+def score_records(records: Iterable[Dict], evaluate: Callable[..., List[Dict]], chunk_size: int, type_scorers: bool,
+                  counters: Dict[str, int], done: Optional[Iterable[Tuple[int, Dict]]] = None,
+                  prefilter: Optional[Callable[[List[str], List[str]], List[Optional[float]]]] = None,
+                  type_scorer_keywords: bool = False) -> Iterator[Tuple[int, Dict, Dict]]:
+    """
+    Score a stream of result records chunk by chunk.
+
+    With type_scorers, the deterministic question-type scorers run first and only the samples they
+    cannot resolve are passed to evaluate (called with return_details=True); type_scorer_keywords also
+    picks scorers for unregistered question types by keyword (see question_scorers.get_scorer). done streams the
+    (index, details) pairs of a resumed journal in increasing index order (ScoreJournal.iter_done); those records keep
+    their journaled details and are not evaluated again. It is read alongside the records, so it is never held in memory.
+    prefilter (e.g. EmbeddingPrefilter.score) gets the remaining (preds, gts) before the judge and returns
+    a score or None per sample; only the None samples are evaluated.
+    counters collects the number of samples resolved each way.
+
+    Yields:
+        (index, record, details) in input order, where details is a dict as returned by L3Lite.evaluate
+        with return_details=True, plus 'type_scorer'/'prefilter'/'resumed' flags.
+    """
+    done = iter(done or ())
+    next_done = next(done, None)
+    for chunk in iter_chunks(enumerate(records), chunk_size):
+        details = [None] * len(chunk)
+        pending = []
+        for position, (index, item) in enumerate(chunk):
+            while next_done is not None and next_done[0] < index:
+                next_done = next(done, None) # A repeated journal entry
+            if next_done is not None and next_done[0] == index:
+                details[position] = dict(next_done[1], resumed=True)
+                next_done = next(done, None)
+            else:
+                pending.append(position)
+        counters['resumed'] += len(chunk) - len(pending)
+
+        if type_scorers:
+            # Deterministic scorers first, the L3-Lite judge only for the samples they could not resolve
+            type_scores = apply_question_scorers([chunk[position][1].get('question_type') for position in pending],
+                                                 [chunk[position][1]['pred'] for position in pending],
+                                                 [chunk[position][1]['gt'] for position in pending],
+                                                 match_keywords=type_scorer_keywords)
+            unresolved = []
+            for position, score in zip(pending, type_scores):
+                if score is None:
+                    unresolved.append(position)
+                else:
+                    details[position] = {"score": score, "exact_match": False, "models": {}, "type_scorer": True}
+            counters['type_scored'] += len(pending) - len(unresolved)
+            pending = unresolved
+
+        if prefilter is not None and pending:
+            # Clear paraphrases and clearly unrelated answers are scored without the judge
+            prefilter_scores = prefilter([chunk[position][1]['pred'] for position in pending],
+                                         [chunk[position][1]['gt'] for position in pending])
+            unresolved = []
+            for position, score in zip(pending, prefilter_scores):
+                if score is None:
+                    unresolved.append(position)
+                else:
+                    details[position] = {"score": score, "exact_match": False, "models": {}, "prefilter": True}
+            counters['prefiltered'] += len(pending) - len(unresolved)
+            pending = unresolved
+
+        # Extract questions, predictions, and ground truths of the samples left for the judge
+        judged_details = evaluate([chunk[position][1]['question'] for position in pending],
+                                  [chunk[position][1]['pred'] for position in pending],
+                                  [chunk[position][1]['gt'] for position in pending],
+                                  return_details=True) if pending else []
+        for position, sample_details in zip(pending, judged_details):
+            details[position] = sample_details
+        counters['judged'] += len(pending)
+
+        for (index, item), sample_details in zip(chunk, details):
+            yield index, item, sample_details
+
+
+def prefill_judges(l3_lite: L3Lite, result_path: str, chunk_size: int, type_scorers: bool, journal: Optional[ScoreJournal] = None,
+                   prefilter: Optional[Callable[[List[str], List[str]], List[Optional[float]]]] = None,
+                   type_scorer_keywords: bool = False):
+    """
+    Run every judge but the last over the whole results file, one judge at a time, writing its scores to the
+    score cache. The final pass then reads them from the cache and only needs the last judge, so a RAM budget
+    that holds one judge is enough and no judge is loaded more than once.
+    """
+    for model_name in l3_lite.judge_order()[:-1]:
+        print(f"Scoring all samples with {model_name}...")
+
+        def prefill(qst, preds, gts, return_details=False):
+            l3_lite.prefill_cache(model_name, qst, preds, gts)
+            return [{}] * len(preds) # Only the scores written to the cache matter
+
+        # The same samples as in the final pass reach the judge (resumed, type-scored and prefiltered samples are skipped)
+        counters = {'type_scored': 0, 'prefiltered': 0, 'judged': 0, 'resumed': 0}
+        done = journal.iter_done() if journal is not None else None
+        for _ in score_records(iter_records(result_path, RECORD_FIELDS), prefill, chunk_size, type_scorers, counters, done, prefilter,
+                               type_scorer_keywords):
+            pass
+
+
+# Arguments that decide how samples are scored; in a distributed job the coordinator's values apply to every worker
+JOB_SETTINGS = ['model_names', 'model_config', 'scoring_mode', 'max_batch_tokens', 'no_prefix_cache', 'free_fallback',
+                'exact_match', 'type_scorers', 'type_scorer_map', 'type_scorer_keywords', 'prefilter_encoder', 'prefilter_high', 'prefilter_low',
+                'cascade_threshold', 'dtype', 'quantize', 'backend', 'chunk_size']
+
+# Arguments of the judge itself; with --server the server's own values apply (see server.py), so they must not be given
+SERVER_JUDGE_SETTINGS = ['model_names', 'model_config', 'ram_budget_mb', 'scoring_mode', 'max_batch_tokens', 'no_prefix_cache',
+                         'free_fallback', 'cache_path', 'exact_match', 'cascade_threshold', 'concurrent_models', 'dtype',
+                         'quantize', 'backend', 'onnx_dir']
+
+
+class RunSummary:
+    """
+    Totals of a run, gathered from its output rows (see make_output_row), so that a single-process run and the
+    coordinator of a distributed job print the same summary.
+    """
+
+    def __init__(self):
+        self.total_score = 0.0
+        self.num_samples = 0
+        self.sources: Dict[str, int] = {}
+        self.escalation: Dict[Optional[str], List[int]] = {} # question type -> [samples judged by a cascade, samples escalated]
+
+    def add(self, row: Dict):
+        self.total_score += row["score"]
+        self.num_samples += 1
+        self.sources[row["source"]] = self.sources.get(row["source"], 0) + 1
+        if row["escalated"] is not None:
+            counts = self.escalation.setdefault(row["question_type"], [0, 0])
+            counts[0] += 1
+            counts[1] += row["escalated"]
+
+    def print_sources(self, args: argparse.Namespace, prefilter: Optional[EmbeddingPrefilter] = None):
+        """
+        How the samples were scored, for the options in args that decide it (see JOB_SETTINGS).
+        prefilter adds the statistics that only the process running the prefilter has.
+        """
+        print("\nSamples by source: " + ", ".join(f"{source} {count}" for source, count in sorted(self.sources.items())))
+        if args.type_scorers:
+            print(f"\nQuestion-type scorers resolved {self.sources.get('type_scorer', 0)} of {self.num_samples} samples.")
+        if args.prefilter_encoder:
+            prefiltered = self.sources.get('prefilter', 0)
+            judged = self.sources.get('judge', 0)
+            print(f"\nEmbedding prefilter: {prefiltered} of {prefiltered + judged} samples scored directly, "
+                  f"{judged} passed to the judge (pass-through rate {100.0 * judged / max(prefiltered + judged, 1):.1f}%).")
+            if prefilter is not None:
+                print(f"Of the samples scored in this run, {prefilter.stats['guarded']} were similar but short or had conflicting "
+                      f"facts; {prefilter.stats['gt_cache_hits']} ground-truth embeddings were taken from the cache.")
+        if args.exact_match:
+            print(f"\n{self.sources.get('exact_match', 0)} of {self.num_samples} samples were exact matches.")
+        if self.escalation:
+            num_cascaded = sum(counts[0] for counts in self.escalation.values())
+            num_escalated = sum(counts[1] for counts in self.escalation.values())
+            print(f"\nCascade: {num_escalated} of {num_cascaded} judged samples escalated ({100.0 * num_escalated / num_cascaded:.1f}%).")
+            for question_type, (cascaded, escalated) in sorted(self.escalation.items(), key=lambda item: str(item[0])):
+                print(f"  {question_type}: {escalated} of {cascaded} escalated ({100.0 * escalated / cascaded:.1f}%)")
+
+    def print_overall(self):
+        if self.num_samples: # Avoid division by zero if no samples were evaluated
+            print("\nOverall Evaluation Results:")
+            print(f"Number of Samples: {self.num_samples}")
+            print(f"Average L3-Lite Score: {self.total_score / self.num_samples:.4f}")
+        else:
+            print("\nNo samples were evaluated.")
+
+
+def run_coordinator(args: argparse.Namespace):
+    """
+    Split the results file into shards in args.job_dir, wait until workers have scored all of them and merge
+    their output rows into args.output, in the same order and format as a single-process run.
+    """
+    plan = create_job(args.job_dir, args.result_path, args.shard_size, {name: getattr(args, name) for name in JOB_SETTINGS})
+    print(f"Job for {plan['num_records']} samples in {plan['num_shards']} shards of {plan['shard_size']}; "
+          f"start workers with: evaluation.py --job_dir {args.job_dir} --role worker")
+    wait_for_shards(args.job_dir, plan)
+
+    summary = RunSummary()
+    writer = ResultWriter(args.output) if args.output else None
+    try:
+        for row in iter_merged_rows(args.job_dir, plan):
+            if writer is not None:
+                writer.write(row)
+            summary.add(row)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    summary.print_sources(args)
+    if writer is not None:
+        print(f"\nPer-sample results written to {args.output}")
+    summary.print_overall()
+
+    if args.report_dir and summary.num_samples:
+        export_report(build_report(args.output, ['question_type', 'image']), args.report_dir)
+        print(f"Breakdown report written to {args.report_dir}")
+
+
+def evaluate_results(args: argparse.Namespace, parser: argparse.ArgumentParser, plan: Optional[Dict] = None):
+    """Score args.result_path with the options of main(), or the shards of a distributed job as a worker of plan."""
+    l3_lite_kwargs = dict(model_names=args.model_names, device=args.device,
+                          model_registry=load_model_registry(args.model_config) if args.model_config else None,
+                          ram_budget_mb=args.ram_budget_mb, scoring_mode=args.scoring_mode,
+                          max_batch_tokens=args.max_batch_tokens, use_prefix_cache=not args.no_prefix_cache,
+                          constrained_fallback=not args.free_fallback,
+                          cache_path=args.cache_path, exact_match_shortcut=args.exact_match,
+                          concurrent_models=args.concurrent_models, dtype=args.dtype, quantize=args.quantize,
+                          backend=args.backend, onnx_dir=args.onnx_dir,
+                          cascade_threshold=args.cascade_threshold, verbose=args.verbose, metrics=bool(args.metrics_path))
+    # Open the journal first, so that a resume against a changed results file fails before any model is loaded
+    journal = ScoreJournal(args.checkpoint_path, args.result_path, resume=args.resume) if args.checkpoint_path else None
+
+    parallel_evaluator = None
+    l3_lite = None
+    if args.server:
+        # The server keeps its models resident; its own settings (models, dtype, cache...) apply, see SERVER_JUDGE_SETTINGS
+        client = ScoringClient(args.server)
+        if not client.health():
+            parser.error(f"No L3-Lite server is answering at {args.server}")
+        evaluate = client.evaluate
+    elif args.workers > 1:
+        # Every worker process initializes its own L3-Lite evaluator once and is reused for every chunk
+        parallel_evaluator = ParallelEvaluator(l3_lite_kwargs, args.workers)
+        evaluate = parallel_evaluator.evaluate
+    else:
+        # Initialize the L3-Lite evaluator
+        l3_lite = L3Lite(**l3_lite_kwargs)
+        evaluate = l3_lite.evaluate
+
+    # The prefilter runs in this process, in front of whichever judge backend is used
+    prefilter = None
+    if args.prefilter_encoder:
+        prefilter = EmbeddingPrefilter(args.prefilter_encoder, device=args.device,
+                                       high_threshold=args.prefilter_high, low_threshold=args.prefilter_low)
+
+    if plan is not None:
+        def score_shard(records, start):
+            counters = {'type_scored': 0, 'prefiltered': 0, 'judged': 0, 'resumed': 0}
+            for i, result, details in score_records(records, evaluate, args.chunk_size, args.type_scorers, counters,
+                                                    prefilter=prefilter.score if prefilter is not None else None,
+                                                    type_scorer_keywords=args.type_scorer_keywords):
+                yield make_output_row(start + i, result, details)
+
+        try:
+            num_scored = run_worker(args.job_dir, plan, score_shard, args.worker_id, args.stale_seconds)
+        finally:
+            if parallel_evaluator is not None:
+                parallel_evaluator.close()
+        print(f"\nAll shards of {args.job_dir} are scored; this worker scored {num_scored}.")
+        return
+
+    # Read the results file record by record (JSON array, JSON Lines or column store) and evaluate it chunk by chunk
+    records = iter_records(args.result_path, RECORD_FIELDS)
+    counters = {'type_scored': 0, 'prefiltered': 0, 'judged': 0, 'resumed': 0}
+
+    writer = ResultWriter(args.output) if args.output else None
+
+    # Per-sample console output only in verbose mode; printing every sample slows down large runs
+    if args.verbose:
+        print("\nEvaluation Results:")
+    summary = RunSummary()
+    metrics = None
+    validation_samples = [] # First judged samples, re-scored by the full ensemble with --cascade_validation
+    prefilter_samples = [] # First prefiltered samples and their scores, re-scored by the judge with --prefilter_validation
+    prefilter_validation = None
+    try:
+        if args.schedule == 'judge_major':
+            prefill_judges(l3_lite, args.result_path, args.chunk_size, args.type_scorers, journal,
+                           prefilter.score if prefilter is not None else None, args.type_scorer_keywords)
+        done = journal.iter_done() if journal is not None else None
+        scored = score_records(records, evaluate, args.chunk_size, args.type_scorers, counters, done,
+                               prefilter.score if prefilter is not None else None, args.type_scorer_keywords)
+        for i, result, details in tqdm(scored, desc="Evaluating samples", unit="sample", disable=args.verbose):
+            score = details["score"]
+            if journal is not None and not details.get("resumed"):
+                journal.append(i, details)
+            row = make_output_row(i, result, details)
+            if writer is not None:
+                writer.write(row)
+            if args.verbose:
+                print(f"\nSample {i+1}:")
+                print(f"Image: {result['image']}")
+                print(f"Question Type: {result['question_type']}")
+                print(f"Question: {result['question']}")
+                print(f"Prediction: {result['pred']}")
+                print(f"Ground Truth: {result['gt']}")
+                print(f"L3-Lite Score: {score:.4f}")
+                print(f"Explanation: {'Semantically Similar' if score > 0.5 else 'Semantically Different'}") # 0-1 scale from L3-Lite
+            # Resumed samples count with their journaled flags, like in the "taken from the journal" line
+            summary.add(row)
+            if "escalated" in details:
+                if len(validation_samples) < args.cascade_validation:
+                    validation_samples.append((result['question'], result['pred'], result['gt']))
+            if details.get("prefilter") and len(prefilter_samples) < args.prefilter_validation:
+                prefilter_samples.append((result['question'], result['pred'], result['gt'], score))
+        if prefilter_samples:
+            # While the judge (workers, server) is still available
+            judge_scores = evaluate([t[0] for t in prefilter_samples], [t[1] for t in prefilter_samples], [t[2] for t in prefilter_samples])
+            prefilter_validation = compare_with_judge([t[3] for t in prefilter_samples], judge_scores)
+        # Collect the metrics while the workers are still running
+        if args.metrics_path:
+            if args.server:
+                metrics = client.stats().get("judge") # Cumulative over the server's lifetime
+                if metrics is None:
+                    print("Warning: The L3-Lite server does not collect metrics (start it with --metrics).")
+            elif parallel_evaluator is not None:
+                metrics = parallel_evaluator.get_metrics()
+            else:
+                metrics = l3_lite.get_metrics()
+    finally:
+        if parallel_evaluator is not None:
+            parallel_evaluator.close()
+        if journal is not None:
+            journal.close()
+        if writer is not None:
+            writer.close()
+
+    summary.print_sources(args, prefilter)
+    if prefilter_validation is not None:
+        print(f"Prefilter validation on {prefilter_validation['samples']} prefiltered samples: "
+              f"{100.0 * prefilter_validation['decision_agreement']:.1f}% on the same side of 50 as the judge, "
+              f"mean difference {prefilter_validation['mean_abs_diff']:.2f}.")
+    if args.resume:
+        print(f"\n{counters['resumed']} of {summary.num_samples} samples were taken from the journal.")
+    if l3_lite is not None and l3_lite.score_cache is not None:
+        stats = l3_lite.score_cache.stats()
+        print(f"\nScore cache: {stats['hits']} hits, {stats['misses']} misses.")
+    if l3_lite is not None and l3_lite.batch_failures:
+        print(f"\nWarning: Failed batches were re-scored one sample at a time: "
+              + ", ".join(f"{model_name} {count}" for model_name, count in sorted(l3_lite.batch_failures.items())) + ".")
+    if l3_lite is not None and l3_lite.first_score_seconds is not None:
+        print(f"\nL3-Lite startup: {l3_lite.startup_seconds:.2f}s, time to first score: {l3_lite.first_score_seconds:.2f}s.")
+    if writer is not None:
+        print(f"\nPer-sample results written to {args.output}")
+
+    # Print average score
+    summary.print_overall()
+
+    # After the summary, so that the score-cache and timing figures above only cover the run itself
+    if validation_samples:
+        validation = l3_lite.validate_cascade([t[0] for t in validation_samples], [t[1] for t in validation_samples],
+                                              [t[2] for t in validation_samples])
+        print(f"\nCascade validation on {validation['samples']} samples: escalation rate {100.0 * validation['escalation_rate']:.1f}%, "
+              f"{100.0 * validation['agreement']:.1f}% within 5 points of the full ensemble, "
+              f"{100.0 * validation['decision_agreement']:.1f}% on the same side of 50, "
+              f"mean difference {validation['mean_abs_diff']:.2f}, largest {validation['max_abs_diff']:.2f}.")
+
+    if metrics is not None:
+        with open(args.metrics_path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+        print(f"\nL3-Lite stage timings and counters (written to {args.metrics_path}):")
+        for line in format_snapshot(metrics):
+            print(line)
+
+    if args.report_dir and summary.num_samples:
+        export_report(build_report(args.output, ['question_type', 'image']), args.report_dir)
+        print(f"Breakdown report written to {args.report_dir}")
+
+    if l3_lite is not None and l3_lite.score_cache is not None:
+        l3_lite.score_cache.close()
+
 
 def main():
     parser = argparse.ArgumentParser(description="Evaluate prediction results using L3-Lite")
     parser.add_argument("--model_names", nargs="+", default=['Qwen2.5-3B-Instruct'], help="List of model names to use")
+    parser.add_argument("--model_config", type=str, default=None, help="JSON file mapping model names to weight directories, used instead of the built-in model paths (see model_registry.py)")
+    parser.add_argument("--ram_budget_mb", type=float, default=None, help="Memory the loaded judges' weights may take together; the least recently used judge is evicted to load another")
+    parser.add_argument("--schedule", type=str, default='interleaved', choices=['interleaved', 'judge_major'], help="'interleaved': every chunk goes through every judge; 'judge_major': all samples go through one judge before the next is loaded")
     parser.add_argument("--device", type=str, default='cuda:3', help="Device to run on")
     parser.add_argument("--result_path", type=str, default='/data/zhangyu/tmp/results/result.json', help="Path to the results file")
+    parser.add_argument("--scoring_mode", type=str, default='logits', choices=SCORING_MODES, help="'logits': one forward pass per sample, generate only as a fallback; 'generate': always generate")
+    parser.add_argument("--max_batch_tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS, help="Budget of padded tokens per batch in 'logits' mode (1 disables batching)")
+    parser.add_argument("--no_prefix_cache", action="store_true", help="Re-encode the fixed prompt prefix for every batch instead of reusing its cached key/values")
+    parser.add_argument("--free_fallback", action="store_true", help="In 'logits' mode, generate the fallback answer freely and search it for a number instead of decoding a number between 0.00 and 1.00 directly")
+    parser.add_argument("--cache_path", type=str, default=None, help="Persistent score cache (SQLite file); already scored samples are read from it on re-runs")
+    parser.add_argument("--exact_match", action="store_true", help="Score predictions that equal the ground truth after normalization as 100 without running the models")
+    parser.add_argument("--type_scorers", action="store_true", help="Score counting, yes/no and location questions with deterministic per-question-type scorers; only unresolved samples go to L3-Lite")
+    parser.add_argument("--type_scorer_map", type=str, default=None, help="JSON file mapping the dataset's question_type names to scorers ('numeric', 'boolean', 'location'); other types go to L3-Lite")
+    parser.add_argument("--type_scorer_keywords", action="store_true", help="Also pick scorers for unmapped question types by keywords in their names (e.g. 'counting', 'yes/no')")
+    parser.add_argument("--prefilter_encoder", type=str, default=None, help="Sentence encoder directory (e.g. all-MiniLM-L6-v2); enables the embedding prefilter, which scores clear paraphrases and clearly unrelated answers without the judge")
+    parser.add_argument("--prefilter_high", type=float, default=DEFAULT_HIGH_THRESHOLD, help="Cosine similarity from which the prefilter scores a sample 100")
+    parser.add_argument("--prefilter_low", type=float, default=DEFAULT_LOW_THRESHOLD, help="Cosine similarity up to which the prefilter scores a sample 0")
+    parser.add_argument("--prefilter_validation", type=int, default=0, help="Also score this many of the prefiltered samples with the judge and report the agreement")
+    parser.add_argument("--checkpoint_path", type=str, default=None, help="Append-only journal of scored samples, written as the run goes")
+    parser.add_argument("--resume", action="store_true", help="Continue the run recorded in --checkpoint_path, skipping samples that are already scored")
+    parser.add_argument("--job_dir", type=str, default=None, help="Directory on a filesystem shared by several nodes; runs a distributed job there in the --role given (see distributed.py)")
+    parser.add_argument("--role", type=str, default=None, choices=['coordinator', 'worker'], help="'coordinator': split --result_path into shards, wait for the workers and merge their scores into --output; 'worker': claim and score shards until none are left")
+    parser.add_argument("--shard_size", type=int, default=None, help="Samples per shard of a distributed job, a multiple of --chunk_size (default: 4 chunks)")
+    parser.add_argument("--stale_seconds", type=float, default=DEFAULT_STALE_SECONDS, help="Seconds without a heartbeat after which a worker's claim on a shard is taken over by another worker")
+    parser.add_argument("--worker_id", type=str, default=None, help="Name of this worker in the job's lock files (default: host name and process id)")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of records read and evaluated at a time; memory use does not depend on the size of the results file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes; samples are sharded across them and each loads its own judge models on a share of the CPU cores")
+    parser.add_argument("--server", type=str, default=None, help="Score with a running L3-Lite server (host:port or Unix socket path, see server.py) instead of loading the models")
+    parser.add_argument("--cascade_threshold", type=float, default=None, help="Run the judges as a cascade, smallest first; a sample only reaches the next judge if p_one and p_zero both stay below this threshold (e.g. 0.9)")
+    parser.add_argument("--cascade_validation", type=int, default=0, help="After a cascade run, score this many of the judged samples with the full ensemble and report the agreement")
+    parser.add_argument("--concurrent_models", action="store_true", help="Run the ensemble members concurrently on separate threads with split core budgets instead of one after another")
+    parser.add_argument("--dtype", type=str, default='auto', choices=DTYPE_POLICIES, help="Model dtype; 'auto' uses fp16 on CUDA, and bf16 (if natively supported) or fp32 on CPU")
+    parser.add_argument("--quantize", action="store_true", help="On CPU, apply int8 dynamic quantization to the Linear layers of the judge models")
+    parser.add_argument("--backend", type=str, default='transformers', choices=BACKENDS, help="'transformers': PyTorch on any device; 'onnx': ONNX Runtime on CPU, running a judge graph exported on first use (see judge_backends.py)")
+    parser.add_argument("--onnx_dir", type=str, default=DEFAULT_ONNX_DIR, help="Directory of the exported judge graphs of the 'onnx' backend")
+    parser.add_argument("--output", type=str, default=None, help="Write per-sample results (scores, p_one/p_zero, fallback use) to this file; CSV if it ends in .csv, JSON Lines otherwise")
+    parser.add_argument("--report_dir", type=str, default=None, help="After the run, write per-question-type and per-image breakdown tables of --output to this directory (see report.py)")
+    parser.add_argument("--metrics_path", type=str, default=None, help="Collect per-stage timings and counters (tokenization, forward pass, softmax, fallback...) and write them to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Print every sample and the judge's batch statistics instead of a progress bar")
     args = parser.parse_args()
+    if args.resume and not args.checkpoint_path:
+        parser.error("--resume requires --checkpoint_path")
+    if args.report_dir and not args.output:
+        parser.error("--report_dir requires --output")
+    if args.cascade_validation and args.cascade_threshold is None:
+        parser.error("--cascade_validation requires --cascade_threshold")
+    if args.cascade_validation and (args.server or args.workers > 1):
+        parser.error("--cascade_validation runs in the main process and cannot be combined with --server or --workers")
+    if (args.type_scorer_map or args.type_scorer_keywords) and not args.type_scorers:
+        parser.error("--type_scorer_map and --type_scorer_keywords require --type_scorers")
+    if args.prefilter_validation and not args.prefilter_encoder:
+        parser.error("--prefilter_validation requires --prefilter_encoder")
+    if args.schedule == 'judge_major' and (args.server or args.workers > 1):
+        parser.error("--schedule judge_major runs in the main process and cannot be combined with --server or --workers")
+    if bool(args.job_dir) != bool(args.role):
+        parser.error("--job_dir and --role must be given together")
+    if args.job_dir and (args.checkpoint_path or args.schedule == 'judge_major' or args.cascade_validation or args.prefilter_validation):
+        parser.error("--job_dir cannot be combined with --checkpoint_path, --schedule judge_major or the validation options; finished shards are kept in the job directory")
+    if args.role == 'worker' and (args.output or args.report_dir):
+        parser.error("Workers write their scores to the job directory; pass --output and --report_dir to the coordinator")
+    if args.shard_size is None:
+        args.shard_size = 4 * args.chunk_size
+    if args.shard_size % args.chunk_size:
+        # Shards then split the input into the same chunks as a single-process run, which keeps the scores identical
+        parser.error("--shard_size must be a multiple of --chunk_size")
 
-    # Initialize the L3-Lite evaluator
-    l3_lite = L3Lite(model_names=args.model_names, device=args.device)
-
-    # Read the results file
-    with open(args.result_path, 'r', encoding='utf-8') as f:
-        results = json.load(f)
-
-    # Extract questions, predictions, and ground truths
-    questions = [item['question'] for item in results]
-    predictions = [item['pred'] for item in results]
-    ground_truths = [item['gt'] for item in results]
-
-    # Run evaluation
-    scores = l3_lite.evaluate(questions, predictions, ground_truths)
-
-    # Print results
-    print("\nEvaluation Results:")
-    total_score = 0
-    for i, (result, score) in enumerate(zip(results, scores)):
-        print(f"\nSample {i+1}:")
-        print(f"Image: {result['image']}")
-        print(f"Question Type: {result['question_type']}")
-        print(f"Question: {result['question']}")
-        print(f"Prediction: {result['pred']}")
-        print(f"Ground Truth: {result['gt']}")
-        print(f"L3-Lite Score: {score:.4f}")
-        print(f"Explanation: {'Semantically Similar' if score > 0.5 else 'Semantically Different'}") # 0-1 scale from L3-Lite
-        total_score += score
+    if args.role == 'coordinator':
+        run_coordinator(args)
+        return
+    plan = None
+    if args.role == 'worker':
+        plan = load_plan(args.job_dir, wait=True)
+        # Every worker scores with the coordinator's settings; device, cache and process options stay local
+        for name, value in plan["settings"].items():
+            setattr(args, name, value)
+    if args.server:
+        # After the job settings, which a worker scoring with a server would also silently drop
+        ignored = [name for name in SERVER_JUDGE_SETTINGS if getattr(args, name) != parser.get_default(name)]
+        if ignored:
+            parser.error(f"--server scores with the server's own judge settings; pass {', '.join('--' + name for name in ignored)} to server.py instead")
+    if args.type_scorer_map:
+        load_scorer_map(args.type_scorer_map)
 
-    # Print average score
-    if scores: # Avoid division by zero if scores list is empty
-        avg_score = total_score / len(scores)
-        print(f"\nOverall Evaluation Results:")
-        print(f"Number of Samples: {len(scores)}")
-        print(f"Average L3-Lite Score: {avg_score:.4f}")
-    else:
-        print("\nNo samples were evaluated.")
+    # The judge-major schedule passes per-judge scores between its passes through the score cache
+    temp_cache_dir = None
+    if args.schedule == 'judge_major' and not args.cache_path:
+        temp_cache_dir = tempfile.mkdtemp(prefix="l3lite-schedule-")
+        args.cache_path = os.path.join(temp_cache_dir, "scores.sqlite")
+    try:
+        evaluate_results(args, parser, plan)
+    finally:
+        # Also after an error or Ctrl-C, so that no score cache of the whole run is left behind
+        if temp_cache_dir is not None:
+            shutil.rmtree(temp_cache_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
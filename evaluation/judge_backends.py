@@ -0,0 +1,536 @@
+from __future__ import annotations # Annotations mention torch types without importing torch
+import argparse
+import copy
+import hashlib
+import json
+import os
+import shutil
+import warnings
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from lazy_import import LazyModule
+from metrics import StageMetrics
+from score_cache import weights_fingerprint
+
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+onnx = LazyModule("onnx")
+onnxruntime = LazyModule("onnxruntime")
+
+# Names of the backends L3Lite can run its judge models on
+BACKENDS = ('transformers', 'onnx')
+
+# Exported judge graphs are kept here, one directory per model and weights version (see judge_graph_dir)
+DEFAULT_ONNX_DIR = "llm_weights/onnx"
+ONNX_OPSET = 17
+
+# Shape of the example batch (after the prefix) graphs are traced with; batch size and sequence length stay dynamic
+EXPORT_EXAMPLE_SHAPE = (2, 8)
+
+
+def resident_size(model) -> int:
+    """Bytes taken by a model's weights and buffers, counting tied tensors once (also for int8 quantized models)."""
+    seen = set()
+    total = 0
+    for value in model.state_dict().values():
+        # Dynamically quantized Linear layers keep their weight and bias in a tuple
+        for tensor in (value if isinstance(value, tuple) else (value,)):
+            if not isinstance(tensor, torch.Tensor) or tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def left_pad(batch_ids: List[List[int]], pad_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Left-pad token id lists into (input_ids, attention_mask) int64 arrays; the last prompt token of every row is at -1."""
+    max_len = max(len(ids) for ids in batch_ids)
+    input_ids = np.full((len(batch_ids), max_len), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(batch_ids), max_len), dtype=np.int64)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, max_len - len(ids):] = ids
+        attention_mask[row, max_len - len(ids):] = 1
+    return input_ids, attention_mask
+
+
+class JudgeBackend:
+    """
+    Runs one judge model on token ids for L3Lite, which takes care of prompts, tokenization, batching and turning
+    probabilities into scores. A backend provides:
+
+    - next_token_logits: processed logits of the token following each prompt of a batch (one forward pass)
+    - decode: a short greedy decode whose tokens are picked by the caller at every step (constrained fallback)
+    - generate: free greedy generation for one prompt, with the logits of its first step ('generate' scoring mode)
+
+    decode and generate are implemented here by running the whole sequences again at every step, so a backend only
+    has to implement next_token_logits and resident_size; TransformersBackend overrides them with cached key/values.
+    Logits are processed the way greedy generate() processes them (repetition penalty of the generation config).
+    """
+
+    name = None
+
+    def __init__(self, model_path: str, tokenizer, metrics: Optional[StageMetrics] = None,
+                 stage_sync: Optional[Callable[[], None]] = None):
+        self.model_path = model_path
+        self.tokenizer = tokenizer
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        self.stage_sync = stage_sync
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.pad_id = pad_id if pad_id is not None else 0
+        self.eos_id = tokenizer.eos_token_id
+        self.repetition_penalty = None # Set by the backends from the model's generation config
+
+    def next_token_logits(self, batch_ids: List[List[int]]) -> torch.Tensor:
+        """Processed float32 next-token logits after each of a batch of unpadded prompts, shape (batch, vocab)."""
+        raise NotImplementedError
+
+    def resident_size(self) -> int:
+        """Bytes of memory the model's weights take."""
+        raise NotImplementedError
+
+    def build_prefix_cache(self, prefix_ids: List[int]) -> bool:
+        """
+        Precompute the key/values of prefix_ids, which most prompts start with, so that later calls only run the
+        rest of those prompts. Returns False if the backend cannot reuse key/values.
+        """
+        return False
+
+    def process_logits(self, sequences: torch.Tensor, logits: torch.Tensor) -> torch.Tensor:
+        """Process next-token logits the way greedy generate() does, given the sequences so far."""
+        # Greedy generate() applies the repetition penalty from the model's generation config to its scores
+        # (sampling warpers such as temperature/top-p are not applied when do_sample=False)
+        if self.repetition_penalty is not None and self.repetition_penalty != 1.0:
+            logits = transformers.RepetitionPenaltyLogitsProcessor(penalty=self.repetition_penalty)(sequences, logits)
+        return logits
+
+    def decode(self, batch_ids: List[List[int]], choose: Callable[[int, torch.Tensor], Optional[torch.Tensor]], max_steps: int):
+        """
+        Decode after a batch of prompts for at most max_steps steps. At every step, choose(step, logits) gets the
+        processed next-token logits of every row and returns the token appended to every row, or None once all
+        rows are finished.
+        """
+        sequences = [list(ids) for ids in batch_ids]
+        for step in range(max_steps):
+            next_tokens = choose(step, self.next_token_logits(sequences))
+            if next_tokens is None:
+                return
+            for row, token_id in enumerate(next_tokens.tolist()):
+                sequences[row].append(token_id)
+
+    def generate(self, ids: List[int], max_new_tokens: int = 20) -> Tuple[Optional[torch.Tensor], List[int]]:
+        """
+        Generate greedily after one prompt until end of sequence or max_new_tokens.
+
+        Returns:
+            (processed logits of the first generated token or None, generated token ids)
+        """
+        first_logits = []
+        generated = []
+
+        def choose(step: int, logits: torch.Tensor) -> Optional[torch.Tensor]:
+            if step == 0:
+                first_logits.append(logits[0])
+            next_token = logits.argmax(dim=-1)
+            generated.append(int(next_token[0]))
+            if generated[-1] == self.eos_id or len(generated) >= max_new_tokens:
+                return None
+            return next_token
+
+        self.metrics.count("generate_calls")
+        with self.metrics.stage("generate", self.stage_sync):
+            self.decode([ids], choose, max_new_tokens)
+        return (first_logits[0] if first_logits else None), generated
+
+
+class TransformersBackend(JudgeBackend):
+    """Runs a Hugging Face transformers model with PyTorch, reusing the key/values of the prompt prefix."""
+
+    name = 'transformers'
+
+    def __init__(self, model_path: str, tokenizer, device: str, torch_dtype, quantize: bool = False, seq2seq: bool = False,
+                 metrics: Optional[StageMetrics] = None, stage_sync: Optional[Callable[[], None]] = None):
+        """
+        Load the model; errors are raised to the caller.
+
+        Args:
+            device: Device to load the model on.
+            torch_dtype: torch dtype of the weights.
+            quantize: Apply int8 dynamic quantization to the Linear layers (CPU only).
+            seq2seq: Load an encoder-decoder model (AutoModelForSeq2SeqLM) instead of a causal LM.
+        """
+        super().__init__(model_path, tokenizer, metrics, stage_sync)
+        self.device = device
+
+        # safetensors checkpoints are memory-mapped and copied into the model one tensor at a time,
+        # instead of first materializing a randomly initialized model and a full copy of the state dict
+        load_kwargs = dict(
+            torch_dtype=torch_dtype,
+            device_map=device,
+            low_cpu_mem_usage=True,
+        )
+        if any(file_name.endswith('.safetensors') for file_name in os.listdir(model_path)):
+            load_kwargs['use_safetensors'] = True
+
+        if seq2seq:
+            model = transformers.AutoModelForSeq2SeqLM.from_pretrained(model_path, **load_kwargs)
+        else:
+            model = transformers.AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs)
+
+        # Ensure model is loaded to the correct device
+        if device != 'cpu' and hasattr(model, 'to'):
+            model.to(device)
+        model.eval() # Set to evaluation mode
+
+        if quantize:
+            # Linear layers hold nearly all of the weights and FLOPs of the judge models
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.model = model
+        generation_config = getattr(model, 'generation_config', None)
+        self.repetition_penalty = getattr(generation_config, 'repetition_penalty', None)
+        self.prefix_cache = None # (prefix token ids, past_key_values), see build_prefix_cache
+
+    def resident_size(self) -> int:
+        return resident_size(self.model)
+
+    def build_prefix_cache(self, prefix_ids: List[int]) -> bool:
+        input_ids = torch.tensor([prefix_ids], dtype=torch.long, device=self.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), use_cache=True)
+        if outputs.past_key_values is None:
+            return False
+        self.prefix_cache = (prefix_ids, outputs.past_key_values)
+        return True
+
+    def _collate(self, batch_ids: List[List[int]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Left-pad token id lists into input_ids and attention_mask tensors on the model device."""
+        input_ids, attention_mask = left_pad(batch_ids, self.pad_id)
+        return torch.from_numpy(input_ids).to(self.device), torch.from_numpy(attention_mask).to(self.device)
+
+    def _prepare(self, batch_ids: List[List[int]]) -> Tuple[torch.Tensor, torch.Tensor, int]:
+        """
+        Collate a batch. Returns (input_ids, attention_mask, past_length): if every row starts with the cached
+        prefix, only the part after it is padded and the first past_length tokens are the prefix.
+        """
+        prefix_ids = self.prefix_cache[0] if self.prefix_cache is not None else None
+        with self.metrics.stage("collate"):
+            if prefix_ids and all(ids[:len(prefix_ids)] == prefix_ids for ids in batch_ids):
+                suffix_ids, suffix_mask = self._collate([ids[len(prefix_ids):] for ids in batch_ids])
+                prefix = torch.tensor([prefix_ids], dtype=torch.long, device=self.device).expand(len(batch_ids), -1)
+                input_ids = torch.cat([prefix, suffix_ids], dim=1)
+                attention_mask = torch.cat([torch.ones_like(prefix), suffix_mask], dim=1)
+                return input_ids, attention_mask, len(prefix_ids)
+            input_ids, attention_mask = self._collate(batch_ids)
+            return input_ids, attention_mask, 0
+
+    def _expand_prefix_cache(self, batch_size: int):
+        """Return a fresh copy of the prefix key/values repeated for batch_size rows."""
+        # The model appends to the cache it is given, so every forward pass needs its own copy
+        with self.metrics.stage("prefix_expand", self.stage_sync):
+            past_key_values = copy.deepcopy(self.prefix_cache[1])
+            if isinstance(past_key_values, tuple): # Legacy tuple format from older transformers versions
+                return tuple(tuple(t.expand(batch_size, *t.shape[1:]).contiguous() for t in layer) for layer in past_key_values)
+            past_key_values.batch_repeat_interleave(batch_size)
+            return past_key_values
+
+    def next_token_logits(self, batch_ids: List[List[int]]) -> torch.Tensor:
+        input_ids, attention_mask, past_length = self._prepare(batch_ids)
+        # Positions are counted from the first real token, as generate() does for left-padded inputs
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        past_key_values = self._expand_prefix_cache(input_ids.size(0)) if past_length > 0 else None
+        self.metrics.count("forward_passes")
+        self.metrics.count("forward_tokens", input_ids[:, past_length:].numel()) # Including padding
+        with torch.no_grad(), self.metrics.stage("forward", self.stage_sync):
+            if past_length > 0:
+                outputs = self.model(
+                    input_ids=input_ids[:, past_length:],
+                    attention_mask=attention_mask, # Covers the cached prefix and the new tokens
+                    position_ids=position_ids[:, past_length:],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+            else:
+                outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, use_cache=False)
+        # generate() upcasts the last-position logits to float32 before processing them
+        return self.process_logits(input_ids, outputs.logits[:, -1, :].to(dtype=torch.float32))
+
+    def decode(self, batch_ids: List[List[int]], choose: Callable[[int, torch.Tensor], Optional[torch.Tensor]], max_steps: int):
+        # Every step only runs the newly chosen tokens, reusing the key/values of everything before them
+        input_ids, attention_mask, past_length = self._prepare(batch_ids)
+        past_key_values = self._expand_prefix_cache(len(batch_ids)) if past_length > 0 else None
+        sequences = input_ids
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        step_ids, step_positions = input_ids[:, past_length:], position_ids[:, past_length:]
+        for step in range(max_steps):
+            with torch.no_grad():
+                outputs = self.model(input_ids=step_ids, attention_mask=attention_mask, position_ids=step_positions,
+                                     past_key_values=past_key_values, use_cache=True)
+            past_key_values = outputs.past_key_values
+            next_tokens = choose(step, self.process_logits(sequences, outputs.logits[:, -1, :].to(dtype=torch.float32)))
+            if next_tokens is None:
+                return
+            step_ids = next_tokens.to(self.device).unsqueeze(-1)
+            sequences = torch.cat([sequences, step_ids], dim=1)
+            attention_mask = torch.cat([attention_mask, torch.ones_like(step_ids)], dim=1)
+            step_positions = position_ids[:, -1:] + step + 1
+
+    def generate(self, ids: List[int], max_new_tokens: int = 20) -> Tuple[Optional[torch.Tensor], List[int]]:
+        input_ids = torch.tensor([ids], dtype=torch.long, device=self.device)
+        # Set max_new_tokens a bit larger to prevent the model generating extra tokens that affect number extraction
+        self.metrics.count("generate_calls")
+        with torch.no_grad(), self.metrics.stage("generate", self.stage_sync):
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=max_new_tokens,
+                return_dict_in_generate=True,
+                output_scores=True, # Need output_scores to calculate probabilities
+                pad_token_id=self.tokenizer.eos_token_id,
+                num_beams=1, # Typically used for generation, L3-Lite's original logic might require this
+                do_sample=False, # Disable sampling, use Greedy Search or Beam Search
+                generation_config=self.model.generation_config if hasattr(self.model, 'generation_config') else None # Use model's default generation config
+            )
+        # scores is a tuple of tensors, scores[i] are the scores for the i-th generated token (batch size = 1)
+        first_logits = outputs.scores[0][0] if outputs.scores else None
+        return first_logits, outputs.sequences[0, len(ids):].tolist()
+
+
+def judge_graph_dir(onnx_dir: str, model_name: str, model_path: str) -> str:
+    """Directory of a model's exported graphs; a new weights version gets a new directory."""
+    return os.path.join(onnx_dir, f"{model_name}-{weights_fingerprint(model_path)[:16]}")
+
+
+def judge_graph_file(prefix_ids: Optional[List[int]] = None, quantize: bool = False) -> str:
+    """
+    File name of a graph in a model's graph directory: 'judge.onnx' runs full prompts, 'judge-prefix-<hash>.onnx'
+    has the key/values of prefix_ids built in and runs the rest of prompts; '-int8' marks the quantized copies.
+    """
+    stem = "judge"
+    if prefix_ids:
+        stem += "-prefix-" + hashlib.sha256(json.dumps(list(prefix_ids)).encode('utf-8')).hexdigest()[:16]
+    return stem + ("-int8" if quantize else "") + ".onnx"
+
+
+def _install_graph(temp_dir: str, graph_dir: str, graph_file: str):
+    """Move a graph and its data file from temp_dir into graph_dir."""
+    # The graph refers to its data file by name; the graph is moved last, so it never appears without its data
+    for file_name in sorted(os.listdir(temp_dir), key=lambda name: name == graph_file):
+        if os.path.isfile(os.path.join(temp_dir, file_name)):
+            os.replace(os.path.join(temp_dir, file_name), os.path.join(graph_dir, file_name))
+
+
+def export_judge_graph(model_path: str, graph_dir: str, prefix_ids: Optional[List[int]] = None):
+    """
+    Export a causal LM to graph_dir/judge_graph_file(prefix_ids): float32, inputs input_ids, attention_mask and
+    position_ids, output the last position's logits (batch, vocab), the only ones the LM head computes. Weights go
+    to one external data file.
+
+    With prefix_ids, the prefix's key/values are constants of the graph, expanded to the batch size: input_ids and
+    position_ids are those of the tokens after the prefix, while attention_mask also covers the prefix, as in
+    TransformersBackend's prefix cache path.
+    """
+    class LastTokenLogits(torch.nn.Module):
+        # Only the last position's logits leave the graph, not (batch, sequence, vocab)
+        def __init__(self, model, prefix_key_values):
+            super().__init__()
+            self.model = model
+            self.num_prefix_layers = len(prefix_key_values)
+            for layer, (keys, values) in enumerate(prefix_key_values):
+                self.register_buffer(f"prefix_keys_{layer}", keys)
+                self.register_buffer(f"prefix_values_{layer}", values)
+
+        def forward(self, input_ids, attention_mask, position_ids):
+            past_key_values = None
+            if self.num_prefix_layers:
+                batch_size = input_ids.shape[0]
+                past_key_values = transformers.DynamicCache()
+                for layer in range(self.num_prefix_layers):
+                    keys = getattr(self, f"prefix_keys_{layer}")
+                    values = getattr(self, f"prefix_values_{layer}")
+                    past_key_values.update(keys.expand(batch_size, -1, -1, -1), values.expand(batch_size, -1, -1, -1), layer)
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                                 past_key_values=past_key_values, use_cache=past_key_values is not None, logits_to_keep=1)
+            return outputs.logits[:, -1, :]
+
+    graph_file = judge_graph_file(prefix_ids)
+    temp_dir = os.path.join(graph_dir, f"{graph_file}.tmp-{os.getpid()}")
+    os.makedirs(os.path.join(temp_dir, "trace"), exist_ok=True)
+    try:
+        # Eager attention traces to plain MatMul/Softmax nodes, which ONNX Runtime fuses better than traced SDPA
+        model = transformers.AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, low_cpu_mem_usage=True,
+                                                                  attn_implementation="eager")
+        model.eval()
+        prefix_key_values = []
+        if prefix_ids:
+            with torch.no_grad():
+                past_key_values = model(input_ids=torch.tensor([prefix_ids], dtype=torch.long), use_cache=True).past_key_values
+            if isinstance(past_key_values, tuple): # Legacy tuple format from older transformers versions
+                prefix_key_values = [(layer[0], layer[1]) for layer in past_key_values]
+            elif hasattr(past_key_values, 'layers'):
+                prefix_key_values = [(layer.keys, layer.values) for layer in past_key_values.layers]
+            else:
+                prefix_key_values = list(zip(past_key_values.key_cache, past_key_values.value_cache))
+        prefix_length = len(prefix_ids) if prefix_ids else 0
+
+        # Trace with a left-padded row, so that the attention mask is not optimized away as all ones
+        batch_size, sequence_length = EXPORT_EXAMPLE_SHAPE
+        attention_mask = torch.ones((batch_size, prefix_length + sequence_length), dtype=torch.long)
+        attention_mask[0, prefix_length:prefix_length + sequence_length // 2] = 0
+        input_ids = torch.zeros(EXPORT_EXAMPLE_SHAPE, dtype=torch.long)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, prefix_length:]
+        dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"}, "position_ids": {0: "batch", 1: "sequence"},
+                        "attention_mask": {0: "batch", 1: "total_sequence" if prefix_length else "sequence"},
+                        "logits": {0: "batch"}}
+        trace_path = os.path.join(temp_dir, "trace", graph_file)
+        with torch.no_grad(), warnings.catch_warnings():
+            # The mask and cache checks traced as constants take the padded branch, which also holds without padding
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            torch.onnx.export(LastTokenLogits(model, prefix_key_values), (input_ids, attention_mask, position_ids), trace_path,
+                              input_names=["input_ids", "attention_mask", "position_ids"], output_names=["logits"],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False)
+        del model, prefix_key_values
+        # Graphs over 2 GB are exported with one file per tensor; keep all weights in a single data file instead
+        graph = onnx.load(trace_path)
+        onnx.save_model(graph, os.path.join(temp_dir, graph_file), save_as_external_data=True,
+                        all_tensors_to_one_file=True, location=graph_file + ".data")
+        del graph
+        # Workers exporting the same graph at the same time write identical files
+        _install_graph(temp_dir, graph_dir, graph_file)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def ensure_judge_graph(model_path: str, graph_dir: str, prefix_ids: Optional[List[int]] = None, quantize: bool = False) -> str:
+    """Path of a model's exported graph, exporting it (and its int8 copy if quantize) on first use."""
+    graph_path = os.path.join(graph_dir, judge_graph_file(prefix_ids))
+    if not os.path.exists(graph_path):
+        print(f"Exporting {model_path} to {graph_path} (once per model and weights version)...")
+        os.makedirs(graph_dir, exist_ok=True)
+        export_judge_graph(model_path, graph_dir, prefix_ids)
+    if not quantize:
+        return graph_path
+    int8_file = judge_graph_file(prefix_ids, quantize=True)
+    int8_path = os.path.join(graph_dir, int8_file)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"Quantizing {graph_path} to int8...")
+        temp_dir = os.path.join(graph_dir, f"{int8_file}.tmp-{os.getpid()}")
+        os.makedirs(temp_dir, exist_ok=True)
+        try:
+            # Same int8 dynamic quantization of the MatMul weights as the transformers backend's quantize option
+            quantize_dynamic(graph_path, os.path.join(temp_dir, int8_file), weight_type=QuantType.QInt8,
+                             use_external_data_format=True)
+            _install_graph(temp_dir, graph_dir, int8_file)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return int8_path
+
+
+class OnnxBackend(JudgeBackend):
+    """
+    Runs judge graphs exported with export_judge_graph on the ONNX Runtime CPU execution provider.
+
+    The graphs have no key/value inputs or outputs. Instead, build_prefix_cache loads a graph with the prefix's
+    key/values built in, which runs every prompt starting with the prefix; other prompts run on the full-prompt
+    graph. The fallback decodes run the whole sequences again at every step, which is cheap for their few steps.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_path: str, tokenizer, graph_dir: str, quantize: bool = False, num_threads: Optional[int] = None,
+                 defer_full_graph: bool = False, metrics: Optional[StageMetrics] = None,
+                 stage_sync: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            graph_dir: Directory of the exported graphs (see judge_graph_dir); exported from model_path if missing.
+            quantize: Use int8 dynamically quantized copies of the graphs.
+            num_threads: ONNX Runtime intra-op threads; torch's thread count by default, so the core pinning of
+                parallel_eval workers applies to both backends.
+            defer_full_graph: Export/load the full-prompt graph on first use rather than now, for callers that build
+                a prefix cache right away and would then usually not need it.
+        """
+        super().__init__(model_path, tokenizer, metrics, stage_sync)
+        self.graph_dir = graph_dir
+        self.quantize = quantize
+        self.session_options = onnxruntime.SessionOptions()
+        self.session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session_options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.sessions = {} # Graph path -> InferenceSession
+        self.full_graph_path = None
+        self.prefix_graph = None # (prefix token ids, graph path), see build_prefix_cache
+        try:
+            self.repetition_penalty = transformers.GenerationConfig.from_pretrained(model_path).repetition_penalty
+        except OSError: # No generation_config.json
+            self.repetition_penalty = None
+        if not defer_full_graph:
+            self._load_graph()
+
+    def _load_graph(self, prefix_ids: Optional[List[int]] = None) -> str:
+        """Export (if missing) and load the full-prompt graph or the graph of prefix_ids. Returns its path."""
+        graph_path = ensure_judge_graph(self.model_path, self.graph_dir, prefix_ids, self.quantize)
+        if graph_path not in self.sessions:
+            self.sessions[graph_path] = onnxruntime.InferenceSession(graph_path, self.session_options,
+                                                                     providers=["CPUExecutionProvider"])
+        return graph_path
+
+    def resident_size(self) -> int:
+        # The sessions hold the graphs' weights; their files are the closest measure of their size
+        return sum(os.path.getsize(os.path.join(self.graph_dir, file_name)) for graph_path in self.sessions
+                   for file_name in os.listdir(self.graph_dir)
+                   if file_name in (os.path.basename(graph_path), os.path.basename(graph_path) + ".data"))
+
+    def build_prefix_cache(self, prefix_ids: List[int]) -> bool:
+        self.prefix_graph = (list(prefix_ids), self._load_graph(prefix_ids))
+        return True
+
+    def next_token_logits(self, batch_ids: List[List[int]]) -> torch.Tensor:
+        prefix_ids = self.prefix_graph[0] if self.prefix_graph is not None else None
+        with self.metrics.stage("collate"):
+            if prefix_ids and all(ids[:len(prefix_ids)] == prefix_ids for ids in batch_ids):
+                graph_path = self.prefix_graph[1]
+                input_ids, suffix_mask = left_pad([ids[len(prefix_ids):] for ids in batch_ids], self.pad_id)
+                prefix = np.tile(np.asarray(prefix_ids, dtype=np.int64), (len(batch_ids), 1))
+                attention_mask = np.concatenate([np.ones_like(prefix), suffix_mask], axis=1)
+                sequences = np.concatenate([prefix, input_ids], axis=1)
+            else:
+                if self.full_graph_path is None:
+                    self.full_graph_path = self._load_graph()
+                graph_path = self.full_graph_path
+                input_ids, attention_mask = left_pad(batch_ids, self.pad_id)
+                sequences = input_ids
+            # Positions are counted from the first real token, as generate() does for left-padded inputs
+            position_ids = np.maximum(attention_mask.cumsum(-1) - 1, 0)[:, attention_mask.shape[1] - input_ids.shape[1]:]
+        self.metrics.count("forward_passes")
+        self.metrics.count("forward_tokens", input_ids.size) # Including padding
+        with self.metrics.stage("forward"):
+            logits = self.sessions[graph_path].run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask,
+                                                                "position_ids": position_ids})[0]
+        return self.process_logits(torch.from_numpy(sequences), torch.from_numpy(logits))
+
+
+def main():
+    from L3_Lite import L3Lite
+    from model_registry import load_model_registry
+
+    parser = argparse.ArgumentParser(description="Export judge models to ONNX graphs for the 'onnx' backend ahead of the first run")
+    parser.add_argument("--model_names", nargs="+", default=['Qwen2.5-3B-Instruct'], help="Models to export")
+    parser.add_argument("--model_config", type=str, default=None, help="JSON file mapping model names to weight directories (see model_registry.py)")
+    parser.add_argument("--onnx_dir", type=str, default=DEFAULT_ONNX_DIR, help="Directory the graphs are written to")
+    parser.add_argument("--quantize", action="store_true", help="Also write the int8 dynamically quantized graphs")
+    parser.add_argument("--no_prefix_cache", action="store_true", help="Export the full-prompt graphs used with --no_prefix_cache")
+    args = parser.parse_args()
+
+    # Loading the models exports exactly the graphs an evaluation run with the same settings loads
+    l3_lite = L3Lite(model_names=args.model_names, device='cpu', backend='onnx', onnx_dir=args.onnx_dir, quantize=args.quantize,
+                     use_prefix_cache=not args.no_prefix_cache,
+                     model_registry=load_model_registry(args.model_config) if args.model_config else None)
+    l3_lite.load_models()
+    for model_name, backend in l3_lite.backends.items():
+        for graph_path in backend.sessions:
+            print(f"{model_name}: {graph_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its attributes is first used.
+
+    torch and transformers take seconds to import; with `torch = LazyModule("torch")` at the top of a module,
+    code keeps writing `torch.tensor(...)` and runs that never touch a model (score cache hits, exact matches)
+    do not pay for the import.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        # Only called for attributes not found on the stand-in itself
+        return getattr(self._load(), attribute)
+
+    def is_loaded(self) -> bool:
+        """True once the real module has been imported."""
+        return self._module is not None
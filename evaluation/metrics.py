@@ -0,0 +1,110 @@
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Returned by StageMetrics.stage() when instrumentation is off: entering and leaving it does nothing
+_NO_STAGE = contextlib.nullcontext()
+
+
+class _Stage:
+    """Times one pass through a stage and adds it to the stage's total."""
+
+    def __init__(self, metrics: "StageMetrics", name: str, sync: Optional[Callable[[], None]]):
+        self.metrics = metrics
+        self.name = name
+        self.sync = sync
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.sync is not None:
+            self.sync() # Wait for asynchronous (e.g. CUDA) work of the stage before stopping the clock
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageMetrics:
+    """
+    Cumulative per-stage timers and event counters.
+
+    Code under measurement writes `with metrics.stage("forward"): ...` and `metrics.count("fallback_parsed")`.
+    When disabled, stage() returns a shared no-op context manager and count() returns immediately,
+    so instrumented code pays next to nothing. Safe to update from several threads.
+    """
+
+    def __init__(self, enabled: bool = False, callback: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            enabled: Collect timings and counters.
+            callback: Called with snapshot() after every evaluate call of the instrumented object (see report()).
+        """
+        self.enabled = enabled
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    def stage(self, name: str, sync: Optional[Callable[[], None]] = None):
+        """Context manager timing one pass through the named stage."""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name, sync)
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name: str, amount: int = 1):
+        """Add amount to the named counter."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self) -> Dict:
+        """{'stages': {name: {'seconds': total, 'calls': count}}, 'counters': {name: value}}"""
+        with self.lock:
+            return {
+                "stages": {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in self.seconds},
+                "counters": dict(self.counters),
+            }
+
+    def report(self):
+        """Pass the current snapshot to the callback, if there is one."""
+        if self.enabled and self.callback is not None:
+            self.callback(self.snapshot())
+
+    def reset(self):
+        with self.lock:
+            self.seconds.clear()
+            self.calls.clear()
+            self.counters.clear()
+
+
+def merge_snapshots(snapshots: List[Dict]) -> Dict:
+    """Sum the snapshots of several StageMetrics (e.g. one per worker process)."""
+    merged = {"stages": {}, "counters": {}}
+    for snapshot in snapshots:
+        for name, stage in snapshot.get("stages", {}).items():
+            total = merged["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += stage["seconds"]
+            total["calls"] += stage["calls"]
+        for name, value in snapshot.get("counters", {}).items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+    return merged
+
+
+def format_snapshot(snapshot: Dict) -> List[str]:
+    """Human-readable lines of a snapshot: stages by total time, then counters."""
+    lines = []
+    stages = sorted(snapshot.get("stages", {}).items(), key=lambda item: item[1]["seconds"], reverse=True)
+    for name, stage in stages:
+        lines.append(f"{name:<16} {stage['seconds']:10.3f}s {stage['calls']:>10} calls")
+    for name, value in sorted(snapshot.get("counters", {}).items()):
+        lines.append(f"{name:<16} {value:>11}")
+    return lines
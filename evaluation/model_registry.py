@@ -0,0 +1,31 @@
+import json
+import os
+from typing import Dict
+
+
+def load_model_registry(path: str) -> Dict[str, str]:
+    """
+    Read the judge models from a JSON config file, in place of the built-in L3_Lite.MODEL_PATHS:
+
+        {"models": {"Qwen2.5-3B-Instruct": "llm_weights/Qwen/Qwen2.5-3B-Instruct",
+                    "DeepSeek-R1-Distill-Qwen-1.5B": {"path": "/models/DeepSeek-R1-Distill-Qwen-1.5B"}}}
+
+    Relative paths are resolved against the directory of the config file, so a config can live next to the weights.
+
+    Returns:
+        {model name: model path}, in the order of the file.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    models = config.get("models") if isinstance(config, dict) else None
+    if not isinstance(models, dict) or not models:
+        raise ValueError(f"Model config {path} has no 'models' mapping of model names to paths")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    registry = {}
+    for model_name, entry in models.items():
+        model_path = entry.get("path") if isinstance(entry, dict) else entry
+        if not isinstance(model_path, str) or not model_path:
+            raise ValueError(f"Model {model_name} in {path} has no path")
+        registry[model_name] = os.path.join(base_dir, os.path.expanduser(model_path))
+    return registry
@@ -0,0 +1,178 @@
+import multiprocessing as mp
+import os
+import queue
+import traceback
+from typing import Dict, List
+
+from tqdm import tqdm
+
+from L3_Lite import L3Lite, torch
+from metrics import merge_snapshots
+
+# Number of samples a worker scores per L3Lite.evaluate call before sending the scores back
+WORKER_CHUNK_SIZE = 512
+
+# Seconds the parent waits for a message before checking that the workers are still alive
+POLL_INTERVAL = 5.0
+
+
+def split_cores(num_workers: int) -> List[List[int]]:
+    """Split the CPU cores available to this process into num_workers disjoint, contiguous groups."""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cores) // num_workers)
+    groups = []
+    for worker_id in range(num_workers):
+        group = cores[worker_id * per_worker:(worker_id + 1) * per_worker]
+        # More workers than cores: share cores round-robin
+        groups.append(group if group else [cores[worker_id % len(cores)]])
+    return groups
+
+
+def _worker_main(worker_id: int, cores: List[int], l3_lite_kwargs: Dict, task_queue, result_queue):
+    """
+    Load the judge models in this process, then score the shards sent on task_queue
+    and stream (indices, scores) chunks back to the parent until a None task arrives.
+    A "metrics" task is answered with the worker's L3Lite.get_metrics().
+    """
+    try:
+        # Pin the worker to its share of the cores and size torch's intra-op pool to match
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+
+        l3_lite = L3Lite(**l3_lite_kwargs)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            if task == "metrics":
+                result_queue.put(("metrics", worker_id, l3_lite.get_metrics()))
+                continue
+            indices, qst, preds, gts, return_details = task
+            for start in range(0, len(indices), WORKER_CHUNK_SIZE):
+                end = start + WORKER_CHUNK_SIZE
+                scores = l3_lite.evaluate(qst[start:end], preds[start:end], gts[start:end], return_details=return_details)
+                if not return_details:
+                    scores = [float(score) for score in scores]
+                result_queue.put(("scores", indices[start:end], scores))
+    except Exception:
+        result_queue.put(("error", worker_id, traceback.format_exc()))
+
+
+class ParallelEvaluator:
+    """
+    L3-Lite evaluation in a pool of worker processes.
+
+    Every worker loads its own L3Lite (built from l3_lite_kwargs) once, pinned to a disjoint group of cores.
+    Each evaluate() call splits its samples into contiguous shards, one per worker, and reassembles
+    the streamed scores in input order, so the pool can be reused for every chunk of a large result file.
+    """
+
+    def __init__(self, l3_lite_kwargs: Dict, num_workers: int):
+        self.num_workers = max(1, num_workers)
+        core_groups = split_cores(self.num_workers)
+        self.verbose = l3_lite_kwargs.get('verbose', True)
+        worker_kwargs = dict(l3_lite_kwargs, verbose=False) # The parent shows a single progress bar
+
+        # Spawn instead of fork: forking a process that has already initialized torch's thread pools is unsafe
+        context = mp.get_context("spawn")
+        self.result_queue = context.Queue()
+        self.task_queues = []
+        self.workers = []
+        for worker_id in range(self.num_workers):
+            task_queue = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_id, core_groups[worker_id], worker_kwargs, task_queue, self.result_queue),
+                daemon=True
+            )
+            process.start()
+            self.task_queues.append(task_queue)
+            self.workers.append(process)
+        print(f"Started {self.num_workers} L3-Lite workers with {', '.join(str(len(group)) for group in core_groups)} cores each.")
+
+    def evaluate(self, qst: List[str], preds: List[str], gts: List[str], return_details: bool = False) -> List:
+        """
+        Evaluate samples across the worker pool.
+
+        Returns:
+            L3-Lite scores in input order, or detail dicts if return_details is set (see L3Lite.evaluate).
+        """
+        if not (len(preds) == len(gts) == len(qst)):
+            print(f"Error: Mismatch in the number of questions, predictions, and ground truths ({len(qst)}, {len(preds)}, {len(gts)}).")
+            if return_details:
+                return [{"score": 0.0, "exact_match": False, "models": {}} for _ in preds]
+            return [0.0] * len(preds) if preds else []
+        if not preds:
+            return []
+
+        shard_size = (len(preds) + self.num_workers - 1) // self.num_workers
+        for worker_id, task_queue in enumerate(self.task_queues):
+            start, end = worker_id * shard_size, min((worker_id + 1) * shard_size, len(preds))
+            if start < end:
+                task_queue.put((list(range(start, end)), qst[start:end], preds[start:end], gts[start:end], return_details))
+
+        scores = [None] * len(preds)
+        received = 0
+        with tqdm(total=len(preds), desc="Evaluating samples", disable=not self.verbose) as progress:
+            while received < len(preds):
+                try:
+                    kind, payload, data = self.result_queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    dead = [i for i, process in enumerate(self.workers) if not process.is_alive()]
+                    if dead:
+                        raise RuntimeError(f"L3-Lite worker(s) {dead} exited unexpectedly.")
+                    continue
+                if kind == "error":
+                    raise RuntimeError(f"L3-Lite worker {payload} failed:\n{data}")
+                for index, score in zip(payload, data):
+                    scores[index] = score
+                received += len(payload)
+                progress.update(len(payload))
+        return scores
+
+    def get_metrics(self) -> dict:
+        """Per-stage timings and counters of all workers, summed (see L3Lite.get_metrics)."""
+        for task_queue in self.task_queues:
+            task_queue.put("metrics")
+        snapshots = []
+        while len(snapshots) < self.num_workers:
+            try:
+                kind, payload, data = self.result_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                dead = [i for i, process in enumerate(self.workers) if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"L3-Lite worker(s) {dead} exited unexpectedly.")
+                continue
+            if kind == "error":
+                raise RuntimeError(f"L3-Lite worker {payload} failed:\n{data}")
+            if kind == "metrics":
+                snapshots.append(data)
+        return merge_snapshots(snapshots)
+
+    def close(self):
+        """Stop the workers."""
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.workers:
+            process.join(timeout=POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def evaluate_parallel(l3_lite_kwargs: Dict, qst: List[str], preds: List[str], gts: List[str], num_workers: int) -> List[float]:
+    """Evaluate samples with L3-Lite in num_workers processes (see ParallelEvaluator). Scores are in input order."""
+    if not preds:
+        return []
+    with ParallelEvaluator(l3_lite_kwargs, max(1, min(num_workers, len(preds)))) as evaluator:
+        return evaluator.evaluate(qst, preds, gts)
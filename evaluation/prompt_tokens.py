@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from result_io import iter_records
+
+# The L3-Lite prompt, split into pieces that tokenize independently:
+#   PROMPT_PREFIX + "Question:{qst}\n" + "Answer: {pred}\n" + "Grount truth: {gt}\n" + PROMPT_SUFFIX
+# Every piece ends on a newline and the next one starts with a letter, which is a pre-tokenization boundary
+# for byte-level BPE tokenizers (GPT-2/Qwen style), so the token ids of the pieces concatenate to the token ids
+# of the whole prompt. Whether that holds for a given tokenizer is checked when it is loaded (see PromptTokenizer).
+
+# Fixed instruction that starts every L3-Lite prompt. It ends on a newline so that it tokenizes the same
+# on its own as at the start of a full prompt, which lets its key/values be computed once and reused.
+PROMPT_PREFIX = "I'm evaluating for open QA and need your assistance in determining the answers. The questions, predicted answers and ground truths are as follows. Please determine if the following two answers have the same semantic meaning:\n"
+
+# Per-sample fields, each with its label
+PROMPT_FIELD_TEMPLATES = ("Question:{}\n", "Answer: {}\n", "Grount truth: {}\n")
+
+# Fixed instruction that ends every L3-Lite prompt
+PROMPT_SUFFIX = "Please use the questions as background information, provide a similarity score between 0.00 and 1.00, where 1.00 means the answers are completely semantically equivalent, and 0.00 means they are completely different. If the answers are similar, related, or have a contain and be contained relationship, provide a decimal score between 0.00 and 1.00 . Answer with only the number, without any explanation. Your answer : "
+
+# Triples with awkward boundaries (empty fields, trailing spaces/punctuation/newlines, digits, non-ASCII)
+# used to check that a tokenizer can assemble prompts from pieces
+PROBE_TRIPLES = [
+    ("How many cars are on the road?", "3", "three"),
+    ("Is there a bus?", "Yes.", "no"),
+    ("", "", ""),
+    ("What is on the left? ", " a red car ", "truck  "),
+    ("Where is it?\n", "upper left\n\n", "\tbottom right"),
+    ("Count the vehicles:", "12.5", "1,000"),
+    ("¿Qué hay?", "车辆", "naïve café — ok"),
+    ("'s", "'ll", "don't"),
+]
+
+# Pieces the randomized triples of self_test are made of: words, digits, punctuation, non-ASCII text and a
+# special token (which makes the sample take the full-text path), joined by spaces, tabs and newlines
+RANDOM_FIELD_PIECES = ["car", "Bus", "the", "upper left", "3", "42", "0.5", "1,000", "yes", "No", "don't", "'s",
+                       ",", ".", "?", ":", "-", "车辆", "路口", "naïve", "Straße", "¿Qué", "🚗", "—", "<|endoftext|>"]
+RANDOM_FIELD_SEPARATORS = ["", " ", "  ", "\t", "\n", " \n", "\n\n"]
+
+
+def clean_field(value) -> str:
+    """Basic cleaning of inputs to prevent errors from None or non-string types"""
+    return str(value) if value is not None else ""
+
+
+def build_prompt(qst, pred, gt) -> str:
+    """The full L3-Lite prompt of one sample as text (see L3Lite.create_prompt)."""
+    fields = (clean_field(qst), clean_field(pred), clean_field(gt))
+    return PROMPT_PREFIX + "".join(template.format(field) for template, field in zip(PROMPT_FIELD_TEMPLATES, fields)) + PROMPT_SUFFIX
+
+
+def tokenizer_family(tokenizer) -> str:
+    """
+    Fingerprint of how a tokenizer splits plain text: normalizer, pre-tokenizer and vocabulary/merges.
+
+    Special tokens and post-processing (e.g. an added BOS token) are left out, so tokenizers of one
+    family, such as those of Qwen2.5 models and models distilled into them, get the same fingerprint.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is None:
+        # Slow (pure Python) tokenizers cannot be compared, so they are never shared
+        return f"{type(tokenizer).__name__}-{id(tokenizer)}"
+    state = json.loads(backend.to_str())
+    for key in ('added_tokens', 'post_processor', 'decoder', 'padding', 'truncation'):
+        state.pop(key, None)
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class FieldTokenizer:
+    """Batch tokenization of the per-sample prompt pieces, shared by all tokenizers of one family."""
+
+    def __init__(self, tokenizer, family: str):
+        self.tokenizer = tokenizer
+        self.family = family
+
+    def encode(self, triples: List[Tuple[str, str, str]]) -> List[List[int]]:
+        """Token ids of the three field pieces of every (qst, pred, gt) triple, concatenated."""
+        if not triples:
+            return []
+        pieces = []
+        for position, template in enumerate(PROMPT_FIELD_TEMPLATES):
+            texts = [template.format(triple[position]) for triple in triples]
+            pieces.append(self.tokenizer(texts, add_special_tokens=False)["input_ids"])
+        return [a + b + c for a, b, c in zip(*pieces)]
+
+
+class PromptTokenizer:
+    """
+    Token ids of L3-Lite prompts for one model, assembled from the pre-tokenized prefix and suffix and
+    the batch-tokenized field pieces instead of tokenizing every full prompt.
+
+    On creation the assembled ids are compared with tokenizing the full text for PROBE_TRIPLES; if any
+    differ (e.g. SentencePiece tokenizers that add a leading space to every piece), encode() falls back to
+    tokenizing full prompts. Samples whose fields contain special-token text also take the full-text path.
+    """
+
+    def __init__(self, tokenizer, fields: FieldTokenizer):
+        self.tokenizer = tokenizer
+        self.fields = fields
+        self.prefix_ids = tokenizer(PROMPT_PREFIX)["input_ids"] # With the tokenizer's leading special tokens, if any
+        self.suffix_ids = tokenizer(PROMPT_SUFFIX, add_special_tokens=False)["input_ids"]
+        special_strings = sorted(getattr(tokenizer, 'added_tokens_encoder', {}).keys(), key=len, reverse=True)
+        self.special_pattern = re.compile("|".join(re.escape(text) for text in special_strings)) if special_strings else None
+        self.enabled = True
+        self.enabled = not find_mismatches(self, PROBE_TRIPLES)
+
+    def _assemblable(self, triple: Tuple[str, str, str]) -> bool:
+        return self.special_pattern is None or not any(self.special_pattern.search(field) for field in triple)
+
+    def encode(self, qst: List[str], preds: List[str], gts: List[str], memo: Optional[Dict] = None) -> List[List[int]]:
+        """
+        Token ids of the prompts of a list of samples, identical to tokenizing build_prompt() of each.
+
+        Args:
+            memo: Per-call dict shared between the models being run; field pieces tokenized for one model
+                are reused by the other models of the same tokenizer family.
+        """
+        triples = [(clean_field(q), clean_field(p), clean_field(g)) for q, p, g in zip(qst, preds, gts)]
+        encoded: List[Optional[List[int]]] = [None] * len(triples)
+        assembled = [i for i, triple in enumerate(triples) if self.enabled and self._assemblable(triple)]
+
+        family_memo = memo.setdefault(self.fields.family, {}) if memo is not None else {}
+        missing = [i for i in assembled if triples[i] not in family_memo]
+        for i, field_ids in zip(missing, self.fields.encode([triples[i] for i in missing])):
+            family_memo[triples[i]] = field_ids
+        for i in assembled:
+            encoded[i] = self.prefix_ids + family_memo[triples[i]] + self.suffix_ids
+
+        rest = [i for i in range(len(triples)) if encoded[i] is None]
+        if rest:
+            full_ids = self.tokenizer([build_prompt(*triples[i]) for i in rest])["input_ids"]
+            for i, ids in zip(rest, full_ids):
+                encoded[i] = ids
+        return encoded
+
+
+def find_mismatches(prompt_tokenizer: PromptTokenizer, triples: List[Tuple[str, str, str]]) -> List[int]:
+    """Indices of the triples whose assembled token ids differ from tokenizing the full prompt text."""
+    assembled = prompt_tokenizer.encode([t[0] for t in triples], [t[1] for t in triples], [t[2] for t in triples])
+    expected = prompt_tokenizer.tokenizer([build_prompt(*triple) for triple in triples])["input_ids"]
+    return [i for i, (a, b) in enumerate(zip(assembled, expected)) if a != b]
+
+
+def random_triples(num_triples: int, seed: int = 0) -> List[Tuple[str, str, str]]:
+    """Random (qst, pred, gt) triples of RANDOM_FIELD_PIECES, with leading/trailing spaces and newlines."""
+    rng = random.Random(seed)
+
+    def field() -> str:
+        text = "".join(rng.choice(RANDOM_FIELD_PIECES) + rng.choice(RANDOM_FIELD_SEPARATORS) for _ in range(rng.randint(0, 6)))
+        return rng.choice(RANDOM_FIELD_SEPARATORS) + text + rng.choice(RANDOM_FIELD_SEPARATORS)
+
+    return [(field(), field(), field()) for _ in range(num_triples)]
+
+
+def self_test(num_random: int = 2000, seed: int = 0):
+    """
+    Check, without downloaded weights, that assembled prompt ids equal tokenizing the full prompts token for token:
+    on the byte-level BPE tokenizer of benchmark.build_tiny_model, for PROBE_TRIPLES and num_random random_triples.
+    Raises AssertionError on a mismatch.
+    """
+    from transformers import AutoTokenizer
+    from benchmark import build_tiny_model
+
+    with tempfile.TemporaryDirectory(prefix="l3lite-prompt-tokens-") as model_dir:
+        build_tiny_model(model_dir, seed=seed)
+        prompt_tokenizer = PromptTokenizerRegistry().create(AutoTokenizer.from_pretrained(model_dir))
+    # A disabled tokenizer tokenizes full prompts, which would make the comparison below pass trivially
+    assert prompt_tokenizer.enabled, "The byte-level tokenizer does not assemble PROBE_TRIPLES from pieces"
+    for name, triples in (("PROBE_TRIPLES", PROBE_TRIPLES), ("random triples", random_triples(num_random, seed))):
+        mismatches = find_mismatches(prompt_tokenizer, triples)
+        assert mismatches == [], f"{len(mismatches)} of {len(triples)} {name} differ, e.g. {triples[mismatches[0]]!r}"
+        print(f"{name}: {len(triples)} prompts match token for token.")
+
+
+class PromptTokenizerRegistry:
+    """Creates the PromptTokenizer of every model, sharing one FieldTokenizer per tokenizer family."""
+
+    def __init__(self):
+        self.field_tokenizers: Dict[str, FieldTokenizer] = {}
+        self.lock = threading.Lock() # Models may be loaded from several threads
+
+    def create(self, tokenizer) -> PromptTokenizer:
+        family = tokenizer_family(tokenizer)
+        with self.lock:
+            fields = self.field_tokenizers.setdefault(family, FieldTokenizer(tokenizer, family))
+        return PromptTokenizer(tokenizer, fields)
+
+
+def main():
+    from transformers import AutoTokenizer
+    from L3_Lite import MODEL_PATHS
+
+    parser = argparse.ArgumentParser(description="Check that assembled prompt token ids equal tokenizing the full L3-Lite prompts")
+    parser.add_argument("--model_names", nargs="+", default=list(MODEL_PATHS), help="Models whose tokenizers are checked")
+    parser.add_argument("--result_path", type=str, default=None, help="Results file whose samples are checked in addition to the built-in probes")
+    parser.add_argument("--num_samples", type=int, default=10000, help="Number of samples from the start of the results file to check")
+    parser.add_argument("--self_test", action="store_true", help="Only run self_test: the built-in probes and random samples on a byte-level tokenizer built on the fly")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        return
+
+    triples = list(PROBE_TRIPLES)
+    if args.result_path:
+        for i, item in enumerate(iter_records(args.result_path)):
+            if i >= args.num_samples:
+                break
+            triples.append((clean_field(item.get('question')), clean_field(item.get('pred')), clean_field(item.get('gt'))))
+
+    registry = PromptTokenizerRegistry()
+    failed = False
+    for model_name in args.model_names:
+        prompt_tokenizer = registry.create(AutoTokenizer.from_pretrained(MODEL_PATHS[model_name]))
+        if not prompt_tokenizer.enabled:
+            print(f"{model_name}: prompts cannot be assembled from pieces with this tokenizer, full prompts are tokenized instead.")
+            continue
+        mismatches = find_mismatches(prompt_tokenizer, triples)
+        print(f"{model_name}: {len(triples) - len(mismatches)} of {len(triples)} prompts match token for token "
+              f"(tokenizer family {prompt_tokenizer.fields.family[:12]}).")
+        for i in mismatches[:5]:
+            print(f"  Mismatch: {triples[i]!r}")
+        failed = failed or bool(mismatches)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import json
+import re
+from typing import Callable, Dict, List, Optional
+
+from L3_Lite import normalize_answer
+
+# A scorer takes (pred, gt) and returns a score (percentage, 0-100),
+# or None if it cannot decide and the sample should go to the L3-Lite judge.
+Scorer = Callable[[str, str], Optional[float]]
+
+# Scorers registered for exact question_type names (see register_scorer)
+QUESTION_TYPE_SCORERS: Dict[str, Scorer] = {}
+
+# Absolute tolerance of the numeric scorer; counts have to match exactly by default
+COUNT_TOLERANCE = 0.0
+
+BOOLEAN_WORDS = {'yes': True, 'true': True, 'no': False, 'false': False}
+
+# Location vocabulary of the annotation tool, mapped to one canonical spelling per location
+LOCATION_SYNONYMS = {
+    'upper left': 'upper left', 'top left': 'upper left', 'upper right': 'upper right', 'top right': 'upper right',
+    'bottom left': 'bottom left', 'lower left': 'bottom left', 'bottom right': 'bottom right', 'lower right': 'bottom right',
+    'top': 'top', 'upper': 'top', 'bottom': 'bottom', 'lower': 'bottom', 'left': 'left', 'right': 'right',
+    'center': 'center', 'centre': 'center', 'middle': 'center', 'above': 'above', 'below': 'below',
+}
+# Longest phrases first, so "upper left" is not read as "upper" + "left"
+LOCATION_PATTERN = re.compile(r'\b(' + '|'.join(sorted(LOCATION_SYNONYMS, key=len, reverse=True)) + r')\b')
+
+
+def register_scorer(*question_types: str):
+    """Decorator that registers a scorer for one or more question_type names."""
+    def decorator(scorer: Scorer) -> Scorer:
+        for question_type in question_types:
+            QUESTION_TYPE_SCORERS[question_type] = scorer
+        return scorer
+    return decorator
+
+
+def parse_number(answer) -> Optional[float]:
+    """The single number in an answer ("3", "three cars", "2.5"), or None if it has none or several."""
+    numbers = re.findall(r'-?\d+(?:\.\d+)?', normalize_answer(answer))
+    if len(numbers) != 1:
+        return None
+    return float(numbers[0])
+
+
+def parse_boolean(answer) -> Optional[bool]:
+    """Yes/no value of an answer that starts with yes/no/true/false, otherwise None."""
+    tokens = normalize_answer(answer).split()
+    if not tokens:
+        return None
+    return BOOLEAN_WORDS.get(tokens[0])
+
+
+def parse_locations(answer) -> set:
+    """Set of canonical locations mentioned in an answer ("top left and center" -> {"upper left", "center"})."""
+    return {LOCATION_SYNONYMS[match] for match in LOCATION_PATTERN.findall(normalize_answer(answer))}
+
+
+@register_scorer('counting')
+def score_numeric(pred, gt) -> Optional[float]:
+    """Counting questions: 100 if the predicted number is within COUNT_TOLERANCE of the ground truth, else 0."""
+    gt_number = parse_number(gt)
+    pred_number = parse_number(pred)
+    if gt_number is None or pred_number is None:
+        return None
+    return 100.0 if abs(pred_number - gt_number) <= COUNT_TOLERANCE else 0.0
+
+
+def score_boolean(pred, gt) -> Optional[float]:
+    """Yes/no questions: 100 if both answers have the same yes/no value, else 0."""
+    gt_value = parse_boolean(gt)
+    pred_value = parse_boolean(pred)
+    if gt_value is None or pred_value is None:
+        return None
+    return 100.0 if pred_value == gt_value else 0.0
+
+
+def score_location(pred, gt) -> Optional[float]:
+    """Location-choice questions: overlap (Jaccard index) of the predicted and ground-truth location sets."""
+    gt_locations = parse_locations(gt)
+    pred_locations = parse_locations(pred)
+    if not gt_locations or not pred_locations:
+        return None
+    return 100.0 * len(gt_locations & pred_locations) / len(gt_locations | pred_locations)
+
+
+# Scorers by the names used in a scorer map file (see load_scorer_map)
+SCORERS_BY_NAME: Dict[str, Scorer] = {'numeric': score_numeric, 'boolean': score_boolean, 'location': score_location}
+
+# Opt-in fallback for question types without a registered scorer, matched on words in the question_type name.
+# Only words that name the answer format are listed: cognitive types ("judge whether...", "direction of travel")
+# have free-form answers that these scorers would read only a part of.
+KEYWORD_SCORERS = [
+    (('counting', 'how many'), score_numeric),
+    (('yes/no', 'yes-no', 'yes_no'), score_boolean),
+    (('location choice', 'location_choice'), score_location),
+]
+
+
+def load_scorer_map(path: str):
+    """
+    Register the scorers of a JSON file mapping the dataset's question_type names to scorer names
+    (SCORERS_BY_NAME), e.g. {"counting": "numeric", "existence": "boolean", "relative position": "location"}.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        scorer_map = json.load(f)
+    if not isinstance(scorer_map, dict):
+        raise ValueError(f"{path} must map question types to scorer names")
+    for question_type, scorer_name in scorer_map.items():
+        if scorer_name not in SCORERS_BY_NAME:
+            raise ValueError(f"Unknown scorer for question type {question_type!r}: {scorer_name}, expected one of {sorted(SCORERS_BY_NAME)}")
+        register_scorer(question_type)(SCORERS_BY_NAME[scorer_name])
+
+
+def get_scorer(question_type, match_keywords: bool = False) -> Optional[Scorer]:
+    """
+    Scorer for a question type: a registered one first, otherwise (with match_keywords) by keyword, otherwise
+    None, so that the sample goes to the L3-Lite judge.
+    """
+    if question_type is None:
+        return None
+    if question_type in QUESTION_TYPE_SCORERS:
+        return QUESTION_TYPE_SCORERS[question_type]
+    if not match_keywords:
+        return None
+    name = str(question_type).lower()
+    for keywords, scorer in KEYWORD_SCORERS:
+        if any(keyword in name for keyword in keywords):
+            return scorer
+    return None
+
+
+def apply_question_scorers(question_types: List[str], preds: List[str], gts: List[str],
+                           match_keywords: bool = False) -> List[Optional[float]]:
+    """
+    Score samples with the deterministic scorer of their question type (see get_scorer).
+
+    Returns:
+        One entry per sample: the score (percentage, 0-100), or None if the sample still needs the L3-Lite judge.
+    """
+    scores = []
+    for question_type, pred, gt in zip(question_types, preds, gts):
+        scorer = get_scorer(question_type, match_keywords)
+        scores.append(scorer(pred, gt) if scorer is not None else None)
+    return scores
@@ -0,0 +1,235 @@
+import argparse
+import csv
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from result_io import iter_records
+from column_store import ColumnStore, is_column_store
+
+# Percentiles of the score reported for every group
+DEFAULT_PERCENTILES = [10, 50, 90]
+
+# Scores above this value are counted as 'Semantically Similar'
+VERDICT_THRESHOLD = 50
+
+# Composite slices are written as field names joined by '+', e.g. 'weather+question_type'
+SLICE_SEPARATOR = '+'
+
+
+def load_columns(path: str, fields: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Load the scores of a per-sample output file (written by evaluation.py --output, CSV, JSON Lines or
+    column store) together with the requested metadata fields as NumPy arrays.
+
+    Returns:
+        {'index': int64, 'score': float64, field: str for each field}. Missing values are empty strings.
+    """
+    fields = list(fields)
+    if is_column_store(path):
+        # Only the requested columns are read, straight from the memory-mapped files
+        store = ColumnStore(path)
+        columns = {'index': np.asarray(store.column('index'), dtype=np.int64) if 'index' in store else np.arange(len(store), dtype=np.int64),
+                   'score': np.asarray(store.column('score'), dtype=np.float64)}
+        for field in fields:
+            columns[field] = store.text_array(field)
+        return columns
+    indices: List[int] = []
+    scores: List[float] = []
+    values: Dict[str, List[str]] = {field: [] for field in fields}
+    if path.endswith('.csv'):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = csv.DictReader(f)
+            for row in rows:
+                indices.append(int(row['index']))
+                scores.append(float(row['score']))
+                for field in fields:
+                    values[field].append(row.get(field) or "")
+    else:
+        for row in iter_records(path):
+            indices.append(row['index'])
+            scores.append(row['score'])
+            for field in fields:
+                value = row.get(field)
+                values[field].append("" if value is None else str(value))
+    columns = {'index': np.asarray(indices, dtype=np.int64), 'score': np.asarray(scores, dtype=np.float64)}
+    for field in fields:
+        columns[field] = np.asarray(values[field], dtype=str)
+    return columns
+
+
+def join_metadata(columns: Dict[str, np.ndarray], result_path: str, fields: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Add metadata fields that are not in the output file (e.g. weather or lighting conditions) from the
+    original results file, matched by the sample's position in it.
+    """
+    fields = list(fields)
+    if is_column_store(result_path):
+        store = ColumnStore(result_path)
+        for field in fields:
+            column = store.text_array(field)
+            columns[field] = column[columns['index']] if len(column) else np.full(len(columns['index']), "")
+        return columns
+    values: Dict[str, List[str]] = {field: [] for field in fields}
+    for item in iter_records(result_path):
+        for field in fields:
+            value = item.get(field)
+            values[field].append("" if value is None else str(value))
+    for field in fields:
+        column = np.asarray(values[field], dtype=str)
+        columns[field] = column[columns['index']] if len(column) else np.full(len(columns['index']), "")
+    return columns
+
+
+def group_codes(keys: List[np.ndarray]):
+    """
+    Assign every sample the id of its group, where a group is a unique combination of the key columns.
+
+    Returns:
+        (codes, first) where codes[i] is the group id of sample i (groups sorted by key) and first[g]
+        is the position of one sample of group g, used to look up the group's key values.
+    """
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        _, codes = np.unique(key, return_inverse=True)
+        num_values = int(codes.max()) + 1 if len(codes) else 1
+        combined = combined * num_values + codes.reshape(-1)
+    _, first, codes = np.unique(combined, return_index=True, return_inverse=True)
+    return codes.reshape(-1), first
+
+
+def grouped_stats(codes: np.ndarray, scores: np.ndarray, percentiles: List[float]) -> Dict[str, np.ndarray]:
+    """
+    Count, mean, verdict accuracy and score percentiles of every group, without a Python loop over groups.
+
+    Percentiles use linear interpolation between the closest ranks, like np.percentile's default.
+    """
+    num_groups = int(codes.max()) + 1 if len(codes) else 0
+    counts = np.bincount(codes, minlength=num_groups)
+    stats = {
+        'count': counts,
+        'mean': np.bincount(codes, weights=scores, minlength=num_groups) / counts,
+        'accuracy': np.bincount(codes, weights=(scores > VERDICT_THRESHOLD).astype(np.float64), minlength=num_groups) / counts,
+    }
+    # Sort by group, then by score: every group becomes a contiguous sorted run starting at starts[g]
+    order = np.lexsort((scores, codes))
+    sorted_scores = scores[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100.0)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        stats[f'p{q:g}'] = sorted_scores[low] + (sorted_scores[high] - sorted_scores[low]) * (position - low)
+    return stats
+
+
+def breakdown(columns: Dict[str, np.ndarray], slice_name: str, percentiles: List[float]) -> List[Dict]:
+    """
+    Grouped statistics of one slice, e.g. 'question_type' or 'weather+question_type'.
+
+    Returns:
+        One row per group, sorted by key: the slice's field values followed by the statistics.
+    """
+    fields = slice_name.split(SLICE_SEPARATOR)
+    if not len(columns['score']):
+        return []
+    codes, first = group_codes([columns[field] for field in fields])
+    stats = grouped_stats(codes, columns['score'], percentiles)
+    table = {field: columns[field][first] for field in fields}
+    table.update(stats)
+    # Convert column arrays to rows once, at the end, for export
+    return [dict(zip(table.keys(), values)) for values in zip(*(column.tolist() for column in table.values()))]
+
+
+def build_report(scores_path: str, slices: List[str], result_path: Optional[str] = None,
+                 category_map: Optional[Dict[str, str]] = None,
+                 percentiles: Optional[List[float]] = None) -> Dict[str, List[Dict]]:
+    """
+    Build the breakdown tables of a per-sample output file.
+
+    Args:
+        scores_path: Output file of evaluation.py --output (CSV, JSON Lines or column store).
+        slices: Field names (or composite slices such as 'weather+question_type') to group by.
+            'category' is derived from question_type via category_map.
+        result_path: Original results file, needed for fields that are not in the output file.
+        category_map: Maps question types to categories (e.g. 'cognitive'/'perception').
+        percentiles: Score percentiles to report per group.
+
+    Returns:
+        {'overall': [one row], slice_name: rows} for every slice.
+    """
+    percentiles = DEFAULT_PERCENTILES if percentiles is None else percentiles
+    fields = {field for slice_name in slices for field in slice_name.split(SLICE_SEPARATOR)}
+    if 'category' in fields:
+        if category_map is None:
+            raise ValueError("Slicing by 'category' requires a question type to category map.")
+        fields.discard('category')
+        fields.add('question_type')
+    output_fields = ['image', 'question_type', 'source']
+    columns = load_columns(scores_path, [field for field in output_fields if field in fields])
+    extra_fields = sorted(fields - set(output_fields))
+    if extra_fields:
+        if result_path is None:
+            raise ValueError(f"Fields {extra_fields} are not in {scores_path}; pass the original results file to join them.")
+        columns = join_metadata(columns, result_path, extra_fields)
+    if category_map is not None:
+        # Map through the unique question types instead of sample by sample
+        types, codes = np.unique(columns['question_type'], return_inverse=True)
+        categories = np.asarray([category_map.get(question_type, "other") for question_type in types.tolist()], dtype=str)
+        columns['category'] = categories[codes.reshape(-1)] if len(types) else np.asarray([], dtype=str)
+
+    columns['all'] = np.full(len(columns['score']), "all")
+    report = {'overall': breakdown(columns, 'all', percentiles)}
+    for slice_name in slices:
+        report[slice_name] = breakdown(columns, slice_name, percentiles)
+    for row in report['overall']:
+        row.pop('all')
+    return report
+
+
+def export_report(report: Dict[str, List[Dict]], report_dir: str):
+    """Write every table of the report to <report_dir>/<slice>.csv, and all of them to <report_dir>/report.json."""
+    os.makedirs(report_dir, exist_ok=True)
+    for name, rows in report.items():
+        if not rows:
+            continue
+        with open(os.path.join(report_dir, f"{name}.csv"), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    with open(os.path.join(report_dir, "report.json"), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break L3-Lite scores down by question type, image and condition")
+    parser.add_argument("--scores_path", type=str, required=True, help="Per-sample output of evaluation.py --output (CSV, JSON Lines or .cols column store)")
+    parser.add_argument("--result_path", type=str, default=None, help="Original results file, for slicing by fields that are not in the output file (e.g. weather)")
+    parser.add_argument("--group_by", nargs="+", default=['question_type', 'image'], help="Fields to group by; join fields with '+' for composite slices, e.g. weather+question_type")
+    parser.add_argument("--category_map", type=str, default=None, help="JSON file mapping question types to categories (e.g. cognitive/perception); enables grouping by 'category'")
+    parser.add_argument("--percentiles", nargs="+", type=float, default=DEFAULT_PERCENTILES, help="Score percentiles reported per group")
+    parser.add_argument("--report_dir", type=str, default='report', help="Directory the CSV tables and report.json are written to")
+    args = parser.parse_args()
+
+    category_map = None
+    if args.category_map:
+        with open(args.category_map, 'r', encoding='utf-8') as f:
+            category_map = json.load(f)
+    report = build_report(args.scores_path, args.group_by, result_path=args.result_path,
+                          category_map=category_map, percentiles=args.percentiles)
+    export_report(report, args.report_dir)
+
+    overall = report['overall'][0] if report['overall'] else None
+    if overall is not None:
+        print(f"Number of Samples: {overall['count']}")
+        print(f"Average L3-Lite Score: {overall['mean']:.4f}")
+    for name, rows in report.items():
+        if name != 'overall':
+            print(f"{name}: {len(rows)} groups")
+    print(f"Report written to {args.report_dir}")
+
+
+if __name__ == "__main__":
+    main()
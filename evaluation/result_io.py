@@ -0,0 +1,203 @@
+import csv
+import json
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from column_store import COLUMN_STORE_SUFFIX, ColumnStore, ColumnStoreWriter, is_column_store
+
+# Characters read from the result file per step by the incremental JSON array reader
+READ_BLOCK_SIZE = 1 << 20
+
+# Default number of records evaluated together when streaming a result file
+DEFAULT_CHUNK_SIZE = 4096
+
+# Rows buffered by ResultWriter before they are written out
+DEFAULT_WRITE_BUFFER = 1000
+
+# Fields of a result record used by evaluation.py; column stores only read these
+RECORD_FIELDS = ['image', 'question_type', 'question', 'pred', 'gt']
+
+# Columns of the per-sample output; JSON Lines output also keeps the per-model 'models' dict
+OUTPUT_FIELDS = ['index', 'image', 'question_type', 'question', 'pred', 'gt', 'score', 'p_one', 'p_zero', 'fallback', 'escalated', 'source']
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """Yield the records of a JSON Lines file, one per non-empty line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_json_array(path: str) -> Iterator[Dict]:
+    """
+    Yield the elements of a top-level JSON array one at a time.
+
+    The file is read in blocks and decoded element by element, so memory use depends on the size
+    of one record, not of the whole file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill() -> bool:
+            nonlocal buffer, position, eof
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                eof = True
+                return False
+            buffer = buffer[position:] + block # Drop what was already decoded
+            position = 0
+            return True
+
+        def skip(characters: str):
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in characters:
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return
+
+        skip(" \t\r\n")
+        if position >= len(buffer) or buffer[position] != "[":
+            raise ValueError(f"{path} does not contain a JSON array.")
+        position += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if position >= len(buffer):
+                raise ValueError(f"Unexpected end of file in {path}, the JSON array is not closed.")
+            if buffer[position] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element continues in the next block
+                if fill():
+                    continue
+                raise
+            if end == len(buffer) and not eof and fill():
+                # A value that ends exactly at the block boundary (e.g. a number) may continue in the next block
+                continue
+            position = end
+            yield record
+
+
+def iter_records(path: str, fields: Optional[Iterable[str]] = None) -> Iterator[Dict]:
+    """
+    Yield the result records of a JSON (array) or JSON Lines file, or of a column store, without loading the whole file.
+
+    Files ending in .jsonl are read as JSON Lines; other files are read as a JSON array if they start with '['
+    and as JSON Lines otherwise. Column store directories (see column_store.py) are memory-mapped and, if
+    fields is given, only those columns are read; JSON records always have all their fields.
+    """
+    if is_column_store(path):
+        return ColumnStore(path).iter_records(fields)
+    if path.endswith('.jsonl'):
+        return iter_jsonl(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(READ_BLOCK_SIZE).lstrip()[:1]
+    return iter_json_array(path) if first == "[" else iter_jsonl(path)
+
+
+def iter_chunks(items: Iterable, chunk_size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most chunk_size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def make_output_row(index: int, record: Dict, details: Dict) -> Dict:
+    """
+    Build the output row of one sample from its result record and its L3Lite.evaluate details.
+
+    p_one/p_zero are averaged over the judge models, fallback is set if any model's score was parsed
+    from generated text, and source tells how the score was obtained (also for samples resumed from a journal).
+    """
+    models = details.get("models", {})
+    if details.get("exact_match"):
+        source = "exact_match"
+    elif details.get("type_scorer"):
+        source = "type_scorer"
+    elif details.get("prefilter"):
+        source = "prefilter"
+    else:
+        source = "judge"
+    return {
+        "index": index,
+        "image": record.get("image"),
+        "question_type": record.get("question_type"),
+        "question": record.get("question"),
+        "pred": record.get("pred"),
+        "gt": record.get("gt"),
+        "score": float(details["score"]),
+        "p_one": sum(m["p_one"] for m in models.values()) / len(models) if models else None,
+        "p_zero": sum(m["p_zero"] for m in models.values()) / len(models) if models else None,
+        "fallback": any(m.get("fallback", False) for m in models.values()),
+        "escalated": details.get("escalated"), # Only set by a cascade of judges
+        "source": source,
+        "models": models,
+    }
+
+
+class ResultWriter:
+    """
+    Buffered writer of per-sample output rows (see make_output_row).
+
+    Writes CSV if the path ends in .csv, a column store (see column_store.py) if it ends in .cols and
+    JSON Lines otherwise. Rows are buffered and written buffer_size at a time, so large runs do not pay
+    for one write per sample.
+    """
+
+    def __init__(self, path: str, buffer_size: int = DEFAULT_WRITE_BUFFER):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer: List[Dict] = []
+        self.file = None
+        self.csv_writer: Optional[csv.DictWriter] = None
+        self.store_writer: Optional[ColumnStoreWriter] = None
+        if path.endswith(COLUMN_STORE_SUFFIX):
+            self.store_writer = ColumnStoreWriter(path)
+            return
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        if path.endswith('.csv'):
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=OUTPUT_FIELDS, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+    def write(self, row: Dict):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.store_writer is not None:
+            for row in self.buffer:
+                self.store_writer.write(row)
+            self.buffer = []
+            return
+        if self.csv_writer is not None:
+            self.csv_writer.writerows(self.buffer)
+        else:
+            self.file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in self.buffer))
+        self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.store_writer is not None:
+            self.store_writer.close()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
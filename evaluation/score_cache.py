@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+# Weight and config files that identify a set of local model weights
+WEIGHT_FILE_SUFFIXES = ('.safetensors', '.bin', '.pt', '.json')
+
+# Seconds to wait for another process's write lock on the cache file
+SQLITE_TIMEOUT = 60.0
+
+# Number of keys looked up per SELECT (SQLite limits the number of bound parameters)
+LOOKUP_CHUNK_SIZE = 500
+
+
+def weights_fingerprint(model_path: str) -> str:
+    """
+    Identify a set of local model weights without hashing gigabytes of data.
+
+    Uses the name, size and modification time of every weight/config file in the model directory,
+    so replacing or re-downloading the weights gives a new fingerprint.
+    """
+    entries = []
+    if os.path.isdir(model_path):
+        for file_name in sorted(os.listdir(model_path)):
+            if not file_name.endswith(WEIGHT_FILE_SUFFIXES):
+                continue
+            stat = os.stat(os.path.join(model_path, file_name))
+            entries.append((file_name, stat.st_size, int(stat.st_mtime)))
+    return hashlib.sha256(json.dumps([os.path.abspath(model_path), entries]).encode('utf-8')).hexdigest()
+
+
+def weights_size(model_path: str) -> int:
+    """Total size in bytes of the weight files in a model directory (a proxy for the model's parameter count)."""
+    if not os.path.isdir(model_path):
+        return 0
+    return sum(os.path.getsize(os.path.join(model_path, file_name)) for file_name in os.listdir(model_path)
+               if file_name.endswith(WEIGHT_FILE_SUFFIXES) and not file_name.endswith('.json'))
+
+
+def sample_key(judge_identity: str, qst: str, pred: str, gt: str) -> str:
+    """Cache key of one (question, pred, gt) triple scored by the judge described by judge_identity."""
+    # Basic cleaning of inputs, the same way L3Lite.create_prompt does
+    fields = [judge_identity] + [str(x) if x is not None else "" for x in (qst, pred, gt)]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ScoreCache:
+    """
+    Persistent on-disk cache of per-model L3-Lite scores, stored in a SQLite file.
+
+    Each entry maps a sample key (see sample_key) to the (score_one, score_zero) percentages a judge model
+    gave that sample and whether they were parsed from generated text, so re-runs over the same results
+    only score new triples.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Several worker processes may share one cache file, so wait for locks instead of failing
+        # Ensemble members scored on separate threads share this object, so access is serialized with a lock
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score_one REAL NOT NULL, score_zero REAL NOT NULL,"
+            " fallback INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Cache files written before the fallback flag was recorded
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(scores)")]
+        if "fallback" not in columns:
+            self.connection.execute("ALTER TABLE scores ADD COLUMN fallback INTEGER NOT NULL DEFAULT 0")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[float, float, bool]]:
+        """Look up many keys at once. Returns only the keys found in the cache."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for start in range(0, len(unique_keys), LOOKUP_CHUNK_SIZE):
+                chunk = unique_keys[start:start + LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, score_one, score_zero, fallback FROM scores WHERE key IN ({placeholders})", chunk
+                )
+                for key, score_one, score_zero, fallback in rows:
+                    found[key] = (score_one, score_zero, bool(fallback))
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items: List[Tuple[str, Tuple[float, float, bool]]]):
+        """Store (key, (score_one, score_zero, fallback)) pairs and commit them."""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores (key, score_one, score_zero, fallback) VALUES (?, ?, ?, ?)",
+                [(key, float(score_one), float(score_zero), int(fallback)) for key, (score_one, score_zero, fallback) in items]
+            )
+            self.connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counts of all lookups made through this cache object."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
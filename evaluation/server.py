@@ -0,0 +1,354 @@
+import argparse
+import http.client
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from L3_Lite import L3Lite, SCORING_MODES, DEFAULT_MAX_BATCH_TOKENS, DTYPE_POLICIES
+from model_registry import load_model_registry
+from judge_backends import BACKENDS, DEFAULT_ONNX_DIR
+
+# Longest time the first request of a micro-batch waits for others to join it
+DEFAULT_MAX_WAIT_MS = 10.0
+
+# Micro-batches are closed early once they hold this many samples
+DEFAULT_MAX_BATCH_SAMPLES = 256
+
+# Number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+
+
+class _PendingRequest:
+    """One client request waiting in the micro-batch queue."""
+
+    def __init__(self, qst: List[str], preds: List[str], gts: List[str]):
+        self.qst = qst
+        self.preds = preds
+        self.gts = gts
+        self.arrival = time.monotonic()
+        self.done = threading.Event()
+        self.details: Optional[List[Dict]] = None
+        self.error: Optional[str] = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into micro-batches for one resident L3Lite.
+
+    A single scoring thread takes the oldest request, waits at most max_wait_ms for more requests
+    (or until max_batch_samples samples are queued), scores them with one L3Lite.evaluate call and
+    hands every request its slice of the results. Requests are never split across batches.
+    """
+
+    def __init__(self, l3_lite: L3Lite, max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 max_batch_samples: int = DEFAULT_MAX_BATCH_SAMPLES):
+        self.l3_lite = l3_lite
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_samples = max_batch_samples
+        self.queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self.num_requests = 0
+        self.num_samples = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="l3lite-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, qst: List[str], preds: List[str], gts: List[str]) -> List[Dict]:
+        """Queue a request and block until it is scored. Returns detail dicts (see L3Lite.evaluate)."""
+        request = _PendingRequest(qst, preds, gts)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.details
+
+    def _collect(self, first: _PendingRequest) -> List[_PendingRequest]:
+        """Gather requests into a batch until the deadline of the first request or the sample limit."""
+        batch = [first]
+        num_samples = len(first.preds)
+        deadline = first.arrival + self.max_wait
+        while num_samples < self.max_batch_samples:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None) # Let the main loop see the stop signal after this batch
+                break
+            batch.append(request)
+            num_samples += len(request.preds)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            qst = [q for request in batch for q in request.qst]
+            preds = [p for request in batch for p in request.preds]
+            gts = [g for request in batch for g in request.gts]
+            try:
+                details = self.l3_lite.evaluate(qst, preds, gts, return_details=True) if preds else []
+                error = None
+            except Exception as e:
+                details, error = None, f"{type(e).__name__}: {e}"
+
+            finished = time.monotonic()
+            start = 0
+            for request in batch:
+                end = start + len(request.preds)
+                if error is None:
+                    request.details = details[start:end]
+                else:
+                    request.error = error
+                start = end
+                request.done.set()
+            with self.lock:
+                self.num_batches += 1
+                self.num_requests += len(batch)
+                self.num_samples += len(preds)
+                self.num_errors += len(batch) if error is not None else 0
+                self.batch_sizes.append(len(preds))
+                self.latencies.extend(finished - request.arrival for request in batch)
+
+    def stats(self) -> Dict:
+        """Queue depth, throughput counters and request latency percentiles (milliseconds) over the recent window."""
+        with self.lock:
+            latencies = np.asarray(self.latencies, dtype=np.float64) * 1000.0
+            batch_sizes = np.asarray(self.batch_sizes, dtype=np.float64)
+            stats = {
+                "queue_depth": self.queue.qsize(),
+                "uptime_s": time.monotonic() - self.start_time,
+                "requests": self.num_requests,
+                "samples": self.num_samples,
+                "batches": self.num_batches,
+                "errors": self.num_errors,
+                "mean_batch_samples": float(batch_sizes.mean()) if len(batch_sizes) else 0.0,
+            }
+        for q in (50, 90, 99):
+            stats[f"latency_p{q}_ms"] = float(np.percentile(latencies, q)) if len(latencies) else 0.0
+        if self.l3_lite.score_cache is not None:
+            stats["score_cache"] = self.l3_lite.score_cache.stats()
+        if self.l3_lite.metrics.enabled:
+            stats["judge"] = self.l3_lite.get_metrics()
+        return stats
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the scoring server:
+        POST /score  {"qst": [...], "preds": [...], "gts": [...], "details": false} -> {"scores": [...]} or {"details": [...]}
+        GET  /stats  -> MicroBatcher.stats()
+        GET  /health -> {"status": "ok"}
+    """
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.batcher.stats())
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            qst, preds, gts = request["qst"], request["preds"], request["gts"]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        if not (len(qst) == len(preds) == len(gts)):
+            self._send_json(400, {"error": f"Mismatch in the number of questions, predictions, and ground truths ({len(qst)}, {len(preds)}, {len(gts)})."})
+            return
+        try:
+            details = self.server.batcher.submit(qst, preds, gts)
+        except RuntimeError as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        if request.get("details"):
+            self._send_json(200, {"details": details})
+        else:
+            self._send_json(200, {"scores": [float(d["score"]) for d in details]})
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ThreadingHTTPServer counterpart listening on a Unix domain socket."""
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def make_server(batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8765,
+                socket_path: Optional[str] = None, verbose: bool = False):
+    """Create the HTTP server, on a Unix socket if socket_path is given and on host:port otherwise."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path) # Left over from a previous server
+        server = ThreadingUnixHTTPServer(socket_path, ScoringRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringRequestHandler)
+        server.daemon_threads = True
+    server.batcher = batcher
+    server.verbose = verbose
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ScoringClient:
+    """
+    Minimal client of the scoring server. evaluate() has the signature of L3Lite.evaluate, so a client
+    can be used wherever an evaluator is expected (e.g. evaluation.py --server).
+    """
+
+    def __init__(self, address: str, timeout: Optional[float] = None):
+        """
+        Args:
+            address: 'host:port' of an HTTP server, or the path of a Unix socket ('unix:/path' or any path containing '/').
+            timeout: Socket timeout in seconds (None waits indefinitely).
+        """
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix:") or "/" in self.address:
+            return _UnixHTTPConnection(self.address[len("unix:"):] if self.address.startswith("unix:") else self.address, timeout=self.timeout)
+        host, _, port = self.address.rpartition(":")
+        return http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        connection = self._connection()
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            result = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Scoring server error {response.status}: {result.get('error')}")
+        return result
+
+    def evaluate(self, qst: List[str], preds: List[str], gts: List[str], return_details: bool = False) -> List:
+        if not preds:
+            return []
+        result = self._request("POST", "/score", {"qst": qst, "preds": preds, "gts": gts, "details": return_details})
+        return result["details"] if return_details else result["scores"]
+
+    def stats(self) -> Dict:
+        return self._request("GET", "/stats")
+
+    def health(self) -> bool:
+        try:
+            return self._request("GET", "/health").get("status") == "ok"
+        except (OSError, RuntimeError):
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve L3-Lite scoring over HTTP with resident models and micro-batching")
+    parser.add_argument("--model_names", nargs="+", default=['Qwen2.5-3B-Instruct'], help="List of model names to use")
+    parser.add_argument("--device", type=str, default='cuda:3', help="Device to run on")
+    parser.add_argument("--host", type=str, default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--socket_path", type=str, default=None, help="Listen on this Unix socket instead of host:port")
+    parser.add_argument("--max_wait_ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="Longest time a request waits for others to share its micro-batch")
+    parser.add_argument("--max_batch_samples", type=int, default=DEFAULT_MAX_BATCH_SAMPLES, help="Close a micro-batch early once it holds this many samples")
+    parser.add_argument("--scoring_mode", type=str, default='logits', choices=SCORING_MODES, help="See evaluation.py")
+    parser.add_argument("--max_batch_tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS, help="See evaluation.py")
+    parser.add_argument("--no_prefix_cache", action="store_true", help="See evaluation.py")
+    parser.add_argument("--free_fallback", action="store_true", help="See evaluation.py")
+    parser.add_argument("--cache_path", type=str, default=None, help="Persistent score cache (SQLite file)")
+    parser.add_argument("--exact_match", action="store_true", help="Score normalized exact matches as 100 without running the models")
+    parser.add_argument("--dtype", type=str, default='auto', choices=DTYPE_POLICIES, help="See evaluation.py")
+    parser.add_argument("--quantize", action="store_true", help="See evaluation.py")
+    parser.add_argument("--backend", type=str, default='transformers', choices=BACKENDS, help="See evaluation.py")
+    parser.add_argument("--onnx_dir", type=str, default=DEFAULT_ONNX_DIR, help="See evaluation.py")
+    parser.add_argument("--cascade_threshold", type=float, default=None, help="See evaluation.py")
+    parser.add_argument("--concurrent_models", action="store_true", help="See evaluation.py")
+    parser.add_argument("--model_config", type=str, default=None, help="See evaluation.py")
+    parser.add_argument("--ram_budget_mb", type=float, default=None, help="See evaluation.py")
+    parser.add_argument("--metrics", action="store_true", help="Collect per-stage timings and counters of the judge, reported under 'judge' in /stats")
+    parser.add_argument("--verbose", action="store_true", help="Log every HTTP request and batch")
+    args = parser.parse_args()
+
+    l3_lite = L3Lite(model_names=args.model_names, device=args.device, scoring_mode=args.scoring_mode,
+                     max_batch_tokens=args.max_batch_tokens, use_prefix_cache=not args.no_prefix_cache,
+                     constrained_fallback=not args.free_fallback, cache_path=args.cache_path,
+                     exact_match_shortcut=args.exact_match, dtype=args.dtype, quantize=args.quantize,
+                     backend=args.backend, onnx_dir=args.onnx_dir,
+                     cascade_threshold=args.cascade_threshold, concurrent_models=args.concurrent_models,
+                     ram_budget_mb=args.ram_budget_mb,
+                     model_registry=load_model_registry(args.model_config) if args.model_config else None,
+                     verbose=args.verbose, metrics=args.metrics)
+    l3_lite.load_models() # Keep the first request from paying for the model loading
+    batcher = MicroBatcher(l3_lite, max_wait_ms=args.max_wait_ms, max_batch_samples=args.max_batch_samples)
+    server = make_server(batcher, host=args.host, port=args.port, socket_path=args.socket_path, verbose=args.verbose)
+    # Shut down cleanly (and remove the socket file) when stopped by a job scheduler
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"L3-Lite server listening on {args.socket_path or f'{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if args.socket_path and os.path.exists(args.socket_path):
+            os.unlink(args.socket_path)
+
+
+if __name__ == "__main__":
+    main()